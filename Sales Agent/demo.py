@@ -1,10 +1,10 @@
 # Demo script for Sales Agent
 
-from services import classify_sales_intent
-from agents import SalesRouter
-import time
+from sales_services import classify_sales_intent_async
+from sales_agents import SalesRouter
+import asyncio
 
-def run_demo():
+async def run_demo():
     router = SalesRouter()
     
     test_messages = [
@@ -21,14 +21,14 @@ def run_demo():
     for msg in test_messages:
         print(f"\nCustomer: {msg}")
         
-        intent = classify_sales_intent(msg)
+        intent = await classify_sales_intent_async(msg)
         print(f"Classified Intent: {intent}")
         
-        agent_name, response = router.route(intent, msg)
+        _, agent_name, response, _ = await router.route(intent, msg)
         print(f"Agent: {agent_name}")
         print(f"Response: {response[:150]}...") # Truncate for display
         
-        time.sleep(1)
+        await asyncio.sleep(1)
 
 if __name__ == "__main__":
-    run_demo()
+    asyncio.run(run_demo())
@@ -1,11 +1,33 @@
 # FastAPI backend for Sales Agent
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from services import classify_sales_intent, get_sales_context, text_to_speech
-from agents import SalesRouter
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.background import BackgroundTask
+from sales_services import (
+    classify_sales_intent_async, classify_sales_intents_batch_async, sales_intent_classifier, sales_intent_batcher, get_sales_context_async, text_to_speech_async, stream_text_to_speech, tts_backend, close_http_clients,
+    sales_response_cache, sales_context_cache, sales_prompt_budget, register_warm_up, run_stage, PARALLEL_PIPELINE, CLASSIFY_TIMEOUT_SECONDS, CONTEXT_TIMEOUT_SECONDS
+)
+from log_store import create_log_store, parse_timestamp
+from sessions import create_session_store
+from shared_state import get_shared_store
+from cost_tracker import start_request_usage, create_usage_aggregates
+from http_client import http_client_stats
+from metrics import registry, REQUEST_SECONDS, start_trace, install_trace_logging
+from warmup import create_warm_up
+from admission import AdmissionRejected, create_admission_controller
+from cpu_pool import run_cpu, start_cpu_pool, shutdown_cpu_pool, stats as cpu_pool_stats
+from batch import BatchItemError, parse_batch_body, run_batch, MIN_CONCURRENCY, MAX_CONCURRENCY
+from sales_agents import SalesRouter
+import asyncio
+import json
 import logging
+import os
+import time
+from collections import Counter
 from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import Optional
 
 
 logging.basicConfig(
@@ -13,25 +35,91 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+install_trace_logging()
+
+
+warm_up = create_warm_up()
+register_warm_up(warm_up)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Nothing upstream is touched at import; SDK imports and connections are warmed in the
+    background once the server is accepting requests, and released on shutdown
+    """
+    # Forked before warm-up starts any threads
+    start_cpu_pool()
+    warm_up.start()
+    # Pick up models retrained by other workers without a file check on the request path
+    watchers = [asyncio.create_task(classifier.watch()) for classifier in [sales_intent_classifier] if classifier.model_path]
+    yield
+    for watcher in watchers:
+        watcher.cancel()
+    await warm_up.cancel()
+    shutdown_cpu_pool()
+    await asyncio.to_thread(interaction_log.close)
+    await close_http_clients()
 
 
 app = FastAPI(
     title="AI Sales Support Agent",
     description="Specialized AI agent for sales inquiries",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
-interaction_log = []
+interaction_log = create_log_store("sales_interactions")
+
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+RETRAIN_MAX_ENTRIES = int(os.getenv("RETRAIN_MAX_ENTRIES", "50000"))
+
+
+sessions = create_session_store("sales_sessions")
+usage_aggregates = create_usage_aggregates()
+admission = create_admission_controller()
+
+
+for name, source in (
+    ("response_cache", sales_response_cache), ("context_cache", sales_context_cache), ("audio_cache", getattr(tts_backend, "cache", None)),
+    ("classifier", sales_intent_classifier), ("micro_batch", sales_intent_batcher), ("sessions", sessions), ("prompt", sales_prompt_budget), ("interaction_log", interaction_log), ("warmup", warm_up), ("admission", admission), ("shared_state", get_shared_store())
+):
+    if source is not None:
+        registry.register_stats(name, source.stats)
+registry.register_stats("cpu_pool", cpu_pool_stats)
+registry.register_stats("http", http_client_stats)
+
+
+@app.middleware("http")
+async def trace_and_time(request: Request, call_next):
+    """Give each request a trace ID (the caller's X-Request-ID if sent) and time it to its response headers"""
+    trace_id = start_trace(request.headers.get("x-request-id"))
+    started = time.perf_counter()
+    response = await call_next(request)
+    path = request.url.path if response.status_code != 404 else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - started, path=path, status=response.status_code)
+    response.headers["X-Request-ID"] = trace_id
+    return response
+
+
+@app.exception_handler(AdmissionRejected)
+async def shed_request(request: Request, exc: AdmissionRejected) -> JSONResponse:
+    """Load shedding: 429 with Retry-After, answered before any upstream call"""
+    return JSONResponse(status_code=429, content={"detail": str(exc), "reason": exc.reason}, headers={"Retry-After": exc.retry_after_header})
 
 
 router = SalesRouter()
 
 
+ANONYMOUS_CUSTOMER_ID = "demo_customer"
+
+
 class CustomerMessage(BaseModel):
     """Customer message request"""
     message: str
-    customer_id: str = "demo_customer"
+    customer_id: str = ANONYMOUS_CUSTOMER_ID
 
 
 class AgentResponse(BaseModel):
@@ -39,6 +127,8 @@ class AgentResponse(BaseModel):
     agent_type: str
     response: str
     context_used: str
+    cost_estimate: float
+    usage: dict
 
 
 class InteractionLog(BaseModel):
@@ -51,20 +141,69 @@ class InteractionLog(BaseModel):
     context: str
 
 
+async def admit(msg: CustomerMessage):
+    """
+    Admission ticket for a message, prioritized by the local classifier's guess at its
+    intent (classifying upstream is what the queue protects). Anonymous traffic has no
+    customer bucket of its own.
+    """
+    local = sales_intent_classifier.classify(msg.message)
+    customer_id = msg.customer_id if msg.customer_id != ANONYMOUS_CUSTOMER_ID else None
+    return await admission.acquire(customer_id, local[0] if local else None)
+
+
+async def classify_and_fetch_context(message: str, customer_id: Optional[str] = None) -> tuple:
+    """
+    Run classification and context retrieval (concurrently in pipeline mode), each with
+    its own timeout. Follow-ups in a known customer's session keep the previous intent
+    and, while it is still fresh, the previous context, skipping those upstream calls.
+    """
+    session = await sessions.get_async(customer_id) if customer_id and customer_id != ANONYMOUS_CUSTOMER_ID else None
+    intent = sessions.sticky_intent(session, message, sales_intent_classifier.classify)
+    context = sessions.reusable_context(session) if intent else None
+    if intent:
+        logger.info(f"Follow-up from {customer_id}: keeping intent {intent}")
+
+    stages = {}
+    if intent is None:
+        stages["intent"] = run_stage("classification", classify_sales_intent_async(message), CLASSIFY_TIMEOUT_SECONDS, "other")
+    if context is None:
+        stages["context"] = run_stage("context", get_sales_context_async(message), CONTEXT_TIMEOUT_SECONDS, "")
+    if PARALLEL_PIPELINE:
+        results = await asyncio.gather(*stages.values())
+    else:
+        results = [await stage for stage in stages.values()]
+    resolved = dict(zip(stages, results))
+    intent = resolved.get("intent", intent)
+    context = resolved.get("context", context)
+    logger.info(f"Classified as: {intent}")
+    return intent, context
+
+
+async def record_turn(msg: CustomerMessage, intent: str, response: str, context: str) -> None:
+    if msg.customer_id != ANONYMOUS_CUSTOMER_ID:
+        await sessions.record_async(msg.customer_id, msg.message, response, intent, context)
+
+
+def finish_usage(usage, intent: str, customer_id: str, new_request: bool = True) -> dict:
+    """Price the request's upstream calls and add them to the rolling per-agent/customer totals"""
+    summary = usage.summary()
+    usage_aggregates.record(intent, customer_id, summary, new_request)
+    return summary
+
+
 @app.post("/chat", response_model=AgentResponse)
 async def chat(msg: CustomerMessage) -> AgentResponse:
+    ticket = await admit(msg)
     try:
+        usage = start_request_usage()
         logger.info(f"Received: {msg.message[:50]}...")
         
-        intent = classify_sales_intent(msg.message)
-        logger.info(f"Classified as: {intent}")
+        intent, context = await classify_and_fetch_context(msg.message, msg.customer_id)
         
-        agent_name, response = router.route(intent, msg.message)
+        intent, agent_name, response, context = await router.route(intent, msg.message, context)
         logger.info(f"Generated response from {agent_name}")
-        
-        # Consistent with Billing Agent, fetch context mainly for response metadata 
-        # (Router fetches it internally too, but doesn't pass it back directly in current design)
-        context = get_sales_context(msg.message)
+        usage_summary = finish_usage(usage, intent, msg.customer_id)
         
         log_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -72,20 +211,155 @@ async def chat(msg: CustomerMessage) -> AgentResponse:
             "customer_message": msg.message,
             "agent_type": intent,
             "response": response,
-            "context": context[:200]
+            "context": context[:200],
+            "usage": usage_summary
         }
         interaction_log.append(log_entry)
+        await record_turn(msg, intent, response, context)
         
         return AgentResponse(
             agent_type=intent,
             response=response,
-            context_used=context[:200]
+            context_used=context[:200],
+            cost_estimate=usage_summary["total_cost"],
+            usage=usage_summary
         )
     
     except Exception as e:
         logger.error(f"Error in /chat: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    finally:
+        admission.release(ticket)
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(msg: CustomerMessage) -> StreamingResponse:
+    """
+    Server-Sent Events version of /chat: a `meta` event with agent type and context,
+    `token` events as the response is generated, then a `done` event with timing
+    """
+    ticket = await admit(msg)
+
+    async def events():
+        started = time.perf_counter()
+        usage = start_request_usage()
+        logger.info(f"Stream request received: {msg.message[:50]}...")
+
+        intent, context = await classify_and_fetch_context(msg.message, msg.customer_id)
+        agent = router.select(intent)
+        routed_ms = (time.perf_counter() - started) * 1000
+        yield sse_event("meta", {"agent_type": intent, "agent_name": agent.name, "context_used": context[:200]})
+
+        chunks = []
+        first_token_ms = None
+        async for chunk in agent.stream(msg.message, context):
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            chunks.append(chunk)
+            yield sse_event("token", {"text": chunk})
+
+        response = "".join(chunks)
+        await record_turn(msg, intent, response, context)
+        usage_summary = finish_usage(usage, intent, msg.customer_id)
+        interaction_log.append({
+            "timestamp": datetime.now().isoformat(),
+            "customer_id": msg.customer_id,
+            "customer_message": msg.message,
+            "agent_type": intent,
+            "response": response,
+            "context": context[:200],
+            "usage": usage_summary
+        })
+        yield sse_event("done", {
+            "cost_estimate": usage_summary["total_cost"], "usage": usage_summary, "timing_ms": {
+                "routing": round(routed_ms, 1),
+                "first_token": round(first_token_ms or 0.0, 1),
+                "total": round((time.perf_counter() - started) * 1000, 1)
+            }
+        })
+
+    # The background task also frees the slot if the client leaves before the stream starts
+    return StreamingResponse(
+        admission.holding(ticket, events()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+        background=BackgroundTask(admission.release, ticket)
+    )
+
+
+@app.post("/chat/batch")
+async def chat_batch(request: Request, concurrency: int = Query(8, ge=MIN_CONCURRENCY, le=MAX_CONCURRENCY)) -> StreamingResponse:
+    """
+    Bulk /chat for replays and backfills. The body is NDJSON (one CustomerMessage per
+    line) or a JSON list. Results stream back as NDJSON in input order, one line per
+    item, each with its `index` and either the response fields or an `error`.
+    """
+    try:
+        raw_items, body_concurrency = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body: {e}")
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} items")
+
+    items = []
+    for raw in raw_items:
+        if isinstance(raw, BatchItemError):
+            items.append(raw)
+            continue
+        try:
+            msg = CustomerMessage(**raw) if isinstance(raw, dict) else CustomerMessage(message=str(raw))
+            items.append((msg.customer_id, msg.message))
+        except ValidationError as e:
+            items.append(BatchItemError(f"Invalid message: {e.errors()[0]['msg']}"))
+    logger.info(f"Batch request received: {len(items)} items")
+
+    async def results():
+        # Batched classification is shared by all unique messages. Each unique message's
+        # context fetch and generation run in its own task and are accounted there, then
+        # split between the items that sent that message.
+        batch_usage = start_request_usage()
+        item_usage = {}
+        copies = Counter(item[1] for item in items if not isinstance(item, BatchItemError))
+        shared_cost = None
+
+        async def fetch(message: str) -> str:
+            item_usage[message] = start_request_usage()
+            return await get_sales_context_async(message)
+
+        async for index, item, result in run_batch(
+            items, classify_sales_intents_batch_async, fetch, router.route, concurrency=body_concurrency or concurrency,
+            # Each unique message takes its own slot (and provider tokens) at the lowest
+            # priority, so backfills yield to interactive traffic
+            admit=lambda: admission.admit(None, "batch")
+        ):
+            if "error" not in result:
+                customer_id, message = item
+                if shared_cost is None:
+                    # A generated item means classification, the only shared call, has finished
+                    shared_cost = batch_usage.summary()["total_cost"] / len(copies)
+                usage_summary = item_usage[message].summary(shared_cost=shared_cost, share=1 / copies[message])
+                # The shares of duplicates add up to one charge for the unique generation
+                usage_aggregates.record(result["agent_type"], customer_id, usage_summary)
+                result["cost_estimate"] = usage_summary["total_cost"]
+                result["usage"] = usage_summary
+                interaction_log.append({
+                    "timestamp": datetime.now().isoformat(),
+                    "customer_id": customer_id,
+                    "customer_message": message,
+                    "agent_type": result["agent_type"],
+                    "response": result["response"],
+                    "context": result["context_used"],
+                    "usage": usage_summary
+                })
+            yield json.dumps({"index": index, **result}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 
 @app.post("/voice")
 async def voice_chat(msg: CustomerMessage) -> dict:
@@ -97,35 +371,197 @@ async def voice_chat(msg: CustomerMessage) -> dict:
         
         response = await chat(msg)
         
-        tts_result = text_to_speech(response.response)
+        tts_usage = start_request_usage()
+        tts_result = await text_to_speech_async(response.response)
+        tts_summary = finish_usage(tts_usage, response.agent_type, msg.customer_id, new_request=False)
         
         return {
             "text_response": response.response,
             "agent_type": response.agent_type,
             "audio_available": tts_result["success"],
-            "audio_message": tts_result["message"]
+            "audio_message": tts_result["message"],
+            "cost_estimate": round(response.cost_estimate + tts_summary["total_cost"], 8),
+            "usage": {"chat": response.usage, "tts": tts_summary}
         }
     
+    except AdmissionRejected:
+        raise
+
     except Exception as e:
         logger.error(f"Error in /voice: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/voice/stream")
+async def voice_stream(msg: CustomerMessage) -> StreamingResponse:
+    """
+    Streaming voice endpoint: audio is synthesized sentence by sentence while the
+    response is still generating and streamed back in order as one audio body
+    """
+    ticket = await admit(msg)
+    usage = start_request_usage()
+    logger.info(f"Voice stream request received: {msg.message[:50]}...")
+    try:
+        intent, context = await classify_and_fetch_context(msg.message, msg.customer_id)
+        agent = router.select(intent)
+    except BaseException:
+        admission.release(ticket)
+        raise
+
+    async def audio():
+        chunks = []
+
+        async def text():
+            async for chunk in agent.stream(msg.message, context):
+                chunks.append(chunk)
+                yield chunk
+
+        async for _, audio_chunk in stream_text_to_speech(text()):
+            yield audio_chunk
+
+        await record_turn(msg, intent, "".join(chunks), context)
+        usage_summary = finish_usage(usage, intent, msg.customer_id)
+        interaction_log.append({
+            "timestamp": datetime.now().isoformat(),
+            "customer_id": msg.customer_id,
+            "customer_message": msg.message,
+            "agent_type": intent,
+            "response": "".join(chunks),
+            "context": context[:200],
+            "usage": usage_summary
+        })
+
+    return StreamingResponse(
+        admission.holding(ticket, audio()),
+        media_type=tts_backend.media_type,
+        headers={"X-Agent-Type": intent, "X-Agent-Name": agent.name},
+        background=BackgroundTask(admission.release, ticket)
+    )
+
+
 @app.get("/logs")
-async def get_logs() -> dict:
-    logger.info(f"Logs requested: {len(interaction_log)} interactions")
+async def get_logs(
+    customer_id: Optional[str] = None,
+    agent_type: Optional[str] = None,
+    since: Optional[str] = Query(None, description="ISO timestamp, inclusive"),
+    until: Optional[str] = Query(None, description="ISO timestamp, exclusive"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=1000),
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    """
+    Newest-first interaction log page. With format=ndjson every matching entry is
+    streamed as one JSON object per line (limit is then the page size per fetch).
+    The first page (no cursor) also counts every interaction matching the filters.
+    """
+    try:
+        since, until = parse_timestamp(since), parse_timestamp(until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid since/until: expected an ISO-8601 timestamp")
+    try:
+        interaction_log.validate_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    filters = {"customer_id": customer_id, "agent_type": agent_type, "since": since, "until": until}
+
+    if format == "ndjson":
+        async def export():
+            next_cursor = cursor
+            while True:
+                entries, next_cursor = await asyncio.to_thread(
+                    interaction_log.query, **filters, cursor=next_cursor, limit=limit
+                )
+                if entries:
+                    yield "".join(json.dumps(entry) + "\n" for entry in entries)
+                if not next_cursor:
+                    break
+
+        logger.info(f"Logs export requested: {filters}")
+        return StreamingResponse(export(), media_type="application/x-ndjson")
+
+    entries, next_cursor = await asyncio.to_thread(interaction_log.query, **filters, cursor=cursor, limit=limit)
+    total = None if cursor else await asyncio.to_thread(interaction_log.count, **filters)
+    logger.info(f"Logs requested: {len(entries)} entries, {total} matching")
+    return {
+        "total_interactions": total,
+        "logs": entries,
+        "next_cursor": next_cursor
+    }
+
+
+@app.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    """Prometheus text format: stage latency histograms with p50/p95/p99, cache, fallback and error counters"""
+    # Collectors include SQLite-backed stats, so rendering stays off the event loop
+    return PlainTextResponse(await asyncio.to_thread(registry.render), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/costs")
+async def costs(customer_id: Optional[str] = None, top: int = Query(20, ge=1, le=1000)) -> dict:
+    """Rolling cost and token totals per agent type and per customer (highest spend first)"""
+    return usage_aggregates.stats(customer_id, top)
+
+
+@app.get("/sessions/stats")
+async def session_stats() -> dict:
+    return await asyncio.to_thread(sessions.stats)
+
+
+@app.get("/admission/stats")
+async def admission_stats() -> dict:
+    """Slots in use, queue depth and requests shed by reason; wait times are in /metrics"""
+    return admission.stats()
+
+
+@app.get("/classifier/stats")
+async def classifier_stats() -> dict:
     return {
-        "total_interactions": len(interaction_log),
-        "logs": interaction_log
+        **sales_intent_classifier.stats(),
+        "micro_batch": {"enabled": True, **sales_intent_batcher.stats()} if sales_intent_batcher else {"enabled": False}
     }
 
 
+@app.post("/classifier/retrain")
+async def retrain_classifier() -> dict:
+    """Retrain the local intent classifier from the interaction log and persist it"""
+    # Training is CPU-bound, so it runs in the process pool rather than holding the GIL here
+    entries = await asyncio.to_thread(interaction_log.history, RETRAIN_MAX_ENTRIES)
+    examples = sales_intent_classifier.examples_from_logs(entries)
+    used = sales_intent_classifier.set_model(await run_cpu(sales_intent_classifier.fit, examples))
+    if used:
+        await asyncio.to_thread(sales_intent_classifier.save)
+    logger.info(f"Local classifier retrained on {used} interactions")
+    return {"trained_on": used, **sales_intent_classifier.stats()}
+
+
+def _cache_stats() -> dict:
+    return {
+        "response_cache": {"enabled": True, **sales_response_cache.stats()} if sales_response_cache else {"enabled": False},
+        "context_cache": {"enabled": True, **sales_context_cache.stats()} if sales_context_cache else {"enabled": False},
+        "audio_cache": {"enabled": True, **tts_backend.cache.stats()} if hasattr(tts_backend, "cache") else {"enabled": False}
+    }
+
+
+@app.get("/cache/stats")
+async def cache_stats() -> dict:
+    # SQLite-backed stores count rows, so the blocking reads run in a worker thread
+    return await asyncio.to_thread(_cache_stats)
+
+
+@app.get("/prompt/stats")
+async def prompt_stats() -> dict:
+    """Estimated prompt tokens per section, and what trimming and dedup saved"""
+    return sales_prompt_budget.stats()
+
+
 @app.get("/health")
 async def health() -> dict:
-    return {"status": "ok", "service": "AI Sales Support Agent"}
+    return {"status": "ok", "service": "AI Sales Support Agent", "warmed_up": warm_up.done, "upstreams": http_client_stats()}
 
 
 if __name__ == "__main__":
-    import uvicorn
+    from serve import serve
     logger.info("Starting AI Sales Support Agent backend")
-    uvicorn.run(app, host="0.0.0.0", port=8002) # Port 8002 for Sales Agent
+    # Single process; `python3 serve.py sales --workers auto` runs one worker per core
+    # (launching workers from here would make each one import this script twice)
+    serve("sales", workers="1", app=app)
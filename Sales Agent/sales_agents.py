@@ -0,0 +1,79 @@
+# Specialized Sales Agent classes
+
+from sales_services import generate_sales_response_async, generate_sales_response_stream, get_sales_context_async
+from metrics import timed
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Agent:
+    def __init__(self, name: str, role: str):
+        self.name = name
+        self.role = role
+    
+    async def process(self, customer_message: str, context: str) -> str:
+        response = await generate_sales_response_async(self.role, customer_message, context)
+        logger.info(f"{self.name} processed message")
+        return response
+
+    def stream(self, customer_message: str, context: str):
+        """Async iterator over response chunks"""
+        logger.info(f"{self.name} streaming response")
+        return generate_sales_response_stream(self.role, customer_message, context)
+
+
+class NewCustomerAgent(Agent):
+    def __init__(self):
+        super().__init__("NewCustomerAgent", "new_customer")
+
+
+class UpgradeAgent(Agent):
+    def __init__(self):
+        super().__init__("UpgradeAgent", "upgrade")
+
+
+class DeviceAgent(Agent):
+    def __init__(self):
+        super().__init__("DeviceAgent", "device_inquiry")
+
+
+class PromotionAgent(Agent):
+    def __init__(self):
+        super().__init__("PromotionAgent", "promotion")
+
+
+class GeneralSalesAgent(Agent):
+    def __init__(self):
+        super().__init__("GeneralSalesAgent", "other")
+
+
+class SalesRouter:
+    def __init__(self):
+        self.agents = {
+            "new_customer": NewCustomerAgent(),
+            "upgrade": UpgradeAgent(),
+            "device_inquiry": DeviceAgent(),
+            "promotion": PromotionAgent(),
+            "other": GeneralSalesAgent()
+        }
+        logger.info("SalesRouter initialized with all sub-agents")
+    
+    def select(self, intent: str) -> Agent:
+        """Accepts a sub-intent ("upgrade") or the hierarchical label ("sales/upgrade")"""
+        return self.agents.get(intent.rpartition("/")[2], self.agents["other"])
+
+    @timed("route")
+    async def route(self, intent: str, customer_message: str, context: Optional[str] = None) -> tuple:
+        """Route to the matching agent, fetching context only if the caller has none.
+
+        Returns (intent, agent_name, response, context) so callers can reuse the context
+        for logging and response metadata without a second lookup.
+        """
+        agent = self.select(intent)
+        if context is None:
+            context = await get_sales_context_async(customer_message)
+        response = await agent.process(customer_message, context)
+        logger.info(f"Routed to {agent.name}")
+        return intent, agent.name, response, context
@@ -0,0 +1,438 @@
+# LLM Integrations for Sales Agent
+
+import asyncio
+import json
+import os
+import sys
+from dotenv import load_dotenv
+import logging
+
+# Shared infrastructure modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from local_classifier import LocalIntentClassifier
+from response_cache import create_response_cache
+from context_cache import ContextCache
+from shared_state import get_shared_store
+from cpu_pool import CPU_POOL_MIN_BATCH, run_cpu
+from http_client import get_http_client, close_http_clients
+from tts import stream_speech, TTSUnavailable
+from audio_cache import create_cached_tts_backend
+from micro_batcher import MicroBatcher
+from token_budget import create_prompt_budget
+from cost_tracker import record_perplexity
+from llm_providers import create_provider
+from metrics import timed, count_cache, count_error, count_fallback
+
+load_dotenv()
+
+logging.basicConfig(level = logging.INFO, format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Each stage can use its own model (LLM_CLASSIFICATION_MODEL, LLM_CONTEXT_MODEL, LLM_GENERATION_MODEL);
+# a stage whose provider has no credentials is None and the agent answers offline
+classification_llm = create_provider("classification", required=False)
+context_llm = create_provider("context", required=False)
+generation_llm = create_provider("generation", required=False)
+
+perplexity_api_key = os.getenv("PERPLEXITY_API_KEY")
+
+PERPLEXITY_URL = "https://api.perplexity.ai/openai/v1/chat/completions"
+
+# Pipeline mode: run classification and context retrieval concurrently, each under its own timeout
+PARALLEL_PIPELINE = os.getenv("PARALLEL_PIPELINE", "true").lower() == "true"
+CLASSIFY_TIMEOUT_SECONDS = float(os.getenv("CLASSIFY_TIMEOUT_SECONDS", "5"))
+CONTEXT_TIMEOUT_SECONDS = float(os.getenv("CONTEXT_TIMEOUT_SECONDS", "8"))
+
+# Messages classified per LLM prompt by the batch classifier
+BATCH_CLASSIFY_SIZE = int(os.getenv("BATCH_CLASSIFY_SIZE", "25"))
+
+# Micro-batching: concurrent /chat classifications arriving within the window share one LLM call
+MICRO_BATCH_ENABLED = os.getenv("MICRO_BATCH_ENABLED", "false").lower() == "true"
+MICRO_BATCH_WINDOW_MS = float(os.getenv("MICRO_BATCH_WINDOW_MS", "10"))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "16"))
+
+VALID_SALES_INTENTS = ["new_customer", "upgrade", "device_inquiry", "promotion", "other"]
+
+SALES_SYSTEM_PROMPTS = {
+    "new_customer": "You are a New Customer Specialist. Welcome the user and highlight the benefits of joining our service. Be enthusiastic and persuasive.",
+    "upgrade": "You are an Upgrade Specialist. Help existing customers find better plans or newer devices. Focus on value and loyalty benefits.",
+    "device_inquiry": "You are a Device Expert. Provide detailed, accurate info about smartphones, tablets, and accessories. Compare features if asked.",
+    "promotion": "You are a Promotions Specialist. Explain current deals, bundles, and limited-time offers clearly. Create a sense of urgency.",
+    "other": "You are a General Sales Agent. Assist with any sales-related inquiries professionally and persuasively."
+}
+
+# Keyword rules for the local classifier; a rule only wins when exactly one label matches
+SALES_KEYWORD_RULES = {
+    "new_customer": [r"\bnew customer\b", r"\bsign(ing)? up\b", r"\bswitch(ing)? (to|from|carriers?)\b", r"\bjoin(ing)?\b"],
+    "upgrade": [r"\bupgrad(e|ing)\b", r"\btrade[- ]?in\b"],
+    "device_inquiry": [r"\bspecs?\b", r"\bspecifications?\b", r"\bbattery life\b", r"\bcamera\b", r"\bscreen size\b"],
+    "promotion": [r"\bpromo(tion)?s?\b", r"\bdiscounts?\b", r"\bcoupons?\b", r"\bholiday (sale|deals?)\b"]
+}
+
+sales_intent_classifier = LocalIntentClassifier(
+    VALID_SALES_INTENTS,
+    SALES_KEYWORD_RULES,
+    threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.85")),
+    model_path=os.getenv("SALES_INTENT_MODEL_PATH", "sales_intent_model.json")
+)
+
+OFFLINE_RESPONSE = "I apologize, I am currently offline."
+FALLBACK_RESPONSE = "I apologize, I'm unable to process that request right now. Please try again later."
+
+# Hosted inside the support app (main.py imports services first): reuse its caches and TTS backend,
+# so one process never tracks the same cache store or audio directory twice
+_host = sys.modules.get("services")
+
+sales_response_cache = create_response_cache("sales", _host.response_cache.store if _host and _host.response_cache else None)
+sales_prompt_budget = create_prompt_budget()
+
+if _host:
+    sales_context_cache = _host.context_cache
+    if sales_context_cache:
+        sales_context_cache.skip_values.add("Context unavailable.")
+else:
+    sales_context_cache = ContextCache(
+        default_ttl=float(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600")),
+        stale_seconds=float(os.getenv("CONTEXT_CACHE_STALE_SECONDS", "86400")),
+        max_entries=int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "10000")),
+        skip_values=("Unable to retrieve context.", "Context unavailable."),
+        shared=get_shared_store(),
+        namespace="sales_context"
+    ) if os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true" else None
+
+# Pooled keep-alive client; its circuit breaker sends lookups straight to the context model fallback while Perplexity is unhealthy
+perplexity_client = get_http_client("perplexity")
+
+# One TTS backend (and so one ElevenLabs client) per process, behind the on-disk audio cache;
+# TTS_BACKEND=stub synthesizes silence locally. The cache directory is indexed during warm-up.
+tts_backend = _host.tts_backend if _host else create_cached_tts_backend(load_index=False)
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))
+
+WARMUP_PRECONNECT = os.getenv("WARMUP_PRECONNECT", "true").lower() == "true"
+
+
+def register_warm_up(warm_up) -> None:
+    """Add this module's client warm-up steps; nothing here runs at import time"""
+    for name, provider in (("classification_llm", classification_llm), ("context_llm", context_llm), ("generation_llm", generation_llm)):
+        if provider is not None:
+            warm_up.add(name, provider.warm_up)
+    warm_up.add("tts", getattr(tts_backend, "warm_up", None))
+    if WARMUP_PRECONNECT and perplexity_api_key:
+        async def preconnect_perplexity() -> None:
+            await perplexity_client.preconnect(PERPLEXITY_URL)
+        warm_up.add("perplexity_connect", preconnect_perplexity)
+
+
+async def run_stage(stage: str, coro, timeout: float, default):
+    """Await a pipeline stage, degrading to `default` if it times out or fails"""
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Stage '{stage}' timed out after {timeout}s, using default")
+        count_fallback(stage, "timeout")
+    except Exception as e:
+        logger.error(f"Stage '{stage}' failed: {e}, using default")
+        count_error(stage)
+        count_fallback(stage, "error")
+    return default
+
+
+def _sales_classification_prompt(customer_message: str) -> str:
+    return (
+        f"Classify this sales-related customer message as ONE of: new_customer, upgrade, device_inquiry, promotion, other."
+        f"Focus on the primary sales intent only."
+        f"Reply with ONLY the classification (one word). \n\n"
+        f"Message: {customer_message}"
+    )
+
+
+def _parse_sales_intent(text: str) -> str:
+    classification = text.strip().lower()
+    if classification in VALID_SALES_INTENTS:
+        logger.info(f"Classified as: {classification}")
+        return classification
+
+    logger.warning(f"Invalid classification: {classification}, defaulting to 'other'")
+    return "other"
+
+
+def _perplexity_request(query: str) -> dict:
+    return {
+        "model": "sonar",
+        "messages": [
+            {
+                "role": "user",
+                "content": f"Provide general factual information about typical telecom plans or devices regarding: {query}\n"
+                          f"Focus on specs, features, or general market offerings.\n"
+                          f"Keep response concise (2-3 sentences max)."
+            }
+        ]
+    }
+
+
+def _parse_perplexity(result: dict) -> str:
+    return result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+
+def _context_fallback_prompt(query: str) -> str:
+    return (
+        f"Provide general factual information about typical telecom plans or devices regarding: {query}\n"
+        f"Focus on specs and features.\n"
+        f"Keep response concise (2-3 sentences max)."
+    )
+
+
+def _sales_response_prompt(agent_type: str, customer_message: str, context: str) -> str:
+    system_prompt = SALES_SYSTEM_PROMPTS.get(agent_type, SALES_SYSTEM_PROMPTS["other"])
+    instructions = "Provide a helpful, persuasive response."
+    context, customer_message, _ = sales_prompt_budget.fit(system_prompt, context, customer_message, instructions)
+    return (
+        f"{system_prompt}\n\n"
+        f"Context (General Info): {context}\n\n"
+        f"Customer message: {customer_message}\n\n"
+        f"{instructions}"
+    )
+
+
+def _classify_sales_locally(customer_message: str):
+    local = sales_intent_classifier.predict(customer_message)
+    if local:
+        label, confidence, source = local
+        logger.info(f"Classified locally as: {label} ({source}, {confidence:.2f})")
+        return label
+    return None
+
+
+@timed("classification")
+async def classify_sales_intent_async(customer_message: str) -> str:
+    local_intent = _classify_sales_locally(customer_message)
+    if local_intent:
+        return local_intent
+
+    if not classification_llm:
+        return "other"
+
+    if sales_intent_batcher:
+        try:
+            return await sales_intent_batcher.submit(customer_message)
+        except Exception as e:
+            logger.error(f"Intent Classification Failed: {e}")
+            count_error("classification")
+            count_fallback("classification", "default_intent")
+            return "other"
+
+    try:
+        response = await classification_llm.generate_async(_sales_classification_prompt(customer_message))
+        return _parse_sales_intent(response.text)
+
+    except Exception as e:
+        logger.error(f"Intent Classification Failed: {e}")
+        count_error("classification")
+        count_fallback("classification", "default_intent")
+        return "other"
+
+
+def _batch_classification_prompt(messages: list) -> str:
+    numbered = "\n".join(f"[{i}] {' '.join(message.split())}" for i, message in enumerate(messages, 1))
+    return (
+        f"Classify each sales-related customer message below as ONE of: new_customer, upgrade, device_inquiry, promotion, other."
+        f"Focus on the primary intent only."
+        f"Reply with ONLY a JSON object mapping each message number to its classification, "
+        f"e.g. {{\"1\": \"other\"}}.\n\n"
+        f"{numbered}"
+    )
+
+
+def _parse_batch_intents(text: str, count: int) -> list:
+    labels = json.loads(text)
+    intents = []
+    for i in range(1, count + 1):
+        label = str(labels.get(str(i), "")).strip().lower()
+        intents.append(label if label in VALID_SALES_INTENTS else "other")
+    return intents
+
+
+def _batch_labels(response, count: int) -> list:
+    """Labels from one batch classification response; all 'other' if the call or the parse failed"""
+    try:
+        if isinstance(response, Exception):
+            raise response
+        return _parse_batch_intents(response.text, count)
+
+    except Exception as e:
+        logger.error(f"Batch Intent Classification Failed: {e}")
+        count_error("classification")
+        count_fallback("classification", "default_intent")
+        return ["other"] * count
+
+
+async def _classify_chunk_async(messages: list) -> list:
+    responses = await classification_llm.batch([_batch_classification_prompt(messages)], json_output=True)
+    return _batch_labels(responses[0], len(messages))
+
+
+sales_intent_batcher = MicroBatcher(
+    _classify_chunk_async,
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    window_seconds=MICRO_BATCH_WINDOW_MS / 1000,
+    name="sales_intent"
+) if MICRO_BATCH_ENABLED else None
+
+
+@timed("classification_batch")
+async def classify_sales_intents_batch_async(messages: list) -> list:
+    """Classify many messages: local fast path first, the rest BATCH_CLASSIFY_SIZE per LLM call"""
+    if len(messages) < CPU_POOL_MIN_BATCH:
+        intents = [_classify_sales_locally(message) for message in messages]
+    else:
+        # Large batches are scored in the CPU process pool
+        results = await run_cpu(sales_intent_classifier.predict_many, messages)
+        sales_intent_classifier.count(results)
+        intents = [result[0] if result else None for result in results]
+    pending = [i for i, intent in enumerate(intents) if intent is None]
+    if pending and classification_llm:
+        chunks = [pending[start:start + BATCH_CLASSIFY_SIZE] for start in range(0, len(pending), BATCH_CLASSIFY_SIZE)]
+        prompts = [_batch_classification_prompt([messages[i] for i in chunk]) for chunk in chunks]
+        responses = await classification_llm.batch(prompts, json_output=True)
+        for chunk, response in zip(chunks, responses):
+            for i, label in zip(chunk, _batch_labels(response, len(chunk))):
+                intents[i] = label
+    logger.info(f"Batch classified {len(messages)} messages ({len(pending)} via LLM)")
+    return [intent or "other" for intent in intents]
+
+
+@timed("context")
+async def get_sales_context_async(query: str) -> str:
+    if sales_context_cache:
+        return await sales_context_cache.get_or_fetch(query, _fetch_sales_context_async, scope="sales")
+    return await _fetch_sales_context_async(query)
+
+
+@timed("context_fetch")
+async def _fetch_sales_context_async(query: str) -> str:
+    try:
+        if perplexity_api_key and perplexity_client.is_available():
+            try:
+                response = await perplexity_client.post_async(
+                    PERPLEXITY_URL,
+                    headers={"Authorization": f"Bearer {perplexity_api_key}"},
+                    json=_perplexity_request(query)
+                )
+
+                if response.status_code == 200:
+                    result = response.json()
+                    record_perplexity("context", result)
+                    context = _parse_perplexity(result)
+                    logger.info("Context retrieved from Perplexity")
+                    return context[:500]
+
+            except Exception as e:
+                logger.warning(f"Perplexity failed, falling back to the context model: {e}")
+
+        if context_llm:
+            count_fallback("context", "llm")
+            response = await context_llm.generate_async(_context_fallback_prompt(query))
+
+            context = response.text
+            logger.info(f"Context retrieved from {context_llm.name} (fallback)")
+            return context[:500]
+
+        return "Context unavailable."
+
+    except Exception as e:
+        logger.error(f"Context retrieval failed: {e}")
+        count_error("context")
+        count_fallback("context", "unavailable")
+        return "Unable to retrieve context."
+
+
+async def _cached_response(agent_type: str, customer_message: str, context: str):
+    if sales_response_cache:
+        cached = await sales_response_cache.get_async(agent_type, customer_message, context)
+        count_cache("response", cached is not None)
+        if cached is not None:
+            logger.info(f"Response cache hit for {agent_type} agent")
+            return cached
+    return None
+
+
+@timed("generation")
+async def generate_sales_response_async(agent_type: str, customer_message: str, context: str) -> str:
+    if not generation_llm:
+        return OFFLINE_RESPONSE
+
+    cached = await _cached_response(agent_type, customer_message, context)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await generation_llm.generate_async(_sales_response_prompt(agent_type, customer_message, context))
+
+        if sales_response_cache:
+            await sales_response_cache.set_async(agent_type, customer_message, context, response.text)
+        logger.info(f"Generated response for {agent_type} agent")
+        return response.text
+
+    except Exception as e:
+        logger.error(f"Response generation failed: {e}")
+        count_error("generation")
+        count_fallback("generation", "canned_response")
+        return FALLBACK_RESPONSE
+
+
+@timed("generation")
+async def generate_sales_response_stream(agent_type: str, customer_message: str, context: str):
+    """Yield response text chunks as the model produces them; cached responses are yielded whole"""
+    cached = await _cached_response(agent_type, customer_message, context)
+    if cached is not None:
+        yield cached
+        return
+
+    if not generation_llm:
+        yield OFFLINE_RESPONSE
+        return
+
+    chunks = []
+    try:
+        async for chunk in generation_llm.stream(_sales_response_prompt(agent_type, customer_message, context)):
+            chunks.append(chunk)
+            yield chunk
+
+        if sales_response_cache:
+            await sales_response_cache.set_async(agent_type, customer_message, context, "".join(chunks))
+        logger.info(f"Streamed response for {agent_type} agent")
+
+    except Exception as e:
+        logger.error(f"Response streaming failed: {e}")
+        count_error("generation")
+        if not chunks:
+            count_fallback("generation", "canned_response")
+            yield FALLBACK_RESPONSE
+
+
+@timed("tts")
+def text_to_speech(text: str) -> dict:
+    try:
+        audio = tts_backend.synthesize(text)
+        logger.info("Text-to-speech conversion successful")
+        return {"success": True, "message": "Audio generated", "audio": audio}
+
+    except TTSUnavailable as e:
+        logger.warning(f"TTS unavailable: {e}")
+        count_error("tts")
+        return {"success": False, "message": str(e)}
+
+    except Exception as e:
+        logger.warning(f"Text-to-speech failed: {e}")
+        count_error("tts")
+        return {"success": False, "message": str(e)}
+
+
+async def text_to_speech_async(text: str) -> dict:
+    # The ElevenLabs SDK is synchronous; run it on a worker thread so the loop stays free
+    return await asyncio.to_thread(text_to_speech, text)
+
+
+def stream_text_to_speech(text_chunks):
+    """Async iterator of (sentence, audio) synthesized sentence by sentence as text arrives"""
+    return stream_speech(text_chunks, tts_backend, concurrency=TTS_CONCURRENCY)
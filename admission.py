@@ -0,0 +1,304 @@
+# Admission control: per-customer and per-provider token buckets in front of a bounded priority queue
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Lower admits first; bulk batches only get slots interactive traffic is not waiting for
+DEFAULT_PRIORITIES = "billing=0,technical_support=0,sales=1,other=2,batch=3"
+
+ADMISSION_WAIT_SECONDS = registry.histogram("admission_wait_seconds", "Time admitted requests waited for a slot", ("priority",))
+ADMISSION_REJECTIONS = registry.counter("admission_rejections_total", "Requests shed with 429 before reaching an agent", ("reason",))
+
+
+class AdmissionRejected(Exception):
+    """The request was shed; answer 429 with `retry_after_header` as Retry-After"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Server busy ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float, needed: float = 1.0) -> float:
+        """Seconds until `needed` tokens are available (0.0 if they are now)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (needed - self.tokens) / self.rate)
+
+    def take(self, now: float) -> float:
+        """Spend a token and return 0.0, or return the wait without spending"""
+        wait = self.wait_time(now)
+        if wait == 0.0:
+            self.tokens -= 1
+        return wait
+
+
+class Ticket:
+    __slots__ = ("priority", "admitted_at", "released")
+
+    def __init__(self, priority: int, admitted_at: float):
+        self.priority = priority
+        self.admitted_at = admitted_at
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Gate in front of the agent routers. A request first spends a token from its
+    customer's bucket, then takes one of `max_concurrent` slots, plus a token from every
+    provider bucket since each request calls those upstreams. When none is free it
+    waits in a queue served by priority (FIFO within one). Requests are shed with
+    AdmissionRejected, never queued forever: when the queue is full (the newest
+    lowest-priority waiter makes room for a better one), when the estimated wait exceeds
+    `max_wait_seconds`, or when that wait runs out. Runs on the event loop; not thread-safe.
+    """
+
+    def __init__(self, enabled: bool = True, max_concurrent: int = 32, max_queue: int = 256, max_wait_seconds: float = 10.0,
+                 customer_rate: float = 2.0, customer_burst: float = 10.0, provider_rates: Optional[dict] = None,
+                 priorities: Optional[dict] = None, default_priority: int = 1, max_customers: int = 10000):
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.customer_rate = customer_rate
+        self.customer_burst = customer_burst
+        # A provider bucket holds one second of its rate, so a quiet period allows only a short burst
+        self.providers = {name: TokenBucket(rate, max(1.0, rate)) for name, rate in (provider_rates or {}).items()}
+        self.priorities = priorities or {}
+        self.default_priority = default_priority
+        self.max_customers = max_customers
+        self._customers = OrderedDict()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._dispatch_handle = None
+        self.active = 0
+        # Moving average of how long a request holds its slot, for wait estimates
+        self.service_seconds = 1.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {}
+
+    def priority(self, intent: Optional[str]) -> int:
+        """Priority of an intent ("sales/upgrade" ranks as "sales"); unknown intents get the default"""
+        if not intent:
+            return self.default_priority
+        return self.priorities.get(intent.partition("/")[0], self.default_priority)
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        logger.warning(f"Shedding request: {reason}, retry after {retry_after:.1f}s")
+        return AdmissionRejected(reason, retry_after)
+
+    def _check_customer(self, customer_id: Optional[str], now: float) -> None:
+        if customer_id is None or self.customer_rate <= 0:
+            return
+        bucket = self._customers.get(customer_id)
+        if bucket is None:
+            bucket = self._customers[customer_id] = TokenBucket(self.customer_rate, self.customer_burst)
+            if len(self._customers) > self.max_customers:
+                self._customers.popitem(last=False)
+        else:
+            self._customers.move_to_end(customer_id)
+        wait = bucket.take(now)
+        if wait:
+            raise self._reject("customer_rate", wait)
+
+    def _provider_wait(self, now: float, needed: float = 1.0) -> float:
+        return max((bucket.wait_time(now, needed) for bucket in self.providers.values()), default=0.0)
+
+    def estimated_wait(self, priority: int, now: float) -> float:
+        """Rough wait for a new request: the waiters it cannot overtake, drained by slots and provider rates"""
+        ahead = sum(1 for entry in self._waiting if entry[0] <= priority)
+        slot_wait = 0.0
+        if ahead or self.active >= self.max_concurrent:
+            slot_wait = (ahead + 1) / self.max_concurrent * self.service_seconds
+        return max(slot_wait, self._provider_wait(now, ahead + 1))
+
+    async def acquire(self, customer_id: Optional[str], intent: Optional[str] = None) -> Ticket:
+        """
+        Wait for a slot for `customer_id` (None skips the customer limit) at the priority of
+        `intent`; raises AdmissionRejected instead of waiting past `max_wait_seconds`
+        """
+        now = time.monotonic()
+        priority = self.priority(intent)
+        if not self.enabled:
+            self.active += 1
+            return Ticket(priority, now)
+        self._check_customer(customer_id, now)
+        if self.active < self.max_concurrent and not self._waiting and self._provider_wait(now) == 0.0:
+            self._take_slot(now)
+            return self._admitted(priority, now, now)
+
+        wait = self.estimated_wait(priority, now)
+        if wait > self.max_wait_seconds:
+            raise self._reject("overloaded", wait)
+        if len(self._waiting) >= self.max_queue:
+            worst = max(self._waiting)
+            if worst[0] <= priority:
+                raise self._reject("queue_full", wait)
+            self._waiting.remove(worst)
+            heapq.heapify(self._waiting)
+            worst[2].set_exception(self._reject("preempted", wait))
+
+        entry = (priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiting, entry)
+        self.queued += 1
+        self._dispatch()
+        try:
+            await asyncio.wait((entry[2],), timeout=self.max_wait_seconds)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        if not entry[2].done():
+            self._abandon(entry)
+            raise self._reject("timeout", self.estimated_wait(priority, time.monotonic()))
+        entry[2].result()
+        return self._admitted(priority, now, time.monotonic())
+
+    def _take_slot(self, now: float) -> None:
+        for bucket in self.providers.values():
+            bucket.tokens -= 1
+        self.active += 1
+
+    def _admitted(self, priority: int, enqueued_at: float, now: float) -> Ticket:
+        self.admitted += 1
+        ADMISSION_WAIT_SECONDS.observe(now - enqueued_at, priority=priority)
+        return Ticket(priority, now)
+
+    def _abandon(self, entry: tuple) -> None:
+        """Drop a waiter that gave up; a slot granted to it in the meantime is handed on"""
+        future = entry[2]
+        if not future.done():
+            future.cancel()
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+        elif future.exception() is None:
+            self.active -= 1
+            self._dispatch()
+
+    def release(self, ticket: Ticket) -> None:
+        """Return the slot; safe to call more than once for the same ticket"""
+        if ticket.released:
+            return
+        ticket.released = True
+        self.active -= 1
+        self.service_seconds += 0.1 * (time.monotonic() - ticket.admitted_at - self.service_seconds)
+        if self.enabled:
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the best waiters, or retry once the provider buckets refill"""
+        while self._waiting and self.active < self.max_concurrent:
+            now = time.monotonic()
+            wait = self._provider_wait(now)
+            if wait:
+                if self._dispatch_handle is None:
+                    self._dispatch_handle = asyncio.get_running_loop().call_later(wait, self._redispatch)
+                return
+            self._take_slot(now)
+            heapq.heappop(self._waiting)[2].set_result(None)
+
+    def _redispatch(self) -> None:
+        self._dispatch_handle = None
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, customer_id: Optional[str], intent: Optional[str] = None):
+        ticket = await self.acquire(customer_id, intent)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def holding(self, ticket: Ticket, body):
+        """Stream `body`, keeping the ticket's slot until it is exhausted or closed"""
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        for bucket in self.providers.values():
+            bucket.wait_time(now)
+        return {
+            "enabled": self.enabled,
+            "active": self.active,
+            "queue_depth": len(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": sum(self.rejected.values()),
+            **{f"rejected_{reason}": count for reason, count in self.rejected.items()},
+            "service_seconds": round(self.service_seconds, 4),
+            "tracked_customers": len(self._customers),
+            **{f"provider_{name}_tokens": round(bucket.tokens, 2) for name, bucket in self.providers.items()}
+        }
+
+
+def _parse_rates(spec: str) -> dict:
+    """'gemini=10,perplexity=5' -> {'gemini': 10.0, 'perplexity': 5.0}"""
+    rates = {}
+    for part in filter(None, (item.strip() for item in spec.split(","))):
+        name, _, value = part.partition("=")
+        rates[name.strip()] = float(value)
+    return rates
+
+
+def create_admission_controller() -> AdmissionController:
+    """
+    ADMISSION_PROVIDER_RPS caps requests per second admitted against each upstream
+    (e.g. "gemini=10,perplexity=5"). Every admitted request spends one token per listed
+    provider, so list only the providers this service calls and size each rate from
+    the quota and calls per request.
+
+    The rates are for the whole service. Buckets live in each worker process, so each
+    worker gets 1/WEB_CONCURRENCY of the customer and provider rates (serve.py sets it to
+    its worker count). Concurrency and queue limits stay per worker.
+    """
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    priorities = {name: int(value) for name, value in _parse_rates(os.getenv("ADMISSION_PRIORITIES", DEFAULT_PRIORITIES)).items()}
+    controller = AdmissionController(
+        enabled=os.getenv("ADMISSION_ENABLED", "true").lower() == "true",
+        max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "32")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "256")),
+        max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10")),
+        customer_rate=float(os.getenv("ADMISSION_CUSTOMER_RPS", "2")) / workers,
+        customer_burst=max(1.0, float(os.getenv("ADMISSION_CUSTOMER_BURST", "10")) / workers),
+        provider_rates={name: rate / workers for name, rate in _parse_rates(os.getenv("ADMISSION_PROVIDER_RPS", "")).items()},
+        priorities=priorities
+    )
+    if controller.enabled:
+        logger.info(
+            f"Admission control: {controller.max_concurrent} concurrent, queue {controller.max_queue}, "
+            f"providers {list(controller.providers) or 'unlimited'}, rates split across {workers} worker(s)"
+        )
+    return controller
@@ -1,21 +1,39 @@
 # Multi-agent system: Agent classes and routing
 
-from services import generate_response, get_context_from_perplexity
+from services import generate_response_async, generate_response_stream, get_context_from_perplexity_async
+from metrics import timed
 import logging
+from typing import Awaitable, Callable, Optional
 
 logger = logging.getLogger(__name__)
 
 
+def split_intent(intent: str) -> tuple:
+    """(agent_type, sub_intent) of a label such as "sales/upgrade"; sub_intent is None for a one-level label"""
+    agent_type, _, sub_intent = intent.partition("/")
+    return agent_type, sub_intent or None
+
+
+def join_intent(agent_type: str, sub_intent: Optional[str]) -> str:
+    """Inverse of split_intent()"""
+    return f"{agent_type}/{sub_intent}" if sub_intent else agent_type
+
+
 class Agent:
     def __init__(self, name: str, role: str):
         self.name = name
         self.role = role
     
-    def process(self, customer_message: str, context: str) -> str:
-        response = generate_response(self.role, customer_message, context)
+    async def process(self, customer_message: str, context: str) -> str:
+        response = await generate_response_async(self.role, customer_message, context)
         logger.info(f"{self.name} processed message")
         return response
 
+    def stream(self, customer_message: str, context: str):
+        """Async iterator over response chunks"""
+        logger.info(f"{self.name} streaming response")
+        return generate_response_stream(self.role, customer_message, context)
+
 
 class BillingAgent(Agent):
     def __init__(self):
@@ -45,11 +63,47 @@ class AgentRouter:
             "technical_support": TechSupportAgent(),
             "other": GeneralAgent()
         }
+        # intent -> (sub-router, classify): these intents are handed off to a specialist router
+        self.sub_routers = {}
         logger.info("AgentRouter initialized with all agents")
+
+    def mount(self, intent: str, router, classify: Callable[[str], Awaitable[str]]) -> None:
+        """
+        Hand `intent` off to `router` (e.g. the SalesRouter), whose agent is picked by
+        awaiting `classify(customer_message)` for the sub-intent
+        """
+        self.sub_routers[intent] = (router, classify)
+        logger.info(f"Intent {intent} handed off to {type(router).__name__}")
     
-    def route(self, intent: str, customer_message: str) -> tuple:
-        agent = self.agents.get(intent, self.agents["other"])
-        context = get_context_from_perplexity(customer_message)
-        response = agent.process(customer_message, context)
+    def select(self, intent: str) -> Agent:
+        return self.agents.get(intent, self.agents["other"])
+
+    async def resolve(self, intent: str, customer_message: str) -> tuple:
+        """
+        (agent, sub_intent): select(), descending into a mounted sub-router. A two-level label
+        such as "sales/upgrade" names the sub-agent directly; a bare "sales" is classified by the
+        sub-router, and the sub-intent it picked is returned. sub_intent is None for other intents.
+        """
+        intent, sub_intent = split_intent(intent)
+        if intent in self.sub_routers:
+            router, classify = self.sub_routers[intent]
+            sub_intent = sub_intent or await classify(customer_message)
+            return router.select(sub_intent), sub_intent
+        return self.select(intent), None
+
+    @timed("route")
+    async def route(self, intent: str, customer_message: str, context: Optional[str] = None) -> tuple:
+        """Route to the matching agent, fetching context only if the caller has none.
+
+        Returns (intent, agent_name, response, context): the intent as routed (a bare
+        "sales" gains the sub-intent its sub-router picked), and the context so callers
+        can reuse it for logging and response metadata without a second lookup. A
+        sub-router's agent answers with the context already fetched here.
+        """
+        agent, sub_intent = await self.resolve(intent, customer_message)
+        intent = join_intent(split_intent(intent)[0], sub_intent)
+        if context is None:
+            context = await get_context_from_perplexity_async(customer_message)
+        response = await agent.process(customer_message, context)
         logger.info(f"Routed to {agent.name}")
-        return agent.name, response
+        return intent, agent.name, response, context
@@ -0,0 +1,234 @@
+# Content-addressed on-disk cache for synthesized audio
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from tts import create_tts_backend, split_sentences
+
+logger = logging.getLogger(__name__)
+
+# Pre-warmed along with the services' canned fallback replies (see default_phrases)
+COMMON_PHRASES = [
+    "Hello! How can I help you today?",
+    "Is there anything else I can help you with?",
+    "Thank you for contacting us. Have a great day!",
+]
+
+
+class AudioCache:
+    """
+    Stores audio files named by sha256(voice, model, text) under `directory`, evicting
+    least recently used files once `max_bytes` is exceeded. Writes go through a temp
+    file and os.replace, so several workers can share one directory safely. Recency is
+    tracked in memory; after a restart files rank by when they were written.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, load_index: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._indexed = False
+        os.makedirs(directory, exist_ok=True)
+        if load_index:
+            self.load_index()
+
+    def load_index(self) -> None:
+        """
+        Scan the directory for existing files (slow for large caches, so the app runs it
+        during warm-up). Files already seen through get/put keep their place as most recent.
+        """
+        if self._indexed:
+            return
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".audio"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, name[:-len(".audio")], stat.st_size))
+        with self._lock:
+            if self._indexed:
+                return
+            seen = self._index
+            self._index = OrderedDict()
+            self._bytes = 0
+            for _, key, size in sorted(files):
+                if key not in seen:
+                    self._index[key] = size
+                    self._bytes += size
+            for key, size in seen.items():
+                self._index[key] = size
+                self._bytes += size
+            self._indexed = True
+            self._evict()
+
+    @staticmethod
+    def key(text: str, voice: str, model: str) -> str:
+        normalized = re.sub(r"\s+", " ", text).strip()
+        return hashlib.sha256(f"{voice}\0{model}\0{normalized}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.audio")
+
+    def get(self, text: str, voice: str, model: str) -> Optional[bytes]:
+        key = self.key(text, voice, model)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                if key in self._index:
+                    self._bytes -= self._index.pop(key)
+            self.misses += 1
+            return None
+
+        with self._lock:
+            if key not in self._index:
+                # Written by another worker
+                self._bytes += len(audio)
+            self._index[key] = len(audio)
+            self._index.move_to_end(key)
+        self.hits += 1
+        return audio
+
+    def put(self, text: str, voice: str, model: str, audio: bytes) -> None:
+        if len(audio) > self.max_bytes:
+            return
+        key = self.key(text, voice, model)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._bytes += len(audio) - self._index.pop(key, 0)
+            self._index[key] = len(audio)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            oldest, size = self._index.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(self._path(oldest))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "directory": self.directory,
+            "indexed": self._indexed,
+            "entries": len(self._index),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class CachedTTSBackend:
+    """Wraps a TTS backend so repeated text is served from the audio cache with no synthesis"""
+
+    def __init__(self, backend, cache: AudioCache):
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+        self.media_type = backend.media_type
+        self.voice = backend.voice
+        self.model = backend.model
+
+    def synthesize(self, text: str) -> bytes:
+        audio = self.cache.get(text, self.voice, self.model)
+        if audio is not None:
+            return audio
+        audio = self.backend.synthesize(text)
+        self.cache.put(text, self.voice, self.model, audio)
+        return audio
+
+    def warm_up(self) -> None:
+        self.cache.load_index()
+        if hasattr(self.backend, "warm_up"):
+            self.backend.warm_up()
+
+
+def create_cached_tts_backend(load_index: bool = True):
+    """
+    TTS backend from TTS_* settings, wrapped in the audio cache unless AUDIO_CACHE_ENABLED=false.
+    With load_index=False the directory scan is left to warm_up().
+    """
+    backend = create_tts_backend()
+    if os.getenv("AUDIO_CACHE_ENABLED", "true").lower() != "true":
+        return backend
+    cache = AudioCache(
+        os.getenv("AUDIO_CACHE_DIR", ".audio_cache"),
+        int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+        load_index=load_index
+    )
+    return CachedTTSBackend(backend, cache)
+
+
+def default_phrases() -> list:
+    """The services' canned replies plus COMMON_PHRASES (imported late: services imports this module)"""
+    from services import FALLBACK_RESPONSE
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Sales Agent"))
+    from sales_services import OFFLINE_RESPONSE
+
+    return list(dict.fromkeys([FALLBACK_RESPONSE, OFFLINE_RESPONSE, *COMMON_PHRASES]))
+
+
+def prewarm(phrases: list) -> int:
+    """Synthesize each phrase and each of its sentences (what /voice/stream requests) into the cache"""
+    backend = create_cached_tts_backend()
+    if not isinstance(backend, CachedTTSBackend):
+        raise SystemExit("AUDIO_CACHE_ENABLED is false, nothing to pre-warm")
+
+    texts = []
+    for phrase in phrases:
+        sentences, remainder = split_sentences(phrase + " ")
+        texts.extend([phrase] + sentences + ([remainder.strip()] if remainder.strip() else []))
+
+    warmed = 0
+    for text in dict.fromkeys(texts):
+        try:
+            backend.synthesize(text)
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Pre-warm failed for '{text[:40]}': {e}")
+    return warmed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-warm the TTS audio cache with common phrases")
+    parser.add_argument("phrase_files", nargs="*", help="Text files with one phrase per line")
+    parser.add_argument("--no-defaults", action="store_true", help="Skip the built-in canned phrases")
+    args = parser.parse_args()
+
+    phrases = [] if args.no_defaults else default_phrases()
+    for path in args.phrase_files:
+        with open(path) as f:
+            phrases.extend(line.strip() for line in f if line.strip())
+
+    warmed = prewarm(phrases)
+    print(f"Cached audio for {warmed} texts")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,164 @@
+# Batch chat processing: dedupe, batched classification, bounded-concurrency generation
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from contextlib import nullcontext
+from typing import AsyncContextManager, AsyncIterator, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bounds for generations in flight per batch, whether set by query parameter or body
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 64
+
+
+class BatchItemError:
+    """Placeholder for an input item that failed validation; reported in place in the output"""
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+def parse_batch_body(body: bytes, content_type: str) -> tuple:
+    """
+    Accept NDJSON (one message object per line), a JSON list of messages, or
+    {"messages": [...], "concurrency": n}. Returns (raw items, concurrency or None);
+    undecodable NDJSON lines become BatchItemError so they keep their position. A body
+    of any other shape, or a non-integer concurrency, raises ValueError; an integer
+    concurrency is clamped to MIN_CONCURRENCY..MAX_CONCURRENCY.
+    """
+    text = body.decode("utf-8")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        items = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                items.append(BatchItemError(f"Invalid JSON: {e}"))
+        return items, None
+
+    data = json.loads(text)
+    concurrency = None
+    if isinstance(data, dict):
+        data, concurrency = data.get("messages", []), data.get("concurrency")
+        if concurrency is not None:
+            if isinstance(concurrency, bool) or not isinstance(concurrency, int):
+                raise ValueError("concurrency must be an integer")
+            concurrency = min(max(concurrency, MIN_CONCURRENCY), MAX_CONCURRENCY)
+    if not isinstance(data, list):
+        raise ValueError("expected NDJSON, a JSON list or an object with a 'messages' list")
+    return data, concurrency
+
+
+async def run_batch(
+    items: list,
+    classify_batch: Callable[[list], Awaitable[list]],
+    fetch_context: Callable[[str], Awaitable[str]],
+    route: Callable[[str, str, str], Awaitable[tuple]],
+    concurrency: int = 8,
+    admit: Optional[Callable[[], AsyncContextManager]] = None
+) -> AsyncIterator[tuple]:
+    """
+    Process (customer_id, message) items, yielding (index, item, result) in input order.
+
+    Identical messages are processed once. All unique messages are classified
+    together (the classifier batches them into few LLM calls) while the first
+    contexts are fetched; each message's context fetch and generation run with at
+    most `concurrency` in flight, each inside `admit()` when given. Results are
+    yielded as soon as every earlier item is done. A failed item (including one shed
+    by admission) yields a result with an "error" key and does not affect the rest.
+    `route` returns (intent, agent_name, response, context), the intent as routed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    unique = {}
+    for item in items:
+        if not isinstance(item, BatchItemError):
+            unique.setdefault(item[1], len(unique))
+    texts = list(unique)
+    logger.info(f"Batch of {len(items)} items: {len(texts)} unique messages")
+
+    async def classify() -> list:
+        try:
+            return await classify_batch(texts)
+        except Exception as e:
+            logger.error(f"Batch classification failed: {e}")
+            return ["other"] * len(texts)
+
+    async def generate(position: int, text: str, intents: asyncio.Task) -> tuple:
+        async with semaphore, (admit() if admit else nullcontext()):
+            try:
+                context = await fetch_context(text)
+            except Exception as e:
+                logger.error(f"Batch context fetch failed: {e}")
+                context = ""
+            intent = (await asyncio.shield(intents))[position]
+            return await route(intent, text, context)
+
+    intents = asyncio.create_task(classify())
+    tasks = [asyncio.create_task(generate(position, text, intents)) for position, text in enumerate(texts)]
+    try:
+        for index, item in enumerate(items):
+            if isinstance(item, BatchItemError):
+                yield index, item, {"error": item.error}
+                continue
+            position = unique[item[1]]
+            try:
+                intent, agent_name, response, context = await asyncio.shield(tasks[position])
+                yield index, item, {
+                    "agent_type": intent,
+                    "agent_name": agent_name,
+                    "response": response,
+                    "context_used": context[:200]
+                }
+            except Exception as e:
+                yield index, item, {"error": str(e)}
+    finally:
+        intents.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+def main() -> None:
+    import requests
+
+    parser = argparse.ArgumentParser(description="Replay customer messages through /chat/batch")
+    parser.add_argument("input", help="NDJSON file (one CustomerMessage per line) or a JSON list")
+    parser.add_argument("--url", default="http://localhost:8000", help="Agent server base URL")
+    parser.add_argument("--out", help="Write NDJSON results here instead of stdout")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.input, "rb") as f:
+        body = f.read()
+    is_list = body.lstrip().startswith(b"[")
+    response = requests.post(
+        f"{args.url.rstrip('/')}/chat/batch",
+        params={"concurrency": args.concurrency},
+        data=body,
+        headers={"Content-Type": "application/json" if is_list else "application/x-ndjson"},
+        stream=True
+    )
+    response.raise_for_status()
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    errors = total = 0
+    try:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            total += 1
+            errors += "error" in json.loads(line)
+            out.write(line.decode("utf-8") + "\n")
+    finally:
+        if args.out:
+            out.close()
+    print(f"Processed {total} messages, {errors} errors", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
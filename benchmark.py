@@ -0,0 +1,463 @@
+# Offline load benchmark: drives both FastAPI apps against local stand-ins for Gemini, Perplexity and ElevenLabs
+
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from llm_providers import MockProvider
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SALES_DIR = os.path.join(ROOT, "Sales Agent")
+# app -> (directory, services modules to stub); the support app hosts the sales sub-router too
+APPS = {
+    "support": (ROOT, ("services", "sales_services")),
+    "sales": (SALES_DIR, ("sales_services",)),
+}
+
+MESSAGES = {
+    "support": [
+        "Why was I charged twice on my bill this month?",
+        "My internet keeps dropping every evening, can you help?",
+        "I want to upgrade to the unlimited plan.",
+        "What are your store opening hours?",
+        "I was billed a late fee even though autopay is on. Can you refund it?",
+        "The router shows a red light and nothing connects.",
+        "Do you have any offers for adding a second line?",
+        "How do I update the email address on my account?",
+        "I have been a customer for eight years and lately every bill is higher than the one before, "
+        "with fees I never agreed to and a promotional discount that seems to have disappeared. "
+        "Can you explain each charge on my latest statement?",
+    ],
+    "sales": [
+        "I'm looking to switch to your service, do you have any deals?",
+        "I want to upgrade my iPhone 14 to the new model.",
+        "What are the specs for the Samsung Galaxy S24?",
+        "Are there any holiday promotions right now?",
+        "I am just browsing, curious about what you sell.",
+        "Can I trade in my old phone when I upgrade?",
+        "Which plan is best for a family of four that streams a lot of video?",
+        "Does the Pixel 8 support eSIM?",
+    ],
+}
+
+ENDPOINTS = ("/chat", "/chat/stream", "/voice/stream")
+# SDKs that must only be imported by the background warm-up, never by `import main`
+DEFERRED_MODULES = ("google.generativeai", "elevenlabs")
+
+
+class LatencyModel:
+    """Latency spec: `fixed:MS`, `uniform:LO_MS:HI_MS` or `lognormal:MEDIAN_MS:SIGMA`"""
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if (kind, len(self.params)) not in (("fixed", 1), ("uniform", 2), ("lognormal", 2)):
+            raise ValueError(f"Invalid latency spec '{spec}'")
+
+    def sample(self, rng: random.Random) -> float:
+        """Seconds"""
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(*self.params)
+        else:
+            ms = rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        return ms / 1000
+
+
+class UpstreamStub:
+    """Seeded latency and failure injection plus call counting for one fake provider"""
+
+    def __init__(self, name: str, latency: LatencyModel, error_rate: float, seed: int):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(f"{seed}:{name}")
+        self.calls = 0
+        self.errors = 0
+
+    def _draw(self) -> tuple:
+        self.calls += 1
+        failed = self.rng.random() < self.error_rate
+        self.errors += failed
+        return self.latency.sample(self.rng), failed
+
+    async def wait_async(self) -> bool:
+        delay, failed = self._draw()
+        await asyncio.sleep(delay)
+        return failed
+
+
+class StubLLMProvider(MockProvider):
+    """Mock model for one stage whose calls go through the shared upstream stub, priced like Gemini"""
+
+    provider = "gemini"
+
+    def __init__(self, stage: str, upstream: UpstreamStub):
+        super().__init__("gemini-2.0-flash-lite", stage)
+        self.upstream = upstream
+
+    async def _generate_async(self, prompt: str, json_output: bool):
+        if await self.upstream.wait_async():
+            raise RuntimeError("Stub LLM: injected failure")
+        return self._response(prompt)
+
+
+class _StubHTTPResponse:
+    def __init__(self, status_code: int, payload: dict):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self) -> dict:
+        return self._payload
+
+
+class StubPerplexityClient(UpstreamStub):
+    """Stands in for the pooled Perplexity client; failures come back as HTTP 503"""
+
+    def _response(self, failed: bool, payload: dict) -> _StubHTTPResponse:
+        if failed:
+            return _StubHTTPResponse(503, {})
+        content = f"General information about: {payload['messages'][-1]['content'][:80]}. Standard terms apply."
+        return _StubHTTPResponse(200, {
+            "model": "sonar",
+            "choices": [{"message": {"content": content}}],
+            "usage": {"prompt_tokens": len(json.dumps(payload)) // 4, "completion_tokens": len(content) // 4}
+        })
+
+    def is_available(self) -> bool:
+        return True
+
+    async def post_async(self, url: str, json: dict = None, **kwargs) -> _StubHTTPResponse:
+        return self._response(await self.wait_async(), json)
+
+    def stats(self) -> dict:
+        return {"requests": self.calls, "errors": self.errors}
+
+
+class StubElevenLabsBackend(UpstreamStub):
+    """TTS backend returning PCM silence after a sampled delay, priced like ElevenLabs"""
+
+    media_type = "audio/L16;rate=16000"
+    voice = "stub"
+    model = "eleven_monolingual_v1"
+
+    def synthesize(self, text: str) -> bytes:
+        from cost_tracker import record_tts
+
+        # Called in a worker thread (stream_speech), so it blocks instead of awaiting
+        delay, failed = self._draw()
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError("Stub ElevenLabs: injected failure")
+        record_tts(self.model, len(text))
+        return b"\x00\x00" * (4800 * max(len(text.split()), 1))
+
+
+def percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def configure_environment(args) -> None:
+    """Keep everything in memory and off the network; caches only when asked for"""
+    os.environ["LLM_MODEL"] = "mock"
+    os.environ.setdefault("PERPLEXITY_API_KEY", "offline-benchmark")
+    os.environ["LOG_STORE_BACKEND"] = "memory"
+    os.environ["AUDIO_CACHE_ENABLED"] = "false"
+    # Measures the pipeline, not the shedding policy; ADMISSION_ENABLED=true benchmarks both
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    if not args.caches:
+        os.environ["RESPONSE_CACHE_BACKEND"] = "off"
+        os.environ["CONTEXT_CACHE_ENABLED"] = "false"
+    if args.no_local_classifier:
+        os.environ["LOCAL_CLASSIFIER_THRESHOLD"] = "1.1"
+        os.environ["INTENT_MODEL_PATH"] = os.devnull
+
+
+def create_stubs(args) -> dict:
+    return {
+        "gemini": UpstreamStub("gemini", LatencyModel(args.gemini_latency), args.gemini_error_rate, args.seed),
+        "perplexity": StubPerplexityClient("perplexity", LatencyModel(args.perplexity_latency), args.perplexity_error_rate, args.seed),
+        "elevenlabs": StubElevenLabsBackend("elevenlabs", LatencyModel(args.tts_latency), args.tts_error_rate, args.seed),
+    }
+
+
+def install_stubs(services, stubs: dict) -> None:
+    services.classification_llm = StubLLMProvider("classification", stubs["gemini"])
+    services.context_llm = StubLLMProvider("context", stubs["gemini"])
+    services.generation_llm = StubLLMProvider("generation", stubs["gemini"])
+    services.perplexity_client = stubs["perplexity"]
+    services.perplexity_api_key = "offline-benchmark"
+    services.tts_backend = stubs["elevenlabs"]
+
+
+async def drive(app, app_name: str, args) -> dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    messages = MESSAGES[app_name]
+    plan = [(f"bench-{i % args.customers}", rng.choice(messages)) for i in range(args.requests)]
+    latencies = []
+    failures = 0
+    shed = 0
+    next_index = 0
+
+    async def worker(client) -> None:
+        nonlocal failures, shed, next_index
+        while next_index < len(plan):
+            customer_id, message = plan[next_index]
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await client.post(args.endpoint, json={"message": message, "customer_id": customer_id})
+                await response.aread()
+                failures += response.status_code != 200
+                shed += response.status_code == 429
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(args.concurrency)])
+        duration = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "duration_seconds": round(duration, 3),
+        "throughput_rps": round(len(plan) / duration, 2) if duration else 0.0,
+        "errors": failures,
+        "error_rate": round(failures / len(plan), 4) if plan else 0.0,
+        "shed": shed,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+            "p50": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99": round(percentile(ordered, 0.99) * 1000, 2),
+            "max": round(ordered[-1] * 1000, 2) if ordered else 0.0
+        }
+    }
+
+
+def run_worker(app_name: str, args) -> dict:
+    """Benchmark one app in this process (each app gets its own process: both have a `main` module)"""
+    configure_environment(args)
+    directory, modules = APPS[app_name]
+    sys.path[:0] = [directory, SALES_DIR]
+    os.chdir(directory)
+    stubs = create_stubs(args)
+    for module in modules:
+        install_stubs(importlib.import_module(module), stubs)
+    import main
+    from metrics import ERRORS, STAGE_SECONDS
+
+    result = asyncio.run(drive(main.app, app_name, args))
+    requests = args.requests
+    # A sentence whose synthesis failed is skipped from a 200 audio stream; count it as an error
+    skipped = int(ERRORS.value(stage="tts_sentence"))
+    result["errors"] += skipped
+    result["error_rate"] = round(result["errors"] / requests, 4) if requests else 0.0
+    return {
+        "app": app_name,
+        "endpoint": args.endpoint,
+        "requests": requests,
+        "concurrency": args.concurrency,
+        **result,
+        "tts_sentences_skipped": skipped,
+        "upstream_calls_per_request": {
+            **{name: round(stub.calls / requests, 3) for name, stub in stubs.items()},
+            "total": round(sum(stub.calls for stub in stubs.values()) / requests, 3)
+        },
+        "upstream_errors": {name: stub.errors for name, stub in stubs.items()},
+        "stages": STAGE_SECONDS.snapshot()
+    }
+
+
+def run_startup_worker(app_name: str, args) -> dict:
+    """
+    One cold start: time `import main` and the lifespan startup until the app can serve,
+    then how long the background warm-up takes. Dummy credentials make every client
+    eligible for warm-up; pre-connecting is disabled to stay offline.
+    """
+    for key in ("GEMINI_API_KEY", "PERPLEXITY_API_KEY", "ELEVENLABS_API_KEY"):
+        os.environ.setdefault(key, "offline-benchmark")
+    os.environ["WARMUP_PRECONNECT"] = "false"
+    os.environ["LOG_STORE_BACKEND"] = "memory"
+    directory, _ = APPS[app_name]
+    sys.path.insert(0, directory)
+    os.chdir(directory)
+
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    eager = [name for name in DEFERRED_MODULES if name in sys.modules]
+
+    async def start() -> tuple:
+        lifespan_started = time.perf_counter()
+        async with main.app.router.lifespan_context(main.app):
+            ready = time.perf_counter()
+            await main.warm_up.wait(timeout=60)
+            warmed = time.perf_counter()
+        return ready - lifespan_started, warmed - ready
+
+    lifespan_seconds, warm_up_seconds = asyncio.run(start())
+    import_seconds = imported - started
+    return {
+        "app": app_name,
+        "import_ms": round(import_seconds * 1000, 1),
+        "lifespan_ms": round(lifespan_seconds * 1000, 1),
+        "ready_ms": round((import_seconds + lifespan_seconds) * 1000, 1),
+        "warm_up_ms": round(warm_up_seconds * 1000, 1),
+        "warm_up_steps": main.warm_up.stats()["steps"],
+        "imported_at_startup": eager
+    }
+
+
+def startup_budget(args) -> list:
+    """Median of `--startup-runs` cold starts per app, each in a fresh interpreter"""
+    results = []
+    for app_name in args.apps.split(","):
+        runs = []
+        for _ in range(args.startup_runs):
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--startup", "--worker", app_name],
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                sys.stderr.write(completed.stderr)
+                raise SystemExit(f"Startup benchmark of '{app_name}' failed")
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        result = {"app": app_name, "runs": len(runs)}
+        for field in ("import_ms", "lifespan_ms", "ready_ms", "warm_up_ms"):
+            result[field] = percentile(sorted(run[field] for run in runs), 0.5)
+        result["imported_at_startup"] = sorted({name for run in runs for name in run["imported_at_startup"]})
+        result["warm_up_steps"] = runs[-1]["warm_up_steps"]
+        results.append(result)
+    return results
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """Regressions against a previous results file: p95 or upstream calls up, or throughput down, by more than `tolerance`"""
+    with open(baseline_path) as f:
+        baseline = {(r["app"], r["endpoint"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get((result["app"], result["endpoint"]))
+        if before is None:
+            continue
+        checks = (
+            ("latency_ms.p95", before["latency_ms"]["p95"], result["latency_ms"]["p95"], 1),
+            ("throughput_rps", before["throughput_rps"], result["throughput_rps"], -1),
+            ("upstream_calls_per_request.total", before["upstream_calls_per_request"]["total"],
+             result["upstream_calls_per_request"]["total"], 1),
+        )
+        for metric, old, new, direction in checks:
+            if old and direction * (new - old) / old > tolerance:
+                regressions.append(f"{result['app']} {result['endpoint']} {metric}: {old} -> {new}")
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the support and sales apps with stub upstreams")
+    parser.add_argument("--apps", default="support,sales", help="Comma-separated: support, sales")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="/chat")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--customers", type=int, default=50, help="Distinct customer_ids to spread requests over")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--gemini-latency", default="lognormal:350:0.4")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--perplexity-latency", default="lognormal:800:0.5")
+    parser.add_argument("--perplexity-error-rate", type=float, default=0.0)
+    parser.add_argument("--tts-latency", default="lognormal:250:0.3")
+    parser.add_argument("--tts-error-rate", type=float, default=0.0)
+    parser.add_argument("--caches", action="store_true", help="Leave the response and context caches enabled")
+    parser.add_argument("--no-local-classifier", action="store_true", help="Send every classification to the LLM")
+    parser.add_argument("--out", help="Write the JSON results here")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression vs the baseline")
+    parser.add_argument("--startup", action="store_true", help="Measure cold-start time against --startup-budget-ms instead of load")
+    parser.add_argument("--startup-runs", type=int, default=5)
+    parser.add_argument("--startup-budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "1500")),
+                        help="Max median time from interpreter start of `import main` until the app can serve")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    if args.worker:
+        print(json.dumps((run_startup_worker if args.startup else run_worker)(args.worker, args)))
+        return
+
+    if args.startup:
+        results = startup_budget(args)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump({"generated_at": datetime.now(timezone.utc).isoformat(), "budget_ms": args.startup_budget_ms, "results": results}, f, indent=2)
+        failures = []
+        for r in results:
+            print(
+                f"{r['app']:8} ready {r['ready_ms']:8.1f}ms (import {r['import_ms']:.1f}ms, lifespan {r['lifespan_ms']:.1f}ms)  "
+                f"background warm-up {r['warm_up_ms']:.1f}ms  budget {args.startup_budget_ms:.0f}ms"
+            )
+            if r["ready_ms"] > args.startup_budget_ms:
+                failures.append(f"{r['app']} ready in {r['ready_ms']}ms, budget {args.startup_budget_ms}ms")
+            if r["imported_at_startup"]:
+                failures.append(f"{r['app']} imports {', '.join(r['imported_at_startup'])} at startup instead of during warm-up")
+        for line in failures:
+            print(f"OVER BUDGET {line}")
+        if failures:
+            raise SystemExit(1)
+        return
+
+    results = []
+    for app_name in args.apps.split(","):
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--worker", app_name],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr)
+            raise SystemExit(f"Benchmark of '{app_name}' failed")
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("worker", "out", "baseline")},
+        "results": results
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for r in results:
+        print(
+            f"{r['app']:8} {r['endpoint']:14} {r['throughput_rps']:8.1f} req/s  "
+            f"p50 {r['latency_ms']['p50']:8.1f}ms  p95 {r['latency_ms']['p95']:8.1f}ms  p99 {r['latency_ms']['p99']:8.1f}ms  "
+            f"errors {r['error_rate']:.1%}  upstream/req {r['upstream_calls_per_request']['total']}"
+        )
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
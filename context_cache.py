@@ -0,0 +1,172 @@
+# TTL cache for context lookups with request coalescing and stale-while-revalidate
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from response_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+# (topic, pattern, ttl_seconds): first match wins. Promotions change often, device specs rarely.
+DEFAULT_TOPIC_TTLS = [
+    ("promotion", r"\b(promo(tion)?s?|deals?|discounts?|offers?|sale)\b", 15 * 60),
+    ("outage", r"\b(outage|down|not working|no (signal|service))\b", 5 * 60),
+    ("device", r"\b(iphone|galaxy|pixel|phones?|tablets?|devices?|specs?)\b", 24 * 3600),
+    ("plan", r"\b(plans?|unlimited|5g|data|prepaid|postpaid)\b", 6 * 3600),
+    ("policy", r"\b(polic(y|ies)|fees?|contract|return|cancel(lation)?)\b", 12 * 3600),
+]
+
+
+class ContextEntry:
+    __slots__ = ("value", "topic", "fresh_until", "stale_until")
+
+    def __init__(self, value: str, topic: str, fresh_until: float, stale_until: float):
+        self.value = value
+        self.topic = topic
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class ContextCache:
+    """
+    Caches non-personalized context per normalized query.
+
+    Fresh entries are returned directly. Entries past their topic TTL but within
+    the stale window are returned immediately while one background task refreshes
+    them. Concurrent misses for the same query share a single upstream fetch.
+    With a `shared` store, entries are written through to it and local misses are
+    filled from it, so other worker processes' fetches count as hits. Its blocking
+    reads and writes run off the event loop.
+    """
+
+    def __init__(self, default_ttl: float = 3600, stale_seconds: float = 86400, max_entries: int = 10000,
+                 topic_ttls: Optional[list] = None, skip_values: tuple = (), shared=None, namespace: str = "context"):
+        self.default_ttl = default_ttl
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.topic_ttls = [(topic, re.compile(p, re.IGNORECASE), ttl) for topic, p, ttl in (topic_ttls or DEFAULT_TOPIC_TTLS)]
+        # Placeholder/error strings that must never be cached
+        self.skip_values = set(skip_values)
+        self.shared = shared
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._background = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.shared_hits = 0
+
+    def topic_for(self, query: str) -> tuple:
+        for topic, pattern, ttl in self.topic_ttls:
+            if pattern.search(query):
+                return topic, ttl
+        return "general", self.default_ttl
+
+    async def _store(self, key: str, query: str, value: str) -> None:
+        if not value or value in self.skip_values:
+            return
+        topic, ttl = self.topic_for(query)
+        now = time.time()
+        entry = ContextEntry(value, topic, now + ttl, now + ttl + self.stale_seconds)
+        self._remember(key, entry)
+        if self.shared:
+            await asyncio.to_thread(
+                self.shared.put, self.namespace, key,
+                {"value": value, "topic": topic, "fresh_until": entry.fresh_until, "stale_until": entry.stale_until},
+                ttl + self.stale_seconds
+            )
+
+    def _remember(self, key: str, entry: ContextEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load_shared(self, key: str) -> Optional[ContextEntry]:
+        row = await asyncio.to_thread(self.shared.get, self.namespace, key) if self.shared else None
+        if row is None:
+            return None
+        self.shared_hits += 1
+        entry = ContextEntry(row["value"], row["topic"], row["fresh_until"], row["stale_until"])
+        self._remember(key, entry)
+        return entry
+
+    async def _lookup(self, key: str) -> tuple:
+        """Return (entry, is_fresh); expired entries are dropped"""
+        entry = self._entries.get(key)
+        if entry is None or (self.shared and time.time() >= entry.fresh_until):
+            # Another worker may hold a newer copy
+            entry = await self._load_shared(key) or entry
+        if entry is None:
+            return None, False
+        now = time.time()
+        if now >= entry.stale_until:
+            self._entries.pop(key, None)
+            return None, False
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        return entry, now < entry.fresh_until
+
+    def _start_fetch(self, key: str, query: str, fetch: Callable[[str], Awaitable[str]]) -> asyncio.Task:
+        async def run() -> str:
+            try:
+                value = await fetch(query)
+                await self._store(key, query, value)
+                return value
+            finally:
+                self._inflight.pop(key, None)
+
+        task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        return task
+
+    async def get_or_fetch(self, query: str, fetch: Callable[[str], Awaitable[str]], scope: str = "") -> str:
+        """`scope` keeps callers whose `fetch` answers the same query differently apart"""
+        key = f"{scope}|{normalize_message(query)}" if scope else normalize_message(query)
+        entry, fresh = await self._lookup(key)
+        if entry and fresh:
+            self.hits += 1
+            return entry.value
+
+        if entry:
+            self.stale_hits += 1
+            if key not in self._inflight:
+                self.refreshes += 1
+                task = self._start_fetch(key, query, fetch)
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+                logger.info(f"Serving stale context ({entry.topic}), refreshing in background")
+            return entry.value
+
+        task = self._inflight.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._start_fetch(key, query, fetch)
+        # Shield so a caller's timeout does not cancel the fetch other callers are waiting on
+        return await asyncio.shield(task)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "background_refreshes": self.refreshes,
+            "shared_hits": self.shared_hits,
+            "inflight": len(self._inflight),
+            "hit_rate": (self.hits + self.stale_hits + self.coalesced) / lookups if lookups else 0.0
+        }
@@ -0,0 +1,216 @@
+# Per-request token and cost accounting for Gemini, Perplexity and ElevenLabs calls
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# USD. Token rates per million tokens; TTS per thousand characters. Keyed by model,
+# falling back to the provider entry. Override with a JSON file at COST_RATES_PATH.
+DEFAULT_RATES = {
+    "gemini": {"prompt_per_million": 0.075, "completion_per_million": 0.30},
+    "gemini-2.0-flash-lite": {"prompt_per_million": 0.075, "completion_per_million": 0.30},
+    "perplexity": {"prompt_per_million": 1.0, "completion_per_million": 1.0, "per_request": 0.005},
+    "sonar": {"prompt_per_million": 1.0, "completion_per_million": 1.0, "per_request": 0.005},
+    "elevenlabs": {"per_1k_characters": 0.30},
+}
+
+_current_usage = ContextVar("request_usage", default=None)
+
+
+def load_rates() -> dict:
+    rates = {name: dict(rate) for name, rate in DEFAULT_RATES.items()}
+    path = os.getenv("COST_RATES_PATH")
+    if path:
+        try:
+            with open(path) as f:
+                for name, rate in json.load(f).items():
+                    rates.setdefault(name, {}).update(rate)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load cost rates from {path}: {e}")
+    return rates
+
+
+RATES = load_rates()
+
+
+def price(provider: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0, characters: int = 0) -> float:
+    rate = RATES.get(model) or RATES.get(provider, {})
+    return (
+        prompt_tokens * rate.get("prompt_per_million", 0.0) / 1_000_000
+        + completion_tokens * rate.get("completion_per_million", 0.0) / 1_000_000
+        + characters * rate.get("per_1k_characters", 0.0) / 1000
+        + rate.get("per_request", 0.0)
+    )
+
+
+class RequestUsage:
+    """Upstream calls made on behalf of one request"""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add(self, provider: str, model: str, stage: str, prompt_tokens: int = 0,
+            completion_tokens: int = 0, characters: int = 0) -> None:
+        call = {
+            "provider": provider,
+            "model": model,
+            "stage": stage,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "characters": characters,
+            "cost": price(provider, model, prompt_tokens, completion_tokens, characters)
+        }
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self, shared_cost: float = 0.0, share: float = 1.0) -> dict:
+        """
+        Totals plus a per-stage breakdown; `shared_cost` adds this request's share of batched
+        calls. With `share` below 1 the calls answered several requests (duplicate batch
+        items) and only that fraction of their cost and tokens is charged to this one.
+        """
+        with self._lock:
+            calls = list(self.calls)
+        by_stage = {}
+        for call in calls:
+            stage = by_stage.setdefault(call["stage"], {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "characters": 0, "cost": 0.0})
+            stage["calls"] += 1
+            for field in ("prompt_tokens", "completion_tokens", "characters", "cost"):
+                stage[field] += call[field]
+        for stage in by_stage.values():
+            for field in ("prompt_tokens", "completion_tokens", "characters"):
+                stage[field] = _scale(stage[field], share)
+            stage["cost"] = round(stage["cost"] * share, 8)
+        summary = {
+            "total_cost": round((sum(call["cost"] for call in calls) + shared_cost) * share, 8),
+            "shared_cost": round(shared_cost * share, 8),
+            "upstream_calls": len(calls),
+            "prompt_tokens": _scale(sum(call["prompt_tokens"] for call in calls), share),
+            "completion_tokens": _scale(sum(call["completion_tokens"] for call in calls), share),
+            "tts_characters": _scale(sum(call["characters"] for call in calls), share),
+            "by_stage": by_stage
+        }
+        if share != 1.0:
+            summary["share"] = round(share, 6)
+        return summary
+
+
+def _scale(count: int, share: float):
+    return count if share == 1.0 else round(count * share, 2)
+
+
+def start_request_usage() -> RequestUsage:
+    """
+    Begin accounting for the current request. Tasks and threads started afterwards
+    (gather, to_thread) inherit it; a micro-batched call is charged to the request
+    that opened its batch window.
+    """
+    usage = RequestUsage()
+    _current_usage.set(usage)
+    return usage
+
+
+def current_usage() -> Optional[RequestUsage]:
+    return _current_usage.get()
+
+
+def record_llm(provider: str, model: str, stage: str, prompt_tokens: int, completion_tokens: int) -> None:
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(provider, model, stage, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def record_perplexity(stage: str, result: dict) -> None:
+    usage = _current_usage.get()
+    if usage is None:
+        return
+    tokens = result.get("usage", {})
+    usage.add(
+        "perplexity", result.get("model", "sonar"), stage,
+        prompt_tokens=tokens.get("prompt_tokens", 0),
+        completion_tokens=tokens.get("completion_tokens", 0)
+    )
+
+
+def record_tts(model: str, characters: int) -> None:
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add("elevenlabs", model, "tts", characters=characters)
+
+
+class UsageAggregates:
+    """
+    Rolling per-agent and per-customer totals over the last `window_seconds`, kept in
+    `bucket_seconds` buckets. Only the `max_customers` most recently active customers
+    are tracked.
+    """
+
+    FIELDS = ("requests", "cost", "prompt_tokens", "completion_tokens", "tts_characters")
+
+    def __init__(self, window_seconds: float = 3600, bucket_seconds: float = 60, max_customers: int = 10000):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.max_customers = max_customers
+        self._agents = {}
+        self._customers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _add(self, buckets: deque, bucket: int, values: tuple) -> None:
+        oldest = bucket - int(self.window_seconds // self.bucket_seconds)
+        while buckets and buckets[0][0] < oldest:
+            buckets.popleft()
+        if not buckets or buckets[-1][0] != bucket:
+            buckets.append([bucket, *([0] * len(self.FIELDS))])
+        for i, value in enumerate(values, 1):
+            buckets[-1][i] += value
+
+    def record(self, agent_type: str, customer_id: str, summary: dict, new_request: bool = True) -> None:
+        """Add a request's usage summary; follow-up calls for the same request pass new_request=False"""
+        bucket = int(time.time() // self.bucket_seconds)
+        values = (int(new_request), summary["total_cost"], summary["prompt_tokens"], summary["completion_tokens"], summary["tts_characters"])
+        with self._lock:
+            self._add(self._agents.setdefault(agent_type, deque()), bucket, values)
+            if customer_id not in self._customers:
+                self._customers[customer_id] = deque()
+            self._customers.move_to_end(customer_id)
+            self._add(self._customers[customer_id], bucket, values)
+            while len(self._customers) > self.max_customers:
+                self._customers.popitem(last=False)
+
+    def _totals(self, buckets: deque, oldest: int) -> dict:
+        while buckets and buckets[0][0] < oldest:
+            buckets.popleft()
+        totals = dict.fromkeys(self.FIELDS, 0)
+        for bucket in buckets:
+            for i, field in enumerate(self.FIELDS, 1):
+                totals[field] += bucket[i]
+        totals["cost"] = round(totals["cost"], 6)
+        totals["avg_cost_per_request"] = round(totals["cost"] / totals["requests"], 8) if totals["requests"] else 0.0
+        return totals
+
+    def stats(self, customer_id: Optional[str] = None, top: int = 20) -> dict:
+        oldest = int((time.time() - self.window_seconds) // self.bucket_seconds)
+        with self._lock:
+            agents = {agent: self._totals(buckets, oldest) for agent, buckets in self._agents.items()}
+            if customer_id is not None:
+                buckets = self._customers.get(customer_id, deque())
+                customers = {customer_id: self._totals(buckets, oldest)}
+            else:
+                customers = {cid: self._totals(buckets, oldest) for cid, buckets in self._customers.items()}
+                customers = dict(sorted(customers.items(), key=lambda item: item[1]["cost"], reverse=True)[:top])
+        return {"window_seconds": self.window_seconds, "by_agent": agents, "by_customer": customers}
+
+
+def create_usage_aggregates() -> UsageAggregates:
+    return UsageAggregates(
+        window_seconds=float(os.getenv("COST_WINDOW_SECONDS", "3600")),
+        max_customers=int(os.getenv("COST_MAX_CUSTOMERS", "10000"))
+    )
@@ -0,0 +1,69 @@
+# Process pool for CPU-bound local work (classifier training and bulk inference)
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", "1"))
+# Batches smaller than this are classified inline: pickling to a worker costs more than the work
+CPU_POOL_MIN_BATCH = int(os.getenv("CPU_POOL_MIN_BATCH", "256"))
+
+_pool = None
+_lock = threading.Lock()
+tasks = 0
+
+
+def get_cpu_pool():
+    """
+    The process-wide pool, or None with CPU_POOL_WORKERS=0 (work then runs in a thread).
+    Workers are forked on first use, so start_cpu_pool() runs it at startup before the
+    server has threads of its own.
+    """
+    global _pool
+    if CPU_POOL_WORKERS <= 0:
+        return None
+    with _lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            _pool = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS, mp_context=context)
+            logger.info(f"CPU pool started with {CPU_POOL_WORKERS} worker processes")
+    return _pool
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+def start_cpu_pool() -> None:
+    pool = get_cpu_pool()
+    if pool is not None:
+        pool.submit(_ready).result()
+
+
+async def run_cpu(func: Callable, *args):
+    """Run a picklable function with picklable arguments in the pool, off the event loop"""
+    global tasks
+    tasks += 1
+    pool = get_cpu_pool()
+    if pool is None:
+        return await asyncio.to_thread(func, *args)
+    return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+
+def shutdown_cpu_pool() -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def stats() -> dict:
+    return {"workers": CPU_POOL_WORKERS if _pool is not None else 0, "tasks": tasks}
@@ -0,0 +1,248 @@
+# Shared pooled HTTP clients with timeouts, retries and a circuit breaker
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is short-circuited because the upstream is unhealthy"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and rejects calls
+    for `reset_seconds`. After that a single trial call is let through
+    (half-open). If it succeeds the breaker closes, otherwise it opens again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.trial_started_at = 0.0
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            # A trial that never reported back (e.g. its caller was cancelled) expires after reset_seconds
+            trial_expired = time.monotonic() - self.trial_started_at >= self.reset_seconds
+            if state == "half_open" and (not self.trial_in_flight or trial_expired):
+                self.trial_in_flight = True
+                self.trial_started_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit '{self.name}' closed")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.opens += 1
+                    logger.warning(f"Circuit '{self.name}' opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+class PooledHTTPClient:
+    """Keep-alive sync and async (httpx) clients sharing one retry and breaker policy"""
+
+    def __init__(self, name: str, pool_size: int = 20, connect_timeout: float = 3.0, read_timeout: float = 10.0,
+                 max_retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 4.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker(name)
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.short_circuited = 0
+
+    def _client_options(self) -> dict:
+        return {
+            "timeout": httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            "limits": httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        }
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(**self._client_options())
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(**self._client_options())
+        return self._async_client
+
+    async def preconnect(self, url: str) -> bool:
+        """
+        Open a pooled keep-alive connection (DNS, TCP and TLS) ahead of the first real
+        request. The response status is irrelevant and failures are not counted by the breaker.
+        """
+        try:
+            await self.async_client.head(url)
+            return True
+        except httpx.HTTPError as e:
+            logger.info(f"{self.name} pre-connect to {url} failed: {e}")
+            return False
+
+    def is_available(self) -> bool:
+        return self.breaker.state != "open"
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter: spreads retries from many workers so they don't stampede a recovering upstream
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _check_breaker(self) -> None:
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise CircuitOpenError(f"Circuit '{self.name}' is open")
+
+    def post(self, url: str, **kwargs) -> httpx.Response:
+        self._check_breaker()
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            try:
+                response = self.client.post(url, **kwargs)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                if attempt == self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                logger.warning(f"{self.name} request failed ({e}), retrying")
+                retry_after = None
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                if attempt == self.max_retries:
+                    self.breaker.record_failure()
+                    return response
+                logger.warning(f"{self.name} returned {response.status_code}, retrying")
+                retry_after = response.headers.get("Retry-After")
+            self.retries += 1
+            time.sleep(self._backoff(attempt, retry_after))
+
+    async def post_async(self, url: str, **kwargs) -> httpx.Response:
+        self._check_breaker()
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            try:
+                response = await self.async_client.post(url, **kwargs)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                if attempt == self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                logger.warning(f"{self.name} request failed ({e}), retrying")
+                retry_after = None
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                if attempt == self.max_retries:
+                    self.breaker.record_failure()
+                    return response
+                logger.warning(f"{self.name} returned {response.status_code}, retrying")
+                retry_after = response.headers.get("Retry-After")
+            self.retries += 1
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "short_circuited": self.short_circuited,
+            "circuit_state": self.breaker.state,
+            "circuit_open": int(self.breaker.state == "open"),
+            "circuit_opens": self.breaker.opens
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_http_client(name: str) -> PooledHTTPClient:
+    """Process-wide client per upstream, configured from HTTP_* / CIRCUIT_* environment variables"""
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = PooledHTTPClient(
+                name,
+                pool_size=int(os.getenv("HTTP_POOL_SIZE", "20")),
+                connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "3")),
+                read_timeout=float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "10")),
+                max_retries=int(os.getenv("HTTP_MAX_RETRIES", "2")),
+                breaker=CircuitBreaker(
+                    name,
+                    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+                    reset_seconds=float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+                )
+            )
+        return _clients[name]
+
+
+async def close_http_clients() -> None:
+    for client in list(_clients.values()):
+        await client.aclose()
+
+
+def http_client_stats() -> dict:
+    """Retry, short-circuit and circuit-breaker counters per upstream client created so far"""
+    return {name: client.stats() for name, client in _clients.items()}
@@ -0,0 +1,293 @@
+# LLM provider interface with Gemini, Perplexity and local mock implementations
+
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import AsyncIterator, Optional
+
+from cost_tracker import record_llm
+from token_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gemini:gemini-2.0-flash-lite"
+PERPLEXITY_URL = "https://api.perplexity.ai/openai/v1/chat/completions"
+
+# One provider (and so one SDK client) per (provider, model, stage) per process, shared by
+# every agent hosted in it
+_providers = {}
+
+
+class ProviderUnavailable(Exception):
+    """The provider selected for a stage cannot be used (missing credentials or SDK)"""
+
+
+class LLMResponse:
+    __slots__ = ("text", "prompt_tokens", "completion_tokens")
+
+    def __init__(self, text: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class LLMProvider:
+    """
+    One model serving one pipeline stage. Subclasses implement `_generate` and
+    `_generate_async`, and `_stream` if the backend can stream; token usage of every
+    call is charged to the current request under this instance's stage.
+    """
+
+    provider = "base"
+
+    def __init__(self, model: str, stage: str):
+        self.model = model
+        self.stage = stage
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+    def available(self) -> bool:
+        """Whether credentials are configured; checked without importing SDKs or touching the network"""
+        return True
+
+    def warm_up(self) -> None:
+        """Import the SDK and build the client ahead of the first call (safe to call from any thread)"""
+
+    def _record(self, response: LLMResponse) -> LLMResponse:
+        record_llm(self.provider, self.model, self.stage, response.prompt_tokens, response.completion_tokens)
+        return response
+
+    def generate(self, prompt: str, json_output: bool = False) -> LLMResponse:
+        return self._record(self._generate(prompt, json_output))
+
+    async def generate_async(self, prompt: str, json_output: bool = False) -> LLMResponse:
+        return self._record(await self._generate_async(prompt, json_output))
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield text chunks; usage is recorded once the stream is exhausted"""
+        usage = LLMResponse("")
+        async for chunk in self._stream(prompt, usage):
+            yield chunk
+        self._record(usage)
+
+    async def batch(self, prompts: list, json_output: bool = False) -> list:
+        """Run prompts concurrently; a failed prompt yields its exception in place of a response"""
+        return await asyncio.gather(*[self.generate_async(p, json_output) for p in prompts], return_exceptions=True)
+
+    def _generate(self, prompt: str, json_output: bool) -> LLMResponse:
+        raise NotImplementedError
+
+    async def _generate_async(self, prompt: str, json_output: bool) -> LLMResponse:
+        return await asyncio.to_thread(self._generate, prompt, json_output)
+
+    async def _stream(self, prompt: str, usage: LLMResponse) -> AsyncIterator[str]:
+        response = await self._generate_async(prompt, False)
+        usage.prompt_tokens, usage.completion_tokens = response.prompt_tokens, response.completion_tokens
+        yield response.text
+
+
+class GeminiProvider(LLMProvider):
+    provider = "gemini"
+
+    def __init__(self, model: str, stage: str, api_key: Optional[str]):
+        super().__init__(model, stage)
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Built on first use (or by warm_up) so importing the app never loads the SDK
+        if self._client is None:
+            if not self.api_key:
+                raise ProviderUnavailable("GEMINI_API_KEY not found in environment variables")
+            with self._lock:
+                if self._client is None:
+                    import google.generativeai as genai
+
+                    genai.configure(api_key=self.api_key)
+                    self._client = genai.GenerativeModel(self.model)
+        return self._client
+
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def warm_up(self) -> None:
+        if self.api_key:
+            self.client
+
+    @staticmethod
+    def _response(response) -> LLMResponse:
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            response.text,
+            getattr(usage, "prompt_token_count", 0) or 0,
+            getattr(usage, "candidates_token_count", 0) or 0
+        )
+
+    @staticmethod
+    def _config(json_output: bool) -> Optional[dict]:
+        return {"response_mime_type": "application/json"} if json_output else None
+
+    def _generate(self, prompt: str, json_output: bool) -> LLMResponse:
+        return self._response(self.client.generate_content(prompt, generation_config=self._config(json_output)))
+
+    async def _generate_async(self, prompt: str, json_output: bool) -> LLMResponse:
+        return self._response(await self.client.generate_content_async(prompt, generation_config=self._config(json_output)))
+
+    async def _stream(self, prompt: str, usage: LLMResponse) -> AsyncIterator[str]:
+        response = await self.client.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+        metadata = getattr(response, "usage_metadata", None)
+        usage.prompt_tokens = getattr(metadata, "prompt_token_count", 0) or 0
+        usage.completion_tokens = getattr(metadata, "candidates_token_count", 0) or 0
+
+
+class PerplexityProvider(LLMProvider):
+    """Chat completions over the pooled Perplexity client (streams arrive as one chunk)"""
+
+    provider = "perplexity"
+
+    def __init__(self, model: str, stage: str, api_key: Optional[str]):
+        super().__init__(model, stage)
+        from http_client import get_http_client
+
+        self.api_key = api_key
+        self.client = get_http_client("perplexity")
+
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def _headers(self) -> dict:
+        if not self.api_key:
+            raise ProviderUnavailable("PERPLEXITY_API_KEY not found in environment variables")
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _request(self, prompt: str) -> dict:
+        return {"model": self.model, "messages": [{"role": "user", "content": prompt}]}
+
+    def _response(self, response) -> LLMResponse:
+        if response.status_code != 200:
+            raise RuntimeError(f"Perplexity returned HTTP {response.status_code}")
+        result = response.json()
+        usage = result.get("usage", {})
+        return LLMResponse(
+            result.get("choices", [{}])[0].get("message", {}).get("content", ""),
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0)
+        )
+
+    def _generate(self, prompt: str, json_output: bool) -> LLMResponse:
+        return self._response(self.client.post(PERPLEXITY_URL, headers=self._headers(), json=self._request(prompt)))
+
+    async def _generate_async(self, prompt: str, json_output: bool) -> LLMResponse:
+        return self._response(await self.client.post_async(PERPLEXITY_URL, headers=self._headers(), json=self._request(prompt)))
+
+
+class MockProvider(LLMProvider):
+    """
+    Deterministic local model for tests, demos and benchmarks: picks a classification
+    label from the prompt, answers batch prompts with JSON, and returns canned
+    context and responses. MOCK_LLM_LATENCY_MS adds a fixed delay per call.
+    """
+
+    provider = "mock"
+    LABELS = re.compile(r"as ONE of: ([a-z_/, ]+)\.")
+    CONTEXT_PROMPTS = ("Provide accurate information", "Provide general factual")
+    RESPONSE = (
+        "Thanks for reaching out. I've looked into this for you, and here is what I can tell you. "
+        "Your request has been noted and the details are on your account. Is there anything else I can help with?"
+    )
+
+    def __init__(self, model: str = "mock", stage: str = "generation", latency_seconds: float = 0.0):
+        super().__init__(model, stage)
+        self.latency_seconds = latency_seconds
+
+    @staticmethod
+    def label(text: str, choices: list) -> str:
+        text = text.lower()
+        for choice in choices:
+            if choice.rpartition("/")[2].split("_")[0][:4] in text:
+                return choice
+        return choices[sum(map(ord, text)) % len(choices)]
+
+    def answer(self, prompt: str) -> str:
+        labels = self.LABELS.search(prompt)
+        if labels:
+            choices = [label.strip() for label in labels.group(1).split(",")]
+            numbered = re.findall(r"^\[(\d+)\] (.*)$", prompt, re.MULTILINE)
+            if numbered:
+                return json.dumps({n: self.label(text, choices) for n, text in numbered})
+            return self.label(prompt.rsplit("Message:", 1)[-1], choices)
+        if prompt.startswith(self.CONTEXT_PROMPTS):
+            return "Plans are billed monthly. Late fees apply after 30 days. Autopay customers receive a discount."
+        return self.RESPONSE
+
+    def _response(self, prompt: str) -> LLMResponse:
+        text = self.answer(prompt)
+        return LLMResponse(text, estimate_tokens(prompt), estimate_tokens(text))
+
+    def _generate(self, prompt: str, json_output: bool) -> LLMResponse:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return self._response(prompt)
+
+    async def _generate_async(self, prompt: str, json_output: bool) -> LLMResponse:
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        return self._response(prompt)
+
+    async def _stream(self, prompt: str, usage: LLMResponse) -> AsyncIterator[str]:
+        response = await self._generate_async(prompt, False)
+        usage.prompt_tokens, usage.completion_tokens = response.prompt_tokens, response.completion_tokens
+        words = response.text.split(" ")
+        for start in range(0, len(words), 8):
+            yield " ".join(words[start:start + 8]) + (" " if start + 8 < len(words) else "")
+
+
+def parse_model_spec(spec: str) -> tuple:
+    """'gemini:gemini-1.5-pro' -> ('gemini', 'gemini-1.5-pro'); a bare provider uses its default model"""
+    provider, _, model = spec.partition(":")
+    defaults = {"gemini": "gemini-2.0-flash-lite", "perplexity": "sonar", "mock": "mock"}
+    if provider not in defaults:
+        raise ValueError(f"Unknown LLM provider '{provider}' in '{spec}'")
+    return provider, model or defaults[provider]
+
+
+def create_provider(stage: str, required: bool = True) -> Optional[LLMProvider]:
+    """
+    Provider for a pipeline stage from LLM_<STAGE>_MODEL (e.g. LLM_CLASSIFICATION_MODEL=
+    gemini:gemini-2.0-flash-lite), falling back to LLM_MODEL. Nothing is imported or
+    connected here; the SDK client is built by warm_up() or the first call. Without
+    credentials a `required` stage still gets its provider, whose calls raise
+    ProviderUnavailable (so callers fall back), and an optional stage gets None.
+    Repeated calls for the same stage return the same instance.
+    """
+    spec = os.getenv(f"LLM_{stage.upper()}_MODEL") or os.getenv("LLM_MODEL", DEFAULT_MODEL)
+    provider, model = parse_model_spec(spec)
+    instance = _providers.get((provider, model, stage))
+    if instance is not None:
+        return instance if instance.available() or required else None
+    if provider == "gemini":
+        instance = GeminiProvider(model, stage, os.getenv("GEMINI_API_KEY"))
+    elif provider == "perplexity":
+        instance = PerplexityProvider(model, stage, os.getenv("PERPLEXITY_API_KEY"))
+    else:
+        instance = MockProvider(model, stage, float(os.getenv("MOCK_LLM_LATENCY_MS", "0")) / 1000)
+    _providers[(provider, model, stage)] = instance
+    if not instance.available():
+        if not required:
+            logger.warning(f"No {stage} model available ({spec}): credentials not configured")
+            return None
+        logger.error(f"{stage.capitalize()} model {instance.name} has no credentials; its calls will fail until configured")
+        return instance
+    logger.info(f"{stage.capitalize()} model: {instance.name}")
+    return instance
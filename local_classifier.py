@@ -0,0 +1,287 @@
+# Local fast-path intent classifier: keyword rules + TF-IDF logistic regression
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def extract_features(text: str) -> list:
+    """Lowercased unigrams plus adjacent-word bigrams"""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class LocalIntentClassifier:
+    """
+    Answers confidently-classified messages locally and returns None for the rest,
+    so callers only escalate ambiguous messages to Gemini.
+
+    Keyword rules are tried first and only win when exactly one label matches.
+    Otherwise a multinomial logistic regression over TF-IDF features is used,
+    trained from logged (customer_message, agent_type) pairs.
+    """
+
+    def __init__(self, labels: list, rules: dict, threshold: float = 0.85, model_path: Optional[str] = None,
+                 reload_seconds: float = 30):
+        self.labels = list(labels)
+        self.rules = {label: [re.compile(p, re.IGNORECASE) for p in patterns] for label, patterns in rules.items()}
+        self.threshold = threshold
+        self.model_path = model_path
+        # How often watch() checks model_path for a model retrained by another worker process
+        self.reload_seconds = reload_seconds
+        # (idf, weights, bias) swapped as one tuple so retraining never exposes a half-built model
+        self._model = None
+        self._model_mtime = 0.0
+        self._lock = threading.Lock()
+        self.total = 0
+        self.rule_hits = 0
+        self.model_hits = 0
+        self.escalations = 0
+
+        if model_path and os.path.exists(model_path):
+            self.load(model_path)
+
+    def __getstate__(self) -> dict:
+        # Picklable for the CPU process pool
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def is_trained(self) -> bool:
+        return self._model is not None
+
+    def match_rules(self, text: str) -> Optional[str]:
+        matched = [label for label, patterns in self.rules.items() if any(p.search(text) for p in patterns)]
+        return matched[0] if len(matched) == 1 else None
+
+    def _vectorize(self, text: str, idf: dict) -> dict:
+        counts = Counter(f for f in extract_features(text) if f in idf)
+        vector = {f: (1.0 + math.log(c)) * idf[f] for f, c in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {f: v / norm for f, v in vector.items()}
+
+    @staticmethod
+    def _softmax(scores: dict) -> dict:
+        peak = max(scores.values())
+        exps = {label: math.exp(s - peak) for label, s in scores.items()}
+        total = sum(exps.values())
+        return {label: e / total for label, e in exps.items()}
+
+    def predict_proba(self, text: str) -> dict:
+        model = self._model
+        if model is None:
+            return {}
+        idf, weights, bias = model
+        vector = self._vectorize(text, idf)
+        scores = {
+            label: bias[label] + sum(weights[label].get(f, 0.0) * v for f, v in vector.items())
+            for label in self.labels
+        }
+        return self._softmax(scores)
+
+    def classify(self, text: str) -> Optional[tuple]:
+        """predict() without updating the counters (safe to run in a worker process)"""
+        label = self.match_rules(text)
+        if label:
+            return label, 1.0, "rules"
+
+        probs = self.predict_proba(text)
+        if probs:
+            label, confidence = max(probs.items(), key=lambda item: item[1])
+            if confidence >= self.threshold:
+                return label, confidence, "model"
+        return None
+
+    def predict_many(self, texts: list) -> list:
+        return [self.classify(text) for text in texts]
+
+    def count(self, results: list) -> None:
+        """Add classify()/predict_many() results to the hit counters"""
+        for result in results:
+            self.total += 1
+            if result is None:
+                self.escalations += 1
+            elif result[2] == "rules":
+                self.rule_hits += 1
+            else:
+                self.model_hits += 1
+
+    def predict(self, text: str) -> Optional[tuple]:
+        """Return (label, confidence, source) or None when the message should be escalated"""
+        result = self.classify(text)
+        self.count([result])
+        return result
+
+    def fit(self, examples: list, epochs: int = 20, learning_rate: float = 0.5, l2: float = 1e-4, min_df: int = 1) -> Optional[tuple]:
+        """
+        Fit a model on (text, label) pairs without installing it; unknown labels are
+        skipped. Pure CPU work, so the app runs it in the process pool.
+        """
+        examples = [(text, label) for text, label in examples if label in self.labels and text]
+        if not examples:
+            return None
+
+        doc_freq = Counter()
+        for text, _ in examples:
+            doc_freq.update(set(extract_features(text)))
+        n_docs = len(examples)
+        idf = {f: math.log((1 + n_docs) / (1 + df)) + 1.0 for f, df in doc_freq.items() if df >= min_df}
+
+        data = [(self._vectorize(text, idf), label) for text, label in examples]
+        weights = {label: {} for label in self.labels}
+        bias = {label: 0.0 for label in self.labels}
+        rng = random.Random(0)
+
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for vector, target in data:
+                scores = {
+                    label: bias[label] + sum(weights[label].get(f, 0.0) * v for f, v in vector.items())
+                    for label in self.labels
+                }
+                probs = self._softmax(scores)
+                for label in self.labels:
+                    grad = probs[label] - (1.0 if label == target else 0.0)
+                    w = weights[label]
+                    for f, v in vector.items():
+                        current = w.get(f, 0.0)
+                        w[f] = current - learning_rate * (grad * v + l2 * current)
+                    bias[label] -= learning_rate * grad
+
+        weights = {label: {f: round(v, 6) for f, v in w.items() if abs(v) > 1e-6} for label, w in weights.items()}
+        return idf, weights, bias, len(examples)
+
+    def set_model(self, fitted: Optional[tuple]) -> int:
+        """Install a fit() result; returns the number of examples it was trained on"""
+        if fitted is None:
+            logger.warning("No usable training examples, local model unchanged")
+            return 0
+        idf, weights, bias, used = fitted
+        with self._lock:
+            self._model = (idf, weights, bias)
+        logger.info(f"Local classifier trained on {used} examples, {len(idf)} features")
+        return used
+
+    def train(self, examples: list, **kwargs) -> int:
+        """Fit and install the model. Returns examples used."""
+        return self.set_model(self.fit(examples, **kwargs))
+
+    def train_from_logs(self, entries: list, sub_intents_of: Optional[str] = None, **kwargs) -> int:
+        """
+        Train from interaction log entries ({"customer_message": ..., "agent_type": ...}).
+        Two-level agent types ("sales/upgrade") train the top-level label, or with
+        `sub_intents_of="sales"` the sub-intent of that intent's entries.
+        """
+        return self.train(self.examples_from_logs(entries, sub_intents_of), **kwargs)
+
+    @staticmethod
+    def examples_from_logs(entries: list, sub_intents_of: Optional[str] = None) -> list:
+        examples = []
+        for e in entries:
+            intent, _, sub_intent = e.get("agent_type", "").partition("/")
+            # Entries logged before `sub_intent` was split out carry "sales/<sub-intent>" in agent_type
+            sub_intent = e.get("sub_intent") or sub_intent
+            if sub_intents_of is None:
+                examples.append((e.get("customer_message", ""), intent))
+            elif intent == sub_intents_of and sub_intent:
+                examples.append((e.get("customer_message", ""), sub_intent))
+        return examples
+
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.model_path
+        if not path or self._model is None:
+            return
+        idf, weights, bias = self._model
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"labels": self.labels, "idf": idf, "weights": weights, "bias": bias}, f)
+        os.replace(tmp_path, path)
+        if path == self.model_path:
+            self._model_mtime = os.path.getmtime(path)
+        logger.info(f"Local classifier saved to {path}")
+
+    def load(self, path: str) -> None:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("labels") != self.labels:
+                logger.warning(f"Local classifier at {path} has different labels, ignoring")
+                return
+            with self._lock:
+                self._model = (data["idf"], data["weights"], data["bias"])
+            if path == self.model_path:
+                self._model_mtime = os.path.getmtime(path)
+            logger.info(f"Local classifier loaded from {path}")
+        except Exception as e:
+            logger.warning(f"Failed to load local classifier from {path}: {e}")
+
+    def reload_if_changed(self) -> bool:
+        """Load model_path again if another worker process saved a newer model there"""
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            return False
+        if mtime <= self._model_mtime:
+            return False
+        # Recorded first so an unusable file is not reloaded on every check
+        self._model_mtime = mtime
+        self.load(self.model_path)
+        return True
+
+    async def watch(self) -> None:
+        """Background task: reload_if_changed() every `reload_seconds`, off the event loop"""
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            await asyncio.to_thread(self.reload_if_changed)
+
+    def stats(self) -> dict:
+        local_hits = self.rule_hits + self.model_hits
+        return {
+            "trained": self.is_trained,
+            "threshold": self.threshold,
+            "total": self.total,
+            "rule_hits": self.rule_hits,
+            "model_hits": self.model_hits,
+            "escalations": self.escalations,
+            "hit_rate": local_hits / self.total if self.total else 0.0
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Retrain the local intent classifier from exported /logs JSON")
+    parser.add_argument("logs", help="JSON file: the /logs response or a list of log entries")
+    parser.add_argument("out", help="Where to write the trained model")
+    parser.add_argument("--labels", default="billing,sales,technical_support,other", help="Comma-separated label set")
+    parser.add_argument("--epochs", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.logs) as f:
+        data = json.load(f)
+    entries = data["logs"] if isinstance(data, dict) else data
+
+    classifier = LocalIntentClassifier(args.labels.split(","), rules={})
+    used = classifier.train_from_logs(entries, epochs=args.epochs)
+    classifier.save(args.out)
+    print(f"Trained on {used} examples -> {args.out}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,428 @@
+# Interaction log storage: bounded in-memory ring buffer plus optional durable backend
+
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[str]:
+    """An ISO-8601 `since`/`until` bound in the stored timestamp format; raises ValueError"""
+    return datetime.fromisoformat(value).isoformat() if value else None
+
+
+def _matches(entry: dict, customer_id: Optional[str], agent_type: Optional[str],
+             since: Optional[str], until: Optional[str]) -> bool:
+    timestamp = entry.get("timestamp", "")
+    return (
+        (not customer_id or entry.get("customer_id") == customer_id)
+        and (not agent_type or entry.get("agent_type") == agent_type)
+        and (not since or timestamp >= since)
+        and (not until or timestamp < until)
+    )
+
+
+class SQLiteLogBackend:
+    """Durable log in a WAL-mode SQLite file; safe to share between worker processes"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS interactions ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, customer_id TEXT, "
+            "agent_type TEXT, data TEXT NOT NULL)"
+        )
+        # Composite (field, id) indexes serve filtered, newest-first keyset pagination directly
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_customer ON interactions (customer_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_agent ON interactions (agent_type, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions (timestamp)")
+        self._conn.commit()
+
+    def write_batch(self, entries: list) -> None:
+        rows = [
+            (e.get("timestamp", ""), e.get("customer_id"), e.get("agent_type"), json.dumps(e))
+            for e in entries
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO interactions (timestamp, customer_id, agent_type, data) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def count(self, customer_id: Optional[str] = None, agent_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None) -> int:
+        where, params = self._where(customer_id, agent_type, since, until, None)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM interactions{where}", params).fetchone()[0]
+
+    @staticmethod
+    def parse_cursor(cursor: str) -> int:
+        return int(cursor)
+
+    def _where(self, customer_id: Optional[str], agent_type: Optional[str], since: Optional[str],
+               until: Optional[str], cursor: Optional[str]) -> tuple:
+        clauses, params = [], []
+        if customer_id:
+            clauses.append("customer_id = ?")
+            params.append(customer_id)
+        if agent_type:
+            clauses.append("agent_type = ?")
+            params.append(agent_type)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if cursor:
+            clauses.append("id < ?")
+            params.append(self.parse_cursor(cursor))
+        return (f" WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def query(self, customer_id: Optional[str] = None, agent_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              cursor: Optional[str] = None, limit: int = 50) -> tuple:
+        where, params = self._where(customer_id, agent_type, since, until, cursor)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, data FROM interactions{where} ORDER BY id DESC LIMIT ?", (*params, limit)
+            ).fetchall()
+        entries = [{"id": row_id, **json.loads(data)} for row_id, data in rows]
+        next_cursor = str(rows[-1][0]) if len(rows) == limit else None
+        return entries, next_cursor
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JSONLLogBackend:
+    """Append-only JSONL segments, rotated at `segment_bytes`, keeping at most `max_segments` files"""
+
+    name = "jsonl"
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, max_segments: int = 20):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self._segment_index = int(os.path.basename(segments[-1])[len("interactions-"):-len(".jsonl")]) if segments else 0
+        self._count = 0
+        for path in segments:
+            with open(path, "rb") as f:
+                self._count += sum(1 for _ in f)
+
+    def segments(self) -> list:
+        return sorted(glob.glob(os.path.join(self.directory, "interactions-*.jsonl")))
+
+    def _segment_path(self) -> str:
+        return os.path.join(self.directory, f"interactions-{self._segment_index:06d}.jsonl")
+
+    def write_batch(self, entries: list) -> None:
+        payload = "".join(json.dumps(e) + "\n" for e in entries)
+        with self._lock:
+            path = self._segment_path()
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                self._segment_index += 1
+                path = self._segment_path()
+                self._prune()
+            with open(path, "a") as f:
+                f.write(payload)
+            self._count += len(entries)
+
+    def _prune(self) -> None:
+        segments = self.segments()
+        for old in segments[:max(len(segments) + 1 - self.max_segments, 0)]:
+            with open(old, "rb") as f:
+                self._count -= sum(1 for _ in f)
+            os.remove(old)
+
+    def count(self, customer_id: Optional[str] = None, agent_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None) -> int:
+        """Kept as a running total; counting under filters scans every segment"""
+        if not (customer_id or agent_type or since or until):
+            return self._count
+        total = 0
+        for path in self.segments():
+            try:
+                with open(path) as f:
+                    total += sum(1 for line in f if _matches(json.loads(line), customer_id, agent_type, since, until))
+            except FileNotFoundError:
+                continue
+        return total
+
+    @staticmethod
+    def parse_cursor(cursor: str) -> tuple:
+        segment, line = cursor.split(":")
+        return int(segment), int(line)
+
+    @staticmethod
+    def _read_backwards(path: str, end: int, block_size: int = 64 * 1024):
+        """Yield (offset, line) newest-first for the lines before byte `end`, reading `block_size` at a time"""
+        with open(path, "rb") as f:
+            position, tail = end, b""
+            while position > 0:
+                size = min(block_size, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + tail).split(b"\n")
+                # The first piece may be the end of a line that starts in an earlier block
+                tail = lines.pop(0)
+                offset = position + len(tail) + 1
+                starts = []
+                for line in lines:
+                    starts.append(offset)
+                    offset += len(line) + 1
+                for start, line in zip(reversed(starts), reversed(lines)):
+                    if line:
+                        yield start, line
+            if tail:
+                yield 0, tail
+
+    def query(self, customer_id: Optional[str] = None, agent_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              cursor: Optional[str] = None, limit: int = 50) -> tuple:
+        """
+        Newest-first scan over the segments (unindexed). The cursor is '<segment>:<byte offset>',
+        so each page seeks straight to where the previous one stopped and reads backwards.
+        """
+        cursor_segment, cursor_offset = self.parse_cursor(cursor) if cursor else (None, None)
+        with self._lock:
+            # Sizes taken under the writer's lock only cover complete lines
+            segments = [(path, os.path.getsize(path)) for path in self.segments()]
+        entries = []
+        for path, size in reversed(segments):
+            segment = int(os.path.basename(path)[len("interactions-"):-len(".jsonl")])
+            if cursor_segment is not None and segment > cursor_segment:
+                continue
+            end = min(cursor_offset, size) if segment == cursor_segment else size
+            try:
+                for offset, line in self._read_backwards(path, end):
+                    entry = json.loads(line)
+                    if _matches(entry, customer_id, agent_type, since, until):
+                        entries.append({"id": f"{segment}:{offset}", **entry})
+                        if len(entries) == limit:
+                            return entries, f"{segment}:{offset}"
+            except FileNotFoundError:
+                # Pruned by a rotation since the listing
+                continue
+        return entries, None
+
+    def close(self) -> None:
+        pass
+
+
+class InteractionLogStore:
+    """
+    Keeps the most recent `capacity` interactions in memory and hands every entry to
+    the durable backend in batches from a background writer thread, so request
+    handlers never wait on log I/O. If the write queue fills up, entries are kept in
+    memory only. Queries flush what is still queued first, so they see every entry.
+    """
+
+    def __init__(self, capacity: int = 1000, backend=None, batch_size: int = 100,
+                 flush_interval: float = 0.5, max_pending: int = 10000):
+        self.recent_entries = deque(maxlen=capacity)
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.appended = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        # Entries handed to the writer and not yet written (or failed)
+        self._unwritten = 0
+        self._unwritten_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def append(self, entry: dict) -> None:
+        self.appended += 1
+        self.recent_entries.append((self.appended, entry))
+        if self.backend is None:
+            return
+        self._ensure_writer()
+        try:
+            with self._unwritten_lock:
+                self._queue.put_nowait(entry)
+                self._unwritten += 1
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Interaction log write queue full, entry kept in memory only")
+
+    def _ensure_writer(self) -> None:
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run_writer, name="interaction-log-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+
+    def _run_writer(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._write(batch)
+                    return
+                if isinstance(item, threading.Event):
+                    # flush(): write what is batched now instead of waiting out the interval
+                    self._write(batch)
+                    batch = []
+                    item.set()
+                    break
+                batch.append(item)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: list) -> None:
+        try:
+            self.backend.write_batch(batch)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(batch)} interactions: {e}")
+        finally:
+            with self._unwritten_lock:
+                self._unwritten -= len(batch)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait until entries already appended are in the backend (no-op when nothing is pending)"""
+        writer = self._writer
+        if self._unwritten == 0 or writer is None or not writer.is_alive():
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Persist everything still queued and stop the writer"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None and writer.is_alive():
+            self._queue.put(_STOP)
+            writer.join(timeout)
+
+    def recent(self, limit: Optional[int] = None) -> list:
+        entries = [entry for _, entry in self.recent_entries]
+        return entries if limit is None else entries[-limit:]
+
+    def query(self, customer_id: Optional[str] = None, agent_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              cursor: Optional[str] = None, limit: int = 50) -> tuple:
+        """
+        Newest-first page of interactions matching the filters, plus the cursor for the
+        next page (None on the last page). Timestamps are ISO-8601 strings.
+        """
+        if self.backend is not None:
+            self.flush()
+            return self.backend.query(customer_id, agent_type, since, until, cursor, limit)
+
+        before = int(cursor) if cursor else None
+        entries = []
+        for seq, entry in reversed(list(self.recent_entries)):
+            if before is not None and seq >= before:
+                continue
+            if _matches(entry, customer_id, agent_type, since, until):
+                entries.append({"id": seq, **entry})
+                if len(entries) == limit:
+                    return entries, str(seq)
+        return entries, None
+
+    def history(self, limit: int, page_size: int = 1000) -> list:
+        """
+        Up to `limit` most recent entries from the durable backend (the in-memory buffer
+        without one), paged so every worker reads the same shared history
+        """
+        entries, cursor = [], None
+        while len(entries) < limit:
+            page, cursor = self.query(cursor=cursor, limit=min(page_size, limit - len(entries)))
+            entries.extend(page)
+            if not cursor:
+                break
+        return entries
+
+    def validate_cursor(self, cursor: Optional[str]) -> None:
+        """Raise ValueError for a cursor query() would reject, before a response is started"""
+        if cursor:
+            if self.backend is not None:
+                self.backend.parse_cursor(cursor)
+            else:
+                int(cursor)
+
+    def count(self, customer_id: Optional[str] = None, agent_type: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None) -> int:
+        """Interactions matching the same filters as query()"""
+        if self.backend is None:
+            return sum(1 for _, entry in self.recent_entries if _matches(entry, customer_id, agent_type, since, until))
+        self.flush()
+        return self.backend.count(customer_id, agent_type, since, until)
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name if self.backend is not None else "memory",
+            "in_memory": len(self.recent_entries),
+            "capacity": self.recent_entries.maxlen,
+            "appended": self.appended,
+            "pending_writes": self._queue.qsize(),
+            "dropped_writes": self.dropped
+        }
+
+
+def create_log_store(name: str) -> InteractionLogStore:
+    """
+    Build the store from LOG_STORE_* environment variables (backend: memory | sqlite | jsonl).
+    Without LOG_STORE_PATH, data goes to `<name>.db` (sqlite) or `<name>_logs/` (jsonl).
+    """
+    backend_name = os.getenv("LOG_STORE_BACKEND", "sqlite").lower()
+    path = os.getenv("LOG_STORE_PATH")
+    if backend_name == "sqlite":
+        backend = SQLiteLogBackend(path or f"{name}.db")
+    elif backend_name == "jsonl":
+        backend = JSONLLogBackend(
+            path or f"{name}_logs",
+            segment_bytes=int(os.getenv("LOG_STORE_SEGMENT_BYTES", str(64 * 1024 * 1024))),
+            max_segments=int(os.getenv("LOG_STORE_MAX_SEGMENTS", "20"))
+        )
+    else:
+        backend = None
+    logger.info(f"Interaction log store: {backend_name}")
+    return InteractionLogStore(capacity=int(os.getenv("LOG_STORE_MEMORY_CAPACITY", "1000")), backend=backend)
@@ -0,0 +1,259 @@
+# Stage timing spans, counters and Prometheus text exposition, plus per-request trace IDs
+
+import bisect
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_trace_id = ContextVar("trace_id", default="-")
+
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0.0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class _Series:
+    __slots__ = ("counts", "total", "count", "recent")
+
+    def __init__(self, buckets: int, window: int):
+        self.counts = [0] * (buckets + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+
+class Histogram:
+    """
+    Cumulative Prometheus buckets, plus p50/p95/p99 over the last `window` observations
+    (exported as `<name>_quantile`) so dashboards without histogram_quantile still get them.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS, window: int = 2048):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(len(self.buckets), self.window)
+            series.counts[bisect.bisect_left(self.buckets, value)] += 1
+            series.total += value
+            series.count += 1
+            series.recent.append(value)
+
+    def quantiles(self, **labels) -> dict:
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labels))
+        if series is None or not series.recent:
+            return {}
+        ordered = sorted(series.recent)
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+    def snapshot(self) -> dict:
+        """{label values: {"count", "sum", "p50", "p95", "p99"}} for every series, e.g. for benchmark reports"""
+        with self._lock:
+            keys = list(self._series)
+        snapshot = {}
+        for key in keys:
+            series = self._series[key]
+            quantiles = self.quantiles(**dict(zip(self.labels, key)))
+            snapshot[",".join(map(str, key))] = {
+                "count": series.count,
+                "sum": series.total,
+                **{f"p{round(q * 100)}": value for q, value in quantiles.items()}
+            }
+        return snapshot
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        quantile_lines = [f"# HELP {self.name}_quantile {self.help_text} (recent quantiles)", f"# TYPE {self.name}_quantile gauge"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), series.counts):
+                    cumulative += count
+                    bucket_labels = _label_text(self.labels, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series.total}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series.count}")
+                ordered = sorted(series.recent)
+                for q in QUANTILES:
+                    value = ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+                    quantile_labels = _label_text(self.labels, key, f'quantile="{q}"')
+                    quantile_lines.append(f"{self.name}_quantile{quantile_labels} {value}")
+        return lines + quantile_lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "agent"):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = {}
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        metric = Counter(f"{self.prefix}_{name}", help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), **kwargs) -> Histogram:
+        metric = Histogram(f"{self.prefix}_{name}", help_text, labels, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, name: str, stats: Callable[[], dict]) -> None:
+        """Export every numeric field of an existing `stats()` dict as `<prefix>_<name>_<field>`
+
+        Nested dicts (one entry per upstream, say) are exported as `<prefix>_<name>_<key>_<field>`.
+        """
+        self._collectors[name] = stats
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, stats in self._collectors.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.warning(f"Metrics collector '{name}' failed: {e}")
+                continue
+            for field, value in values.items():
+                nested = value.items() if isinstance(value, dict) else [(None, value)]
+                for subfield, subvalue in nested:
+                    if isinstance(subvalue, (int, float)) and not isinstance(subvalue, bool):
+                        metric = f"{self.prefix}_{name}_{field}" + (f"_{subfield}" if subfield else "")
+                        lines.extend([f"# TYPE {metric} untyped", f"{metric} {subvalue}"])
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("stage_duration_seconds", "Time spent in each pipeline stage", ("stage",))
+REQUEST_SECONDS = registry.histogram("request_duration_seconds", "HTTP request time until response headers are sent", ("path", "status"))
+CACHE_EVENTS = registry.counter("cache_events_total", "Cache lookups by cache and result", ("cache", "result"))
+FALLBACKS = registry.counter("fallbacks_total", "Degraded results served instead of the primary path", ("stage", "reason"))
+ERRORS = registry.counter("errors_total", "Failed stage calls", ("stage",))
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block into the stage histogram; an exception escaping it counts as a stage error"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug(f"Stage {stage} took {elapsed * 1000:.1f}ms")
+
+
+def timed(stage: str):
+    """Decorator form of span() for plain functions, coroutines and async generators"""
+    def decorate(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(stage):
+                    async for item in func(*args, **kwargs):
+                        yield item
+        elif inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(stage):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count_cache(cache: str, hit: bool) -> None:
+    CACHE_EVENTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def count_fallback(stage: str, reason: str) -> None:
+    FALLBACKS.inc(stage=stage, reason=reason)
+
+
+def count_error(stage: str) -> None:
+    ERRORS.inc(stage=stage)
+
+
+def start_trace(trace_id: Optional[str] = None) -> str:
+    """Set the trace ID for the current request (taken from X-Request-ID when the caller sends one)"""
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def current_trace_id() -> str:
+    return _trace_id.get()
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get()
+        return True
+
+
+def install_trace_logging() -> bool:
+    """With TRACE_IDS_ENABLED=true, prefix every log line with the current request's trace ID"""
+    if os.getenv("TRACE_IDS_ENABLED", "false").lower() != "true":
+        return False
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s")
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+        handler.setFormatter(formatter)
+    return True
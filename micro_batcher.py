@@ -0,0 +1,90 @@
+# Micro-batching: coalesce concurrent single-item calls into one batched call
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects items submitted within `window_seconds` of the first pending item (or
+    until `max_batch_size` items are waiting) and processes them with a single
+    `process_batch(items) -> results` call. Each submitter gets its own result back.
+    """
+
+    def __init__(self, process_batch: Callable[[list], Awaitable[list]], max_batch_size: int = 16,
+                 window_seconds: float = 0.01, name: str = "batch"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self.name = name
+        self._pending = []
+        self._timer = None
+        # Strong references to in-flight batches; the loop itself only keeps weak ones
+        self._running = set()
+        self.batches = 0
+        self.items = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.batch_seconds_total = 0.0
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window_seconds, self._flush_now)
+        return await future
+
+    def _flush_now(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.window_seconds, self._flush_now)
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list) -> None:
+        started = time.perf_counter()
+        waits = [started - submitted for _, _, submitted in batch]
+        self.batches += 1
+        self.items += len(batch)
+        self.wait_seconds_total += sum(waits)
+        self.wait_seconds_max = max(self.wait_seconds_max, *waits)
+        try:
+            results = await self.process_batch([item for item, _, _ in batch])
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            for _, future, _ in batch[len(results):]:
+                if not future.done():
+                    future.set_exception(ValueError(f"Micro-batch '{self.name}' returned too few results"))
+        except Exception as e:
+            logger.error(f"Micro-batch '{self.name}' failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.batch_seconds_total += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "in_flight": len(self._running),
+            "window_ms": self.window_seconds * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "fill_rate": self.items / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            "avg_added_latency_ms": self.wait_seconds_total / self.items * 1000 if self.items else 0.0,
+            "max_added_latency_ms": self.wait_seconds_max * 1000,
+            "avg_batch_call_ms": self.batch_seconds_total / self.batches * 1000 if self.batches else 0.0
+        }
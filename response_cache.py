@@ -0,0 +1,292 @@
+# Response cache keyed on (agent role, normalized message, context fingerprint)
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^a-z0-9\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
+
+
+def context_fingerprint(context: str) -> str:
+    return hashlib.sha1(normalize_message(context).encode()).hexdigest()[:16]
+
+
+def char_ngrams(text: str, n: int = 3) -> set:
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def similarity(a: str, b: str) -> float:
+    """Jaccard similarity of character trigrams"""
+    grams_a, grams_b = char_ngrams(a), char_ngrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+class MemoryCacheStore:
+    """In-process LRU store bounded by total value size in bytes"""
+
+    blocking = False
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # key -> (group, message, value, size, expires_at)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry[3]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[4] < time.time():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key: str, group: str, message: str, value: str) -> None:
+        size = len(value.encode()) + len(message.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (group, message, value, size, time.time() + self.ttl_seconds)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def candidates(self, group: str, limit: int) -> list:
+        """Most recently used (message, key) pairs in a group, for similarity lookups"""
+        now = time.time()
+        with self._lock:
+            found = []
+            for key in reversed(self._entries):
+                entry_group, message, _, _, expires_at = self._entries[key]
+                if entry_group == group and expires_at >= now:
+                    found.append((message, key))
+                    if len(found) >= limit:
+                        break
+            return found
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class SQLiteCacheStore:
+    """
+    On-disk LRU store; a WAL-mode SQLite file lets several workers share one cache.
+    The size total is kept in memory and expired rows are purged every `purge_every`
+    writes, when the total is also re-read to pick up other workers' writes.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: float, purge_every: int = 200):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, grp TEXT NOT NULL, message TEXT NOT NULL, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_grp ON response_cache (grp, last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at)")
+        self._bytes = self._total()
+
+    def _total(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, size FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._bytes -= row[2]
+                return None
+            self._conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, group: str, message: str, value: str) -> None:
+        size = len(value.encode()) + len(message.encode())
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            replaced = self._conn.execute("SELECT size FROM response_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, group, message, value, size, now + self.ttl_seconds, now)
+            )
+            self._bytes += size - (replaced[0] if replaced else 0)
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,))
+                self._bytes = self._total()
+            while self._bytes > self.max_bytes:
+                row = self._conn.execute(
+                    "SELECT key, size FROM response_cache ORDER BY last_access LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    self._bytes = 0
+                    break
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (row[0],))
+                self._bytes -= row[1]
+
+    def candidates(self, group: str, limit: int) -> list:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT message, key FROM response_cache WHERE grp = ? AND expires_at >= ? "
+                "ORDER BY last_access DESC LIMIT ?",
+                (group, time.time(), limit)
+            ).fetchall()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "entries": entries, "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class ResponseCache:
+    """
+    Two-tier cache: an exact match on the normalized message, then (optionally)
+    the most similar cached message for the same role and context fingerprint.
+    A similarity_threshold of 0 disables the similarity tier.
+    """
+
+    def __init__(self, store, namespace: str, similarity_threshold: float = 0.0, max_candidates: int = 200):
+        self.store = store
+        self.namespace = namespace
+        self.similarity_threshold = similarity_threshold
+        self.max_candidates = max_candidates
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _group(self, role: str, context: str) -> str:
+        return f"{self.namespace}|{role}|{context_fingerprint(context)}"
+
+    def _key(self, group: str, normalized: str) -> str:
+        return hashlib.sha256(f"{group}|{normalized}".encode()).hexdigest()
+
+    def get(self, role: str, message: str, context: str) -> Optional[str]:
+        group = self._group(role, context)
+        normalized = normalize_message(message)
+        value = self.store.get(self._key(group, normalized))
+        if value is not None:
+            self.exact_hits += 1
+            return value
+
+        if self.similarity_threshold > 0:
+            best_key, best_score = None, self.similarity_threshold
+            for cached_message, key in self.store.candidates(group, self.max_candidates):
+                score = similarity(normalized, cached_message)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key:
+                value = self.store.get(best_key)
+                if value is not None:
+                    self.similar_hits += 1
+                    logger.info(f"Response cache similarity hit ({best_score:.2f})")
+                    return value
+
+        self.misses += 1
+        return None
+
+    def set(self, role: str, message: str, context: str, response: str) -> None:
+        group = self._group(role, context)
+        normalized = normalize_message(message)
+        self.store.put(self._key(group, normalized), group, normalized, response)
+
+    async def get_async(self, role: str, message: str, context: str) -> Optional[str]:
+        """get() off the event loop when the store does blocking I/O"""
+        if self.store.blocking:
+            return await asyncio.to_thread(self.get, role, message, context)
+        return self.get(role, message, context)
+
+    async def set_async(self, role: str, message: str, context: str, response: str) -> None:
+        if self.store.blocking:
+            await asyncio.to_thread(self.set, role, message, context, response)
+        else:
+            self.set(role, message, context, response)
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+            "similarity_threshold": self.similarity_threshold,
+            **self.store.stats()
+        }
+
+
+def create_response_cache(namespace: str, store=None) -> Optional[ResponseCache]:
+    """
+    Build the cache from RESPONSE_CACHE_* environment variables; returns None when disabled.
+    Pass another cache's `store` to share its entries budget (and SQLite file) under a new namespace.
+    """
+    backend = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+    if backend in ("off", "none", ""):
+        return None
+    if store is not None:
+        return ResponseCache(store, namespace, similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0")))
+
+    ttl_seconds = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+    max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    if backend == "sqlite":
+        store = SQLiteCacheStore(os.getenv("RESPONSE_CACHE_PATH", "response_cache.db"), max_bytes, ttl_seconds)
+    else:
+        store = MemoryCacheStore(max_bytes, ttl_seconds)
+
+    logger.info(f"Response cache enabled ({backend}) for {namespace}")
+    return ResponseCache(store, namespace, similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0")))
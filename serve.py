@@ -0,0 +1,95 @@
+# Launcher: runs an app under uvicorn with one worker process per available core
+
+import argparse
+import importlib
+import logging
+import math
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APPS = {
+    "support": ("main:app", ROOT, 8000),
+    "sales": ("main:app", os.path.join(ROOT, "Sales Agent"), 8002),
+}
+
+
+def available_cores() -> int:
+    """CPUs this process may use: the affinity mask, capped by a cgroup v2 CPU quota (containers)"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def worker_count(setting: str) -> int:
+    return available_cores() if setting == "auto" else max(1, int(setting))
+
+
+def configure_shared_state(workers: int) -> None:
+    """
+    With several workers, state each process used to keep to itself moves to files on
+    this host: the response cache and the sessions/context store in SQLite. Explicit
+    settings are left alone; in-memory stores are only warned about. The JSONL log
+    store is refused: its entry count and segment rotation are tracked per process.
+    """
+    if workers <= 1:
+        return
+    os.environ.setdefault("RESPONSE_CACHE_BACKEND", "sqlite")
+    os.environ.setdefault("SHARED_STATE_BACKEND", "sqlite")
+    for name, shared in (("RESPONSE_CACHE_BACKEND", "sqlite"), ("SHARED_STATE_BACKEND", "sqlite"), ("LOG_STORE_BACKEND", "sqlite")):
+        value = os.getenv(name, shared).lower()
+        if value == "memory":
+            logger.warning(f"{name}=memory with {workers} workers: each worker keeps its own copy")
+    if os.getenv("LOG_STORE_BACKEND", "sqlite").lower() == "jsonl":
+        raise SystemExit(f"LOG_STORE_BACKEND=jsonl supports a single worker, not {workers}; use sqlite")
+
+
+def serve(app_name: str = "support", workers: str = None, host: str = "0.0.0.0", port: int = None, app=None) -> None:
+    """
+    Run `app_name` with `workers` processes ('auto' = available cores; default WEB_WORKERS
+    or 1). A single worker serves `app` when the caller already imported it.
+    """
+    import uvicorn
+
+    app_path, app_dir, default_port = APPS[app_name]
+    count = worker_count(workers or os.getenv("WEB_WORKERS", "1"))
+    configure_shared_state(count)
+    # Workers inherit it and split the admission rate limits between them
+    os.environ["WEB_CONCURRENCY"] = str(count)
+    logger.info(f"Starting {app_name} with {count} worker process(es)")
+    if count == 1:
+        if app is None:
+            os.chdir(app_dir)
+            sys.path.insert(0, app_dir)
+            app = importlib.import_module(app_path.split(":")[0]).app
+        uvicorn.run(app, host=host, port=port or default_port)
+    else:
+        # Each worker imports the app itself, so it is passed by import string
+        os.chdir(app_dir)
+        uvicorn.run(app_path, host=host, port=port or default_port, workers=count, app_dir=app_dir)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the support or sales API, one worker per core with --workers auto")
+    parser.add_argument("app", nargs="?", choices=APPS, default="support")
+    parser.add_argument("--workers", help="Worker processes: a number or 'auto' (default: WEB_WORKERS or 1)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, help="Default 8000 (support) or 8002 (sales)")
+    args = parser.parse_args()
+    serve(args.app, args.workers, args.host, args.port)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
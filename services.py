@@ -1,141 +1,456 @@
 # LLM Integrations
 
-import google.generativeai as genai
-import requests
+import asyncio
+import json
 import os
 from dotenv import load_dotenv
 import logging
+from local_classifier import LocalIntentClassifier
+from response_cache import create_response_cache
+from context_cache import ContextCache
+from shared_state import get_shared_store
+from cpu_pool import CPU_POOL_MIN_BATCH, run_cpu
+from http_client import get_http_client, close_http_clients
+from tts import stream_speech, TTSUnavailable
+from audio_cache import create_cached_tts_backend
+from micro_batcher import MicroBatcher
+from token_budget import create_prompt_budget
+from cost_tracker import record_perplexity
+from llm_providers import create_provider
+from metrics import timed, count_cache, count_error, count_fallback
 
 load_dotenv()
 
 logging.basicConfig(level = logging.INFO, format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-if not gemini_api_key:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
+# Each stage can use its own model (LLM_CLASSIFICATION_MODEL, LLM_CONTEXT_MODEL, LLM_GENERATION_MODEL),
+# e.g. a fast, cheap one for classification and the quality model for responses
+classification_llm = create_provider("classification")
+context_llm = create_provider("context")
+generation_llm = create_provider("generation")
 
-genai.configure(api_key = gemini_api_key)
-logger.info("Gemini API key loaded successfully")
+perplexity_api_key = os.getenv("PERPLEXITY_API_KEY")
 
-gemini_model = genai.GenerativeModel('gemini-2.0-flash-lite')
+PERPLEXITY_URL = "https://api.perplexity.ai/openai/v1/chat/completions"
 
-perplexity_api_key = os.getenv("PERPLEXITY_API_KEY")
+# Pipeline mode: run classification and context retrieval concurrently, each under its own timeout
+PARALLEL_PIPELINE = os.getenv("PARALLEL_PIPELINE", "true").lower() == "true"
+CLASSIFY_TIMEOUT_SECONDS = float(os.getenv("CLASSIFY_TIMEOUT_SECONDS", "5"))
+CONTEXT_TIMEOUT_SECONDS = float(os.getenv("CONTEXT_TIMEOUT_SECONDS", "8"))
+
+# Messages classified per LLM prompt by the batch classifier
+BATCH_CLASSIFY_SIZE = int(os.getenv("BATCH_CLASSIFY_SIZE", "25"))
+
+# Micro-batching: concurrent /chat classifications arriving within the window share one LLM call
+MICRO_BATCH_ENABLED = os.getenv("MICRO_BATCH_ENABLED", "false").lower() == "true"
+MICRO_BATCH_WINDOW_MS = float(os.getenv("MICRO_BATCH_WINDOW_MS", "10"))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "16"))
+
+VALID_INTENTS = ["billing", "sales", "technical_support", "other"]
+
+# Intents handed off to a specialist router register their sub-intents here, so a single
+# classification (LLM or local) can answer with the two-level label, e.g. "sales/upgrade".
+# intent -> (sub-intent labels, the specialist's local classifier or None)
+SUB_INTENTS = {}
+
+SYSTEM_PROMPTS = {
+    "billing": "You are a billing support agent for a major telecom provider. Be helpful, professional, and concise. Explain charges clearly and offer solutions.",
+    "sales": "You are a sales agent for a major telecom provider. Help customers understand plans and benefits. Be persuasive but honest.",
+    "technical_support": "You are a technical support agent for a major telecom provider. Help customers troubleshoot issues. Provide clear, step-by-step guidance.",
+    "other": "You are a customer service agent for a major telecom provider. Help the customer efficiently and professionally."
+}
+
+# Keyword rules for the local classifier; a rule only wins when exactly one label matches
+INTENT_KEYWORD_RULES = {
+    "billing": [r"\bbill(s|ed|ing)?\b", r"\bcharge[ds]?\b", r"\brefund", r"\binvoice", r"\bautopay\b", r"\bpayment"],
+    "technical_support": [r"\bdrop(s|ped|ping)? calls?\b", r"\bno (signal|service)\b", r"\bnot working\b", r"\bwon'?t connect\b", r"\bhotspot\b", r"\boutage\b"],
+    "sales": [r"\bunlimited plan\b", r"\bnew plan\b", r"\bupgrade\b", r"\bswitch(ing)? to\b", r"\bpromotions?\b", r"\bdeals?\b"]
+}
+
+intent_classifier = LocalIntentClassifier(
+    VALID_INTENTS,
+    INTENT_KEYWORD_RULES,
+    threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.85")),
+    model_path=os.getenv("INTENT_MODEL_PATH", "intent_model.json")
+)
+
+FALLBACK_RESPONSE = "I apologize, I'm unable to process that request right now. Please try again later."
+
+response_cache = create_response_cache("support")
+prompt_budget = create_prompt_budget()
 
-def classify_intent(customer_message: str) -> str: 
+context_cache = ContextCache(
+    default_ttl=float(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600")),
+    stale_seconds=float(os.getenv("CONTEXT_CACHE_STALE_SECONDS", "86400")),
+    max_entries=int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "10000")),
+    skip_values=("Unable to retrieve context.",),
+    shared=get_shared_store(),
+    namespace="support_context"
+) if os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true" else None
+
+# Pooled keep-alive client; its circuit breaker sends lookups straight to the context model fallback while Perplexity is unhealthy
+perplexity_client = get_http_client("perplexity")
+
+# One TTS backend (and so one ElevenLabs client) per process, behind the on-disk audio cache;
+# TTS_BACKEND=stub synthesizes silence locally. The cache directory is indexed during warm-up.
+tts_backend = create_cached_tts_backend(load_index=False)
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))
+
+WARMUP_PRECONNECT = os.getenv("WARMUP_PRECONNECT", "true").lower() == "true"
+
+
+def register_warm_up(warm_up) -> None:
+    """Add this module's client warm-up steps; nothing here runs at import time"""
+    for name, provider in (("classification_llm", classification_llm), ("context_llm", context_llm), ("generation_llm", generation_llm)):
+        if provider is not None:
+            warm_up.add(name, provider.warm_up)
+    warm_up.add("tts", getattr(tts_backend, "warm_up", None))
+    if WARMUP_PRECONNECT and perplexity_api_key:
+        async def preconnect_perplexity() -> None:
+            await perplexity_client.preconnect(PERPLEXITY_URL)
+        warm_up.add("perplexity_connect", preconnect_perplexity)
+
+
+async def run_stage(stage: str, coro, timeout: float, default):
+    """Await a pipeline stage, degrading to `default` if it times out or fails"""
     try:
-        response = gemini_model.generate_content(
-            f"Classify this customer message as ONE of: billing, sales, technical_support, other."
-            f"Focus on the primary intent only."
-            f"Reply with ONLY the classification (one word). \n\n"
-            f"Message: {customer_message}"
-        )
-
-        classification = response.text.strip().lower()
-        valid_intents = ["billing", "sales", "technical_support", "other"]
-        if classification in valid_intents:
-            logger.info(f"Classified as: {classification}")
-            return classification
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Stage '{stage}' timed out after {timeout}s, using default")
+        count_fallback(stage, "timeout")
+    except Exception as e:
+        logger.error(f"Stage '{stage}' failed: {e}, using default")
+        count_error(stage)
+        count_fallback(stage, "error")
+    return default
+
+
+def register_sub_intents(intent: str, labels: list, local_classifier=None) -> None:
+    """Let classification answer `intent/<label>` for each of `labels` in the same call"""
+    SUB_INTENTS[intent] = (list(labels), local_classifier)
+    logger.info(f"Classifying {intent} sub-intents in one call: {', '.join(labels)}")
+
 
+def intent_labels() -> list:
+    """Labels the classifier may answer with: top-level intents, registered ones expanded to intent/sub-intent"""
+    labels = []
+    for intent in VALID_INTENTS:
+        if intent in SUB_INTENTS:
+            labels.extend(f"{intent}/{sub}" for sub in SUB_INTENTS[intent][0])
         else:
-            logger.warning(f"Invalid classification: {classification}, defaulting to 'other'")
+            labels.append(intent)
+    return labels
+
+
+def _is_valid_intent(label: str) -> bool:
+    # A bare top-level intent is still accepted; its router then picks the sub-intent itself
+    return label in VALID_INTENTS or label in intent_labels()
+
+
+def _classification_prompt(customer_message: str) -> str:
+    return (
+        f"Classify this customer message as ONE of: {', '.join(intent_labels())}."
+        f"Focus on the primary intent only."
+        f"Reply with ONLY the classification (one label). \n\n"
+        f"Message: {customer_message}"
+    )
+
+
+def _parse_intent(text: str) -> str:
+    classification = text.strip().lower().replace(" ", "")
+    if _is_valid_intent(classification):
+        logger.info(f"Classified as: {classification}")
+        return classification
+
+    logger.warning(f"Invalid classification: {classification}, defaulting to 'other'")
+    return "other"
+
+
+def _perplexity_request(query: str) -> dict:
+    return {
+        "model": "sonar",
+        "messages": [
+            {
+                "role": "user",
+                "content": f"Provide accurate information about: {query}\n"
+                          f"Focus on facts, not recommendations.\n"
+                          f"Keep response concise (2-3 sentences max).\n"
+                          f"Include relevant details."
+            }
+        ]
+    }
+
+
+def _parse_perplexity(result: dict) -> str:
+    return result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+
+def _context_fallback_prompt(query: str) -> str:
+    return (
+        f"Provide accurate information about: {query}\n"
+        f"Focus on facts, not recommendations.\n"
+        f"Keep response concise (2-3 sentences max).\n"
+        f"Include relevant details like account status, plan details, policies if applicable."
+    )
+
+
+def _response_prompt(agent_type: str, customer_message: str, context: str) -> str:
+    system_prompt = SYSTEM_PROMPTS.get(agent_type, SYSTEM_PROMPTS["other"])
+    instructions = "Provide a helpful, professional response."
+    context, customer_message, _ = prompt_budget.fit(system_prompt, context, customer_message, instructions)
+    return (
+        f"{system_prompt}\n\n"
+        f"Customer context: {context}\n\n"
+        f"Customer message: {customer_message}\n\n"
+        f"{instructions}"
+    )
+
+
+def _with_sub_intent(label: str, customer_message: str):
+    """
+    For an intent with sub-intents, the specialist's local classifier must also be
+    confident; otherwise None, and the single LLM call answers both levels.
+    """
+    if label not in SUB_INTENTS:
+        return label
+    sub_classifier = SUB_INTENTS[label][1]
+    sub = sub_classifier.predict(customer_message) if sub_classifier else None
+    return f"{label}/{sub[0]}" if sub else None
+
+
+def _classify_locally(customer_message: str):
+    """Local label, or None to ask the LLM"""
+    local = intent_classifier.predict(customer_message)
+    if not local:
+        return None
+    label, confidence, source = local
+    label = _with_sub_intent(label, customer_message)
+    if label:
+        logger.info(f"Classified locally as: {label} ({source}, {confidence:.2f})")
+    return label
+
+
+async def _classify_locally_many(messages: list) -> list:
+    """_classify_locally for a batch; large batches are scored in the CPU process pool"""
+    if len(messages) < CPU_POOL_MIN_BATCH:
+        return [_classify_locally(message) for message in messages]
+    results = await run_cpu(intent_classifier.predict_many, messages)
+    intent_classifier.count(results)
+    return [_with_sub_intent(result[0], message) if result else None for message, result in zip(messages, results)]
+
+
+@timed("classification")
+async def classify_intent_async(customer_message: str) -> str:
+    local_intent = _classify_locally(customer_message)
+    if local_intent:
+        return local_intent
+
+    if intent_batcher:
+        try:
+            return await intent_batcher.submit(customer_message)
+        except Exception as e:
+            logger.error(f"Intent Classification Failed: {e}")
+            count_error("classification")
+            count_fallback("classification", "default_intent")
             return "other"
-        
+
+    try:
+        response = await classification_llm.generate_async(_classification_prompt(customer_message))
+        return _parse_intent(response.text)
+
     except Exception as e:
         logger.error(f"Intent Classification Failed: {e}")
+        count_error("classification")
+        count_fallback("classification", "default_intent")
         return "other"
 
 
-def get_context_from_perplexity(query: str) -> str:
+def _batch_classification_prompt(messages: list) -> str:
+    numbered = "\n".join(f"[{i}] {' '.join(message.split())}" for i, message in enumerate(messages, 1))
+    return (
+        f"Classify each customer message below as ONE of: {', '.join(intent_labels())}."
+        f"Focus on the primary intent only."
+        f"Reply with ONLY a JSON object mapping each message number to its classification, "
+        f"e.g. {{\"1\": \"other\"}}.\n\n"
+        f"{numbered}"
+    )
+
+
+def _parse_batch_intents(text: str, count: int) -> list:
+    labels = json.loads(text)
+    intents = []
+    for i in range(1, count + 1):
+        label = str(labels.get(str(i), "")).strip().lower().replace(" ", "")
+        intents.append(label if _is_valid_intent(label) else "other")
+    return intents
+
+
+def _batch_labels(response, count: int) -> list:
+    """Labels from one batch classification response; all 'other' if the call or the parse failed"""
     try:
-        if perplexity_api_key:
+        if isinstance(response, Exception):
+            raise response
+        return _parse_batch_intents(response.text, count)
+
+    except Exception as e:
+        logger.error(f"Batch Intent Classification Failed: {e}")
+        count_error("classification")
+        count_fallback("classification", "default_intent")
+        return ["other"] * count
+
+
+async def _classify_chunk_async(messages: list) -> list:
+    responses = await classification_llm.batch([_batch_classification_prompt(messages)], json_output=True)
+    return _batch_labels(responses[0], len(messages))
+
+
+intent_batcher = MicroBatcher(
+    _classify_chunk_async,
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    window_seconds=MICRO_BATCH_WINDOW_MS / 1000,
+    name="intent"
+) if MICRO_BATCH_ENABLED else None
+
+
+@timed("classification_batch")
+async def classify_intents_batch_async(messages: list) -> list:
+    """Classify many messages: local fast path first, the rest BATCH_CLASSIFY_SIZE per LLM call"""
+    intents = await _classify_locally_many(messages)
+    pending = [i for i, intent in enumerate(intents) if intent is None]
+    if pending:
+        chunks = [pending[start:start + BATCH_CLASSIFY_SIZE] for start in range(0, len(pending), BATCH_CLASSIFY_SIZE)]
+        prompts = [_batch_classification_prompt([messages[i] for i in chunk]) for chunk in chunks]
+        responses = await classification_llm.batch(prompts, json_output=True)
+        for chunk, response in zip(chunks, responses):
+            for i, label in zip(chunk, _batch_labels(response, len(chunk))):
+                intents[i] = label
+    logger.info(f"Batch classified {len(messages)} messages ({len(pending)} via LLM)")
+    return [intent or "other" for intent in intents]
+
+
+@timed("context")
+async def get_context_from_perplexity_async(query: str) -> str:
+    if context_cache:
+        return await context_cache.get_or_fetch(query, _fetch_context_from_perplexity_async)
+    return await _fetch_context_from_perplexity_async(query)
+
+
+@timed("context_fetch")
+async def _fetch_context_from_perplexity_async(query: str) -> str:
+    try:
+        if perplexity_api_key and perplexity_client.is_available():
             try:
-                response = requests.post(
-                    "https://api.perplexity.ai/openai/v1/chat/completions",
+                response = await perplexity_client.post_async(
+                    PERPLEXITY_URL,
                     headers={"Authorization": f"Bearer {perplexity_api_key}"},
-                    json={
-                        "model": "sonar",
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": f"Provide accurate information about: {query}\n"
-                                          f"Focus on facts, not recommendations.\n"
-                                          f"Keep response concise (2-3 sentences max).\n"
-                                          f"Include relevant details."
-                            }
-                        ]
-                    }
+                    json=_perplexity_request(query)
                 )
 
                 if response.status_code == 200:
                     result = response.json()
-                    context = result.get("choices", [{}]).get("message", {}).get("content", "")
+                    record_perplexity("context", result)
+                    context = _parse_perplexity(result)
                     logger.info("Context retrieved from Perplexity")
                     return context[:500]
 
             except Exception as e:
-                logger.warning(f"Perplexity failed, falling back to Gemini: {e}")
-        
-        response = gemini_model.generate_content(
-            f"Provide accurate information about: {query}\n"
-            f"Focus on facts, not recommendations.\n"
-            f"Keep response concise (2-3 sentences max).\n"
-            f"Include relevant details like account status, plan details, policies if applicable."
-        )
+                logger.warning(f"Perplexity failed, falling back to the context model: {e}")
+
+        count_fallback("context", "llm")
+        response = await context_llm.generate_async(_context_fallback_prompt(query))
 
         context = response.text
-        logger.info("Context retrieved from Gemini (fallback)")
+        logger.info(f"Context retrieved from {context_llm.name} (fallback)")
         return context[:500]
-    
+
     except Exception as e:
         logger.error(f"Context retrieval failed: {e}")
+        count_error("context")
+        count_fallback("context", "unavailable")
         return "Unable to retrieve context."
 
 
-def generate_response(agent_type: str, customer_message: str, context: str) -> str:
-    system_prompts = {
-        "billing": "You are a billing support agent for a major telecom provider. Be helpful, professional, and concise. Explain charges clearly and offer solutions.",
-        "sales": "You are a sales agent for a major telecom provider. Help customers understand plans and benefits. Be persuasive but honest.",
-        "technical_support": "You are a technical support agent for a major telecom provider. Help customers troubleshoot issues. Provide clear, step-by-step guidance.",
-        "other": "You are a customer service agent for a major telecom provider. Help the customer efficiently and professionally."
-    }
-    
-    system_prompt = system_prompts.get(agent_type, system_prompts["other"])
-    
+async def _cached_response(agent_type: str, customer_message: str, context: str):
+    if response_cache:
+        cached = await response_cache.get_async(agent_type, customer_message, context)
+        count_cache("response", cached is not None)
+        if cached is not None:
+            logger.info(f"Response cache hit for {agent_type} agent")
+            return cached
+    return None
+
+
+@timed("generation")
+async def generate_response_async(agent_type: str, customer_message: str, context: str) -> str:
+    cached = await _cached_response(agent_type, customer_message, context)
+    if cached is not None:
+        return cached
+
     try:
-        response = gemini_model.generate_content(
-            f"{system_prompt}\n\n"
-            f"Customer context: {context}\n\n"
-            f"Customer message: {customer_message}\n\n"
-            f"Provide a helpful, professional response."
-        )
+        response = await generation_llm.generate_async(_response_prompt(agent_type, customer_message, context))
 
+        if response_cache:
+            await response_cache.set_async(agent_type, customer_message, context, response.text)
         logger.info(f"Generated response for {agent_type} agent")
         return response.text
 
     except Exception as e:
         logger.error(f"Response generation failed: {e}")
-        return "I apologize, I'm unable to process that request right now. Please try again later."
+        count_error("generation")
+        count_fallback("generation", "canned_response")
+        return FALLBACK_RESPONSE
+
 
+@timed("generation")
+async def generate_response_stream(agent_type: str, customer_message: str, context: str):
+    """Yield response text chunks as the model produces them; cached responses are yielded whole"""
+    cached = await _cached_response(agent_type, customer_message, context)
+    if cached is not None:
+        yield cached
+        return
+
+    chunks = []
+    try:
+        async for chunk in generation_llm.stream(_response_prompt(agent_type, customer_message, context)):
+            chunks.append(chunk)
+            yield chunk
 
+        if response_cache:
+            await response_cache.set_async(agent_type, customer_message, context, "".join(chunks))
+        logger.info(f"Streamed response for {agent_type} agent")
+
+    except Exception as e:
+        logger.error(f"Response streaming failed: {e}")
+        count_error("generation")
+        if not chunks:
+            count_fallback("generation", "canned_response")
+            yield FALLBACK_RESPONSE
+
+
+@timed("tts")
 def text_to_speech(text: str) -> dict:
     try:
-        elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
-        if not elevenlabs_api_key:
-            logger.warning("ELEVENLABS_API_KEY not found, TTS unavailable")
-            return {"success": False, "message": "API key not configured"}
-        
-        from elevenlabs.client import ElevenLabs
-        client = ElevenLabs(api_key=elevenlabs_api_key)
-        audio = client.generate(
-            text=text,
-            voice="Rachel",
-            model="eleven_monolingual_v1"
-        )
+        audio = tts_backend.synthesize(text)
         logger.info("Text-to-speech conversion successful")
         return {"success": True, "message": "Audio generated", "audio": audio}
-        
+
+    except TTSUnavailable as e:
+        logger.warning(f"TTS unavailable: {e}")
+        count_error("tts")
+        return {"success": False, "message": str(e)}
+
     except Exception as e:
         logger.warning(f"Text-to-speech failed: {e}")
+        count_error("tts")
         return {"success": False, "message": str(e)}
 
+
+async def text_to_speech_async(text: str) -> dict:
+    # The ElevenLabs SDK is synchronous; run it on a worker thread so the loop stays free
+    return await asyncio.to_thread(text_to_speech, text)
+
+
+def stream_text_to_speech(text_chunks):
+    """Async iterator of (sentence, audio) synthesized sentence by sentence as text arrives"""
+    return stream_speech(text_chunks, tts_backend, concurrency=TTS_CONCURRENCY)
@@ -0,0 +1,194 @@
+# Per-customer conversation memory with compact, bounded records
+
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+from shared_state import get_shared_store
+
+# Messages that lean on the previous turn rather than stating a new topic
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(and|also|so|then|but|ok(ay)?|thanks|thank you|what about|how about|what if|why|"
+    r"is (it|that|this)|does (it|that|this)|can i|could you|it|that|this)\b",
+    re.IGNORECASE
+)
+
+
+class Turn:
+    __slots__ = ("message", "response", "intent", "at")
+
+    def __init__(self, message: str, response: str, intent: str, at: float):
+        self.message = message
+        self.response = response
+        self.intent = intent
+        self.at = at
+
+
+class Session:
+    __slots__ = ("customer_id", "turns", "last_intent", "last_context", "context_at", "last_seen")
+
+    def __init__(self, customer_id: str, max_turns: int):
+        self.customer_id = customer_id
+        self.turns = deque(maxlen=max_turns)
+        self.last_intent = None
+        self.last_context = None
+        self.context_at = 0.0
+        self.last_seen = 0.0
+
+
+class SessionStore:
+    """
+    Recent turns, last intent and last context per customer_id. Turn text is truncated
+    to `max_chars`. Sessions idle for `idle_seconds` are evicted, and beyond
+    `max_sessions` the least recently active one goes first.
+
+    With a `shared` store, every recorded turn is written through, and `get` and `record`
+    pick up a newer copy written by another worker process first (last writer wins).
+    """
+
+    def __init__(self, max_turns: int = 6, max_chars: int = 500, idle_seconds: float = 1800,
+                 context_ttl: float = 300, follow_up_seconds: float = 300,
+                 max_sessions: int = 100000, shared=None, namespace: str = "sessions"):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.idle_seconds = idle_seconds
+        self.context_ttl = context_ttl
+        self.follow_up_seconds = follow_up_seconds
+        self.max_sessions = max_sessions
+        self.shared = shared
+        self.namespace = namespace
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.sticky_intents = 0
+        self.reused_contexts = 0
+        self.evicted = 0
+
+    def get(self, customer_id: str) -> Optional[Session]:
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(customer_id)
+        if self.shared:
+            record = self.shared.get(self.namespace, customer_id)
+            if record and (session is None or record["last_seen"] > session.last_seen):
+                session = self._from_record(customer_id, record)
+                with self._lock:
+                    self._sessions[customer_id] = session
+                    self._sessions.move_to_end(customer_id)
+        return session
+
+    async def get_async(self, customer_id: str) -> Optional[Session]:
+        """get() off the event loop when the shared store does blocking I/O"""
+        if self.shared:
+            return await asyncio.to_thread(self.get, customer_id)
+        return self.get(customer_id)
+
+    def _to_record(self, session: Session) -> dict:
+        return {
+            "turns": [[t.message, t.response, t.intent, t.at] for t in session.turns],
+            "last_intent": session.last_intent,
+            "last_context": session.last_context,
+            "context_at": session.context_at,
+            "last_seen": session.last_seen
+        }
+
+    def _from_record(self, customer_id: str, record: dict) -> Session:
+        session = Session(customer_id, self.max_turns)
+        session.turns.extend(Turn(*turn) for turn in record["turns"])
+        session.last_intent = record["last_intent"]
+        session.last_context = record["last_context"]
+        session.context_at = record["context_at"]
+        session.last_seen = record["last_seen"]
+        return session
+
+    def _evict_idle(self) -> None:
+        cutoff = time.time() - self.idle_seconds
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_seen >= cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def is_follow_up(self, session: Optional[Session], message: str) -> bool:
+        if session is None or session.last_intent is None:
+            return False
+        if time.time() - session.last_seen > self.follow_up_seconds:
+            return False
+        return bool(FOLLOW_UP_PATTERN.match(message))
+
+    def sticky_intent(self, session: Optional[Session], message: str,
+                      classify: Optional[Callable[[str], Optional[tuple]]] = None) -> Optional[str]:
+        """
+        The previous intent if this message reads as a follow-up to it and `classify` (the
+        local classifier) has no confident answer of its own: "Can I get the unlimited plan
+        instead?" after a connectivity question starts a new topic.
+        """
+        if not self.is_follow_up(session, message):
+            return None
+        if classify is not None and classify(message) is not None:
+            return None
+        self.sticky_intents += 1
+        return session.last_intent
+
+    def reusable_context(self, session: Optional[Session]) -> Optional[str]:
+        if session is None or session.last_context is None:
+            return None
+        if time.time() - session.context_at > self.context_ttl:
+            return None
+        self.reused_contexts += 1
+        return session.last_context
+
+    def record(self, customer_id: str, message: str, response: str, intent: str, context: str) -> None:
+        if self.shared:
+            # Append to another worker's newer copy rather than overwrite its turns
+            self.get(customer_id)
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(customer_id)
+            if session is None:
+                session = Session(customer_id, self.max_turns)
+                self._sessions[customer_id] = session
+            else:
+                self._sessions.move_to_end(customer_id)
+            session.turns.append(Turn(message[:self.max_chars], response[:self.max_chars], intent, now))
+            if context and context is not session.last_context:
+                session.last_context = context[:self.max_chars]
+                session.context_at = now
+            session.last_intent = intent
+            session.last_seen = now
+            self._evict_idle()
+            record = self._to_record(session) if self.shared else None
+        if record:
+            self.shared.put(self.namespace, customer_id, record, self.idle_seconds)
+
+    async def record_async(self, customer_id: str, message: str, response: str, intent: str, context: str) -> None:
+        if self.shared:
+            await asyncio.to_thread(self.record, customer_id, message, response, intent, context)
+        else:
+            self.record(customer_id, message, response, intent, context)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "shared_sessions": self.shared.count(self.namespace) if self.shared else 0,
+            "sticky_intents": self.sticky_intents,
+            "reused_contexts": self.reused_contexts,
+            "evicted": self.evicted
+        }
+
+
+def create_session_store(namespace: str = "sessions") -> SessionStore:
+    """Build the store from SESSION_* environment variables, shared across workers when configured"""
+    return SessionStore(
+        max_turns=int(os.getenv("SESSION_MAX_TURNS", "6")),
+        idle_seconds=float(os.getenv("SESSION_IDLE_SECONDS", "1800")),
+        context_ttl=float(os.getenv("SESSION_CONTEXT_TTL_SECONDS", "300")),
+        follow_up_seconds=float(os.getenv("SESSION_FOLLOW_UP_SECONDS", "300")),
+        max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "100000")),
+        shared=get_shared_store(),
+        namespace=namespace
+    )
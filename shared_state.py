@@ -0,0 +1,101 @@
+# Cross-process key/value state for multi-worker deployments (sessions, context cache)
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStateStore:
+    """
+    JSON values with an expiry in a WAL-mode SQLite file, so every worker process on
+    the host sees the same sessions and cached context. Keys are scoped by namespace.
+    Expired rows are ignored on read and purged every `purge_every` writes.
+    """
+
+    def __init__(self, path: str, purge_every: int = 500):
+        self.path = path
+        self.purge_every = purge_every
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.reads = 0
+        self.read_hits = 0
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+
+    def get(self, namespace: str, key: str) -> Optional[dict]:
+        with self._lock:
+            self.reads += 1
+            row = self._conn.execute(
+                "SELECT value FROM shared_state WHERE namespace = ? AND key = ? AND expires_at >= ?",
+                (namespace, key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        self.read_hits += 1
+        return json.loads(row[0])
+
+    def put(self, namespace: str, key: str, value: dict, ttl_seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_state VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), now + ttl_seconds)
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._conn.execute("DELETE FROM shared_state WHERE expires_at < ?", (now,))
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM shared_state WHERE namespace = ? AND expires_at >= ?",
+                (namespace, time.time())
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "reads": self.reads,
+            "read_hits": self.read_hits,
+            "writes": self._writes
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_shared_store() -> Optional[SharedStateStore]:
+    """
+    The process-wide store when SHARED_STATE_BACKEND=sqlite (the launcher's default with
+    more than one worker), else None and state stays in process memory.
+    """
+    global _store
+    if os.getenv("SHARED_STATE_BACKEND", "memory").lower() != "sqlite":
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SharedStateStore(os.getenv("SHARED_STATE_PATH", "shared_state.db"))
+            logger.info(f"Shared state in {_store.path}")
+    return _store
@@ -0,0 +1,40 @@
+# The modules under test live at the repository root
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Offline, in-memory and deterministic: the mock model everywhere, no caches in the way
+APP_ENV = {
+    "LLM_MODEL": "mock",
+    "LOG_STORE_BACKEND": "memory",
+    "RESPONSE_CACHE_BACKEND": "off",
+    "CONTEXT_CACHE_ENABLED": "false",
+    "AUDIO_CACHE_ENABLED": "false",
+    "ADMISSION_ENABLED": "false",
+    "WARMUP_ENABLED": "false",
+    "CPU_POOL_WORKERS": "0",
+    "LOCAL_CLASSIFIER_THRESHOLD": "1.1",
+    "INTENT_MODEL_PATH": "intent_model.json",
+    "SALES_INTENT_MODEL_PATH": "sales_intent_model.json",
+}
+
+
+@pytest.fixture(scope="session")
+def app_main(tmp_path_factory):
+    """The support app's `main` module, imported once with APP_ENV from a scratch directory"""
+    os.environ.update(APP_ENV)
+    os.chdir(tmp_path_factory.mktemp("app"))
+    return importlib.import_module("main")
+
+
+@pytest.fixture(scope="session")
+def client(app_main):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_main.app) as client:
+        yield client
@@ -0,0 +1,165 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, create_admission_controller
+
+PRIORITIES = {"billing": 0, "sales": 1, "other": 2}
+
+
+def controller(**kwargs) -> AdmissionController:
+    options = {"max_concurrent": 1, "customer_rate": 0, "priorities": PRIORITIES, "max_wait_seconds": 10.0}
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def scenario():
+        gate = controller()
+        holder = await gate.acquire(None, "other")
+        order = []
+
+        async def wait(name, intent):
+            ticket = await gate.acquire(None, intent)
+            order.append(name)
+            gate.release(ticket)
+
+        tasks = [asyncio.create_task(wait(name, intent)) for name, intent in
+                 (("other", "other"), ("sales-1", "sales/upgrade"), ("billing", "billing"), ("sales-2", "sales"))]
+        await settle()
+        assert gate.stats()["queue_depth"] == 4
+        gate.release(holder)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["billing", "sales-1", "sales-2", "other"]
+
+
+def test_full_queue_preempts_the_newest_lowest_priority_waiter():
+    async def scenario():
+        gate = controller(max_queue=2)
+        holder = await gate.acquire(None, "billing")
+        first = asyncio.create_task(gate.acquire(None, "other"))
+        second = asyncio.create_task(gate.acquire(None, "other"))
+        await settle()
+
+        with pytest.raises(AdmissionRejected) as shed:
+            await gate.acquire(None, "other")
+        assert shed.value.reason == "queue_full"
+
+        urgent = asyncio.create_task(gate.acquire(None, "billing"))
+        await settle()
+        with pytest.raises(AdmissionRejected) as preempted:
+            await second
+        assert preempted.value.reason == "preempted"
+
+        gate.release(holder)
+        ticket = await urgent
+        assert ticket.priority == 0
+        gate.release(ticket)
+        gate.release(await first)
+        return gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected_preempted"] == 1
+    assert stats["rejected_queue_full"] == 1
+    assert stats["active"] == 0 and stats["queue_depth"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue_and_a_granted_slot_is_handed_on():
+    async def scenario():
+        gate = controller()
+        holder = await gate.acquire(None, "billing")
+        cancelled = asyncio.create_task(gate.acquire(None, "billing"))
+        await settle()
+        cancelled.cancel()
+        await settle()
+        assert gate.stats()["queue_depth"] == 0
+
+        granted = asyncio.create_task(gate.acquire(None, "billing"))
+        after = asyncio.create_task(gate.acquire(None, "other"))
+        await settle()
+        # The slot is granted, but the waiter is cancelled before it resumes
+        gate.release(holder)
+        granted.cancel()
+        ticket = await after
+        assert gate.active == 1
+        gate.release(ticket)
+        return gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["active"] == 0 and stats["queue_depth"] == 0
+
+
+def test_release_is_idempotent():
+    async def scenario():
+        gate = controller(max_concurrent=2)
+        ticket = await gate.acquire(None)
+        await gate.acquire(None)
+        gate.release(ticket)
+        gate.release(ticket)
+        return gate.active
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_customer_over_their_rate_is_shed_with_retry_after():
+    async def scenario():
+        gate = controller(max_concurrent=10, customer_rate=1.0, customer_burst=2.0)
+        for _ in range(2):
+            gate.release(await gate.acquire("alice"))
+        with pytest.raises(AdmissionRejected) as shed:
+            await gate.acquire("alice")
+        # Other customers and anonymous traffic have their own (or no) bucket
+        gate.release(await gate.acquire("bob"))
+        gate.release(await gate.acquire(None))
+        return shed.value
+
+    shed = asyncio.run(scenario())
+    assert shed.reason == "customer_rate"
+    assert 0 < shed.retry_after <= 1.0
+    assert shed.retry_after_header == "1"
+
+
+def test_provider_bucket_refills_and_admits_queued_requests():
+    async def scenario():
+        gate = controller(max_concurrent=10, provider_rates={"gemini": 10.0})
+        for _ in range(10):
+            gate.release(await gate.acquire(None))
+        started = time.monotonic()
+        ticket = await gate.acquire(None)
+        waited = time.monotonic() - started
+        gate.release(ticket)
+        return waited, gate.stats()
+
+    waited, stats = asyncio.run(scenario())
+    assert 0.05 <= waited < 1.0
+    assert stats["queued"] == 1 and stats["admitted"] == 11
+
+
+def test_provider_wait_over_the_limit_is_shed_on_arrival():
+    async def scenario():
+        gate = controller(max_concurrent=10, provider_rates={"gemini": 1.0}, max_wait_seconds=0.5)
+        gate.release(await gate.acquire(None))
+        await gate.acquire(None)
+
+    with pytest.raises(AdmissionRejected) as shed:
+        asyncio.run(scenario())
+    assert shed.value.reason == "overloaded"
+
+
+def test_rates_are_split_across_workers(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.setenv("ADMISSION_CUSTOMER_RPS", "2")
+    monkeypatch.setenv("ADMISSION_CUSTOMER_BURST", "10")
+    monkeypatch.setenv("ADMISSION_PROVIDER_RPS", "gemini=20,perplexity=8")
+    gate = create_admission_controller()
+    assert gate.customer_rate == 0.5
+    assert gate.customer_burst == 2.5
+    assert {name: bucket.rate for name, bucket in gate.providers.items()} == {"gemini": 5.0, "perplexity": 2.0}
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import pytest
+
+from batch import BatchItemError, parse_batch_body, run_batch, MAX_CONCURRENCY
+
+
+def test_parse_batch_body_shapes():
+    items, concurrency = parse_batch_body(b'{"message": "a"}\nnot json\n\n{"message": "b"}\n', "application/x-ndjson")
+    assert items[0] == {"message": "a"} and isinstance(items[1], BatchItemError) and items[2] == {"message": "b"}
+    assert concurrency is None
+    assert parse_batch_body(b'{"messages": ["a"], "concurrency": 1000}', "application/json") == (["a"], MAX_CONCURRENCY)
+    with pytest.raises(ValueError):
+        parse_batch_body(b'{"messages": ["a"], "concurrency": "8"}', "application/json")
+    with pytest.raises(ValueError):
+        parse_batch_body(b'"just a string"', "application/json")
+
+
+def test_run_batch_answers_duplicates_once_in_input_order():
+    calls = {"classify": 0, "fetch": 0, "route": 0}
+
+    async def classify(texts):
+        calls["classify"] += 1
+        return ["billing" if "bill" in text else "other" for text in texts]
+
+    async def fetch(text):
+        calls["fetch"] += 1
+        return f"context for {text}"
+
+    async def route(intent, text, context):
+        calls["route"] += 1
+        # Later messages finish first; results must still come back in input order
+        await asyncio.sleep(0.01 if text == "my bill" else 0)
+        if text == "boom":
+            raise RuntimeError("generation failed")
+        return intent, f"{intent}-agent", f"answer to {text}", context
+
+    async def scenario():
+        items = [("a", "my bill"), ("b", "hello"), BatchItemError("bad line"), ("c", "my bill"), ("d", "boom")]
+        return [(index, result) async for index, _, result in run_batch(items, classify, fetch, route, concurrency=2)]
+
+    results = asyncio.run(scenario())
+    assert [index for index, _ in results] == [0, 1, 2, 3, 4]
+    assert results[0][1]["agent_type"] == "billing" and results[0][1]["response"] == "answer to my bill"
+    assert results[3][1] == results[0][1]
+    assert results[1][1]["agent_type"] == "other"
+    assert results[2][1] == {"error": "bad line"}
+    assert results[4][1] == {"error": "generation failed"}
+    assert calls == {"classify": 1, "fetch": 3, "route": 3}
+
+
+def test_batch_costs_split_duplicates_and_add_up_to_the_real_spend(client, app_main, monkeypatch):
+    import cost_tracker
+
+    # Every upstream call costs exactly 1: one batched classification, then a context
+    # lookup and a generation per unique message (no keyword rule matches these)
+    monkeypatch.setitem(cost_tracker.RATES, "mock", {"per_request": 1.0})
+    body = [{"message": message, "customer_id": "batch-cost"} for message in
+            ("hello there", "hello there", "a question", "hello there", "one more thing")]
+    response = client.post("/chat/batch", json=body)
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+
+    assert all("error" not in result for result in results)
+    assert round(sum(result["cost_estimate"] for result in results), 6) == 7.0
+    duplicate = results[0]["usage"]
+    assert duplicate["share"] == pytest.approx(1 / 3)
+    assert duplicate["total_cost"] == pytest.approx((2 + 1 / 3) / 3)
+    assert results[2]["cost_estimate"] == pytest.approx(2 + 1 / 3)
+    assert "share" not in results[2]["usage"]
+
+    customer = app_main.usage_aggregates.stats("batch-cost")["by_customer"]["batch-cost"]
+    assert customer["cost"] == pytest.approx(7.0)
+    assert customer["requests"] == 5
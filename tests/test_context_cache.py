@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+import context_cache
+from context_cache import ContextCache
+from shared_state import SharedStateStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(context_cache, "time", clock)
+    return clock
+
+
+class Upstream:
+    """fetch() that answers "<query> #<n>" and can be held open to overlap callers"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = None
+
+    async def fetch(self, query: str) -> str:
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        return f"{query} #{self.calls}"
+
+
+def test_concurrent_misses_share_one_fetch(clock):
+    cache, upstream = ContextCache(), Upstream()
+
+    async def run() -> list:
+        upstream.release = asyncio.Event()
+        callers = [asyncio.create_task(cache.get_or_fetch("Roaming fees?", upstream.fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*callers)
+
+    assert asyncio.run(run()) == ["Roaming fees? #1"] * 5
+    assert upstream.calls == 1
+    assert (cache.misses, cache.coalesced) == (1, 4)
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_fetch(clock):
+    cache, upstream = ContextCache(), Upstream()
+
+    async def run() -> str:
+        upstream.release = asyncio.Event()
+        impatient = asyncio.create_task(asyncio.wait_for(cache.get_or_fetch("outage map", upstream.fetch), 0.01))
+        patient = asyncio.create_task(cache.get_or_fetch("outage map", upstream.fetch))
+        with pytest.raises(asyncio.TimeoutError):
+            await impatient
+        upstream.release.set()
+        return await patient
+
+    assert asyncio.run(run()) == "outage map #1"
+    assert upstream.calls == 1
+
+
+def test_fresh_then_stale_then_expired(clock):
+    cache, upstream = ContextCache(default_ttl=60, stale_seconds=600), Upstream()
+
+    async def run() -> list:
+        results = [await cache.get_or_fetch("store hours", upstream.fetch)]
+        clock.now += 30
+        results.append(await cache.get_or_fetch("Store hours!", upstream.fetch))
+        # Past the TTL: the stale value comes back at once and one refresh runs behind it
+        clock.now += 60
+        results.append(await cache.get_or_fetch("store hours", upstream.fetch))
+        await asyncio.gather(*cache._background)
+        results.append(await cache.get_or_fetch("store hours", upstream.fetch))
+        # Past the stale window: a plain miss
+        clock.now += 60 + 600
+        results.append(await cache.get_or_fetch("store hours", upstream.fetch))
+        return results
+
+    assert asyncio.run(run()) == ["store hours #1", "store hours #1", "store hours #1", "store hours #2", "store hours #3"]
+    assert (cache.hits, cache.stale_hits, cache.refreshes, cache.misses) == (2, 1, 1, 2)
+
+
+def test_topic_ttls():
+    cache = ContextCache(default_ttl=3600)
+    assert cache.topic_for("Any holiday deals?") == ("promotion", 15 * 60)
+    assert cache.topic_for("Is the network down?") == ("outage", 5 * 60)
+    assert cache.topic_for("Pixel 8 specs") == ("device", 24 * 3600)
+    assert cache.topic_for("hello") == ("general", 3600)
+
+
+def test_promotions_expire_before_device_specs(clock):
+    cache, upstream = ContextCache(stale_seconds=0), Upstream()
+
+    async def run() -> None:
+        await cache.get_or_fetch("current promotions", upstream.fetch)
+        await cache.get_or_fetch("pixel specs", upstream.fetch)
+        clock.now += 15 * 60
+        await cache.get_or_fetch("current promotions", upstream.fetch)
+        await cache.get_or_fetch("pixel specs", upstream.fetch)
+
+    asyncio.run(run())
+    assert upstream.calls == 3
+
+
+def test_placeholder_values_are_not_cached(clock):
+    cache = ContextCache(skip_values=("Context unavailable.",))
+    calls = []
+
+    async def unavailable(query: str) -> str:
+        calls.append(query)
+        return "Context unavailable."
+
+    async def run() -> None:
+        for _ in range(2):
+            assert await cache.get_or_fetch("plans", unavailable) == "Context unavailable."
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_bound(clock):
+    cache, upstream = ContextCache(max_entries=2), Upstream()
+
+    async def run() -> None:
+        for query in ("a", "b", "a", "c"):
+            await cache.get_or_fetch(query, upstream.fetch)
+
+    asyncio.run(run())
+    assert set(cache._entries) == {"a", "c"}
+
+
+def test_other_workers_fetches_count_as_hits(clock, tmp_path):
+    shared = SharedStateStore(str(tmp_path / "shared.db"))
+    first, second = ContextCache(shared=shared), ContextCache(shared=shared)
+    upstream = Upstream()
+
+    async def run() -> tuple:
+        return (await first.get_or_fetch("data plans", upstream.fetch),
+                await second.get_or_fetch("data plans", upstream.fetch))
+
+    assert asyncio.run(run()) == ("data plans #1", "data plans #1")
+    assert upstream.calls == 1
+    assert second.shared_hits == 1
@@ -0,0 +1,41 @@
+import asyncio
+import sys
+
+from context_cache import ContextCache
+from response_cache import create_response_cache
+
+
+def test_hosted_sales_agent_reuses_the_host_backends(app_main):
+    services, sales_services = sys.modules["services"], sys.modules["sales_services"]
+    assert sales_services.tts_backend is services.tts_backend
+    assert sales_services.sales_context_cache is services.context_cache
+
+
+def test_sales_response_cache_shares_the_host_store(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESPONSE_CACHE_BACKEND", "sqlite")
+    monkeypatch.setenv("RESPONSE_CACHE_PATH", str(tmp_path / "cache.db"))
+    support = create_response_cache("support")
+    sales = create_response_cache("sales", support.store)
+    assert sales.store is support.store
+
+    sales.set("upgrade", "Which phone should I get?", "", "The new one.")
+    assert sales.get("upgrade", "Which phone should I get?", "") == "The new one."
+    assert support.get("upgrade", "Which phone should I get?", "") is None
+    assert support.store.stats()["entries"] == 1
+
+
+def test_context_scopes_do_not_share_entries():
+    cache = ContextCache()
+
+    async def fetch_support(query: str) -> str:
+        return "support context"
+
+    async def fetch_sales(query: str) -> str:
+        return "sales context"
+
+    async def run() -> tuple:
+        return (await cache.get_or_fetch("new phones", fetch_support),
+                await cache.get_or_fetch("new phones", fetch_sales, scope="sales"),
+                await cache.get_or_fetch("new phones", fetch_sales))
+
+    assert asyncio.run(run()) == ("support context", "sales context", "support context")
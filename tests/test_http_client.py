@@ -0,0 +1,29 @@
+from http_client import get_http_client
+from metrics import MetricsRegistry
+
+
+def test_upstream_counters_reach_health_and_metrics(client):
+    upstream = get_http_client("perplexity")
+    upstream.retries += 2
+    upstream.short_circuited += 1
+    try:
+        health = client.get("/health").json()
+        assert health["upstreams"]["perplexity"]["retries"] >= 2
+        assert health["upstreams"]["perplexity"]["circuit_state"] == "closed"
+
+        metrics = client.get("/metrics").text
+        assert "agent_http_perplexity_retries" in metrics
+        assert "agent_http_perplexity_short_circuited" in metrics
+        assert "agent_http_perplexity_circuit_open 0" in metrics
+    finally:
+        upstream.retries -= 2
+        upstream.short_circuited -= 1
+
+
+def test_nested_stats_are_flattened():
+    registry = MetricsRegistry(prefix="t")
+    registry.register_stats("http", lambda: {"a": {"retries": 3, "state": "open"}, "b": 1})
+    lines = registry.render().splitlines()
+    assert "t_http_a_retries 3" in lines
+    assert "t_http_b 1" in lines
+    assert not any("state" in line for line in lines)
@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+from local_classifier import LocalIntentClassifier
+
+LABELS = ["billing", "technical_support"]
+EXAMPLES = [("my invoice is wrong", "billing"), ("refund my payment", "billing"),
+            ("the app crashes on start", "technical_support"), ("cannot log in to the app", "technical_support")] * 5
+
+
+def test_predict_never_checks_the_model_file(tmp_path, monkeypatch):
+    classifier = LocalIntentClassifier(LABELS, {}, threshold=0.0, model_path=str(tmp_path / "model.json"),
+                                       reload_seconds=0)
+
+    def stat(path):
+        raise AssertionError("predict() touched the model file")
+
+    monkeypatch.setattr(os.path, "getmtime", stat)
+    assert classifier.predict("my invoice is wrong") is None
+
+
+def test_watch_reloads_a_model_saved_by_another_worker(tmp_path):
+    path = str(tmp_path / "model.json")
+    trainer = LocalIntentClassifier(LABELS, {}, threshold=0.0, model_path=path)
+    watcher = LocalIntentClassifier(LABELS, {}, threshold=0.0, model_path=path, reload_seconds=0.01)
+    trainer.train(EXAMPLES)
+    trainer.save()
+    assert not watcher.is_trained
+
+    async def run() -> None:
+        task = asyncio.create_task(watcher.watch())
+        for _ in range(200):
+            if watcher.is_trained:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(run())
+    assert watcher.is_trained
+    assert watcher.predict("refund my invoice payment")[0] == "billing"
@@ -0,0 +1,115 @@
+import pytest
+
+from log_store import InteractionLogStore, JSONLLogBackend, SQLiteLogBackend, parse_timestamp
+
+
+def entry(n: int, customer_id: str = "c1", agent_type: str = "billing") -> dict:
+    return {
+        "timestamp": f"2024-01-01T00:00:{n:02d}",
+        "customer_id": customer_id,
+        "customer_message": f"message {n}",
+        "agent_type": agent_type,
+        "response": f"response {n}"
+    }
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    # A long flush interval: queries must not depend on the writer's timing
+    store = InteractionLogStore(capacity=5, backend=SQLiteLogBackend(str(tmp_path / "log.db")), flush_interval=30)
+    yield store
+    store.close()
+
+
+def test_query_sees_entries_the_writer_has_not_flushed(sqlite_store):
+    for n in range(4):
+        sqlite_store.append(entry(n))
+    entries, _ = sqlite_store.query()
+    assert [e["customer_message"] for e in entries] == [f"message {n}" for n in (3, 2, 1, 0)]
+    assert sqlite_store.count() == 4
+    assert sqlite_store.stats()["pending_writes"] == 0
+
+
+def test_history_pages_past_the_in_memory_buffer(sqlite_store):
+    for n in range(12):
+        sqlite_store.append(entry(n))
+    history = sqlite_store.history(10, page_size=3)
+    assert [e["customer_message"] for e in history] == [f"message {n}" for n in range(11, 1, -1)]
+    assert len(sqlite_store.recent()) == 5
+
+
+BACKENDS = {
+    "memory": lambda tmp_path: None,
+    "sqlite": lambda tmp_path: SQLiteLogBackend(str(tmp_path / "log.db")),
+    # Small segments, so pages cross rotated files
+    "jsonl": lambda tmp_path: JSONLLogBackend(str(tmp_path / "logs"), segment_bytes=300, max_segments=100),
+}
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_cursor_pages_cover_every_match_once(tmp_path, backend):
+    store = InteractionLogStore(capacity=100, backend=BACKENDS[backend](tmp_path), batch_size=1)
+    for n in range(10):
+        store.append(entry(n, agent_type="billing" if n % 2 else "sales"))
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.query(agent_type="billing", cursor=cursor, limit=2)
+        seen.extend(e["customer_message"] for e in page)
+        if not cursor:
+            break
+    assert seen == [f"message {n}" for n in (9, 7, 5, 3, 1)]
+    assert store.count(agent_type="billing") == 5
+    assert store.count(since="2024-01-01T00:00:04", until="2024-01-01T00:00:06") == 2
+    assert store.count() == 10
+    store.close()
+
+
+def test_parse_timestamp_normalizes_and_rejects():
+    assert parse_timestamp("2024-01-01") == "2024-01-01T00:00:00"
+    assert parse_timestamp(None) is None
+    with pytest.raises(ValueError):
+        parse_timestamp("notadate")
+
+
+def test_logs_endpoint_validates_and_counts_under_filters(client):
+    for message in ("what is my bill", "my bill is wrong"):
+        assert client.post("/chat", json={"message": message, "customer_id": "logs-test"}).status_code == 200
+    assert client.get("/logs", params={"since": "notadate"}).status_code == 400
+    assert client.get("/logs", params={"cursor": "x"}).status_code == 400
+
+    first = client.get("/logs", params={"customer_id": "logs-test", "limit": 1}).json()
+    assert first["total_interactions"] == 2
+    assert first["logs"][0]["customer_message"] == "my bill is wrong"
+    second = client.get("/logs", params={"customer_id": "logs-test", "limit": 1, "cursor": first["next_cursor"]}).json()
+    assert second["total_interactions"] is None
+    assert second["logs"][0]["customer_message"] == "what is my bill"
+    assert client.get("/logs", params={"customer_id": "logs-test", "since": "2999-01-01"}).json()["total_interactions"] == 0
+
+
+def test_jsonl_pages_cross_rotated_segments(tmp_path):
+    backend = JSONLLogBackend(str(tmp_path / "logs"), segment_bytes=500, max_segments=100)
+    for n in range(40):
+        backend.write_batch([entry(n)])
+    assert len(backend.segments()) > 3
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = backend.query(cursor=cursor, limit=7)
+        seen.extend(e["customer_message"] for e in page)
+        if not cursor:
+            break
+    assert seen == [f"message {n}" for n in range(39, -1, -1)]
+
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64, 1 << 20])
+def test_jsonl_reads_backwards_in_blocks_and_resumes_at_an_offset(tmp_path, block_size):
+    path = tmp_path / "segment.jsonl"
+    lines = [("x" * (n % 23) + str(n)).encode() for n in range(200)]
+    path.write_bytes(b"\n".join(lines) + b"\n")
+    data = path.read_bytes()
+
+    read = list(JSONLLogBackend._read_backwards(str(path), len(data), block_size))
+    assert [line for _, line in read] == lines[::-1]
+    assert all(data[offset:offset + len(line)] == line for offset, line in read)
+    assert list(JSONLLogBackend._read_backwards(str(path), read[50][0], block_size)) == read[51:]
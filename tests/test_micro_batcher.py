@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+def test_concurrent_submissions_share_batches_and_get_their_own_results():
+    batches = []
+
+    async def process(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(process, max_batch_size=3, window_seconds=0.01)
+
+    async def run() -> list:
+        return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+
+    assert asyncio.run(run()) == [0, 10, 20, 30, 40]
+    assert batches == [[0, 1, 2], [3, 4]]
+    assert batcher.stats()["avg_batch_size"] == 2.5
+
+
+def test_a_failed_or_short_batch_fails_its_submitters():
+    async def short(items):
+        return items[:1]
+
+    async def broken(items):
+        raise RuntimeError("upstream down")
+
+    async def run(process) -> list:
+        batcher = MicroBatcher(process, window_seconds=0.001)
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+
+    first, second = asyncio.run(run(short))
+    assert first == "a" and isinstance(second, ValueError)
+    with pytest.raises(RuntimeError):
+        raise asyncio.run(run(broken))[0]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def bare_sales(app_main, monkeypatch):
+    """Classification answers a bare "sales"; the Sales sub-router picks "upgrade" for it"""
+    async def classify_and_fetch_context(message, customer_id=None):
+        return "sales", "context"
+
+    async def classify_sub_intent(message):
+        return "upgrade"
+
+    router, _ = app_main.router.sub_routers["sales"]
+    monkeypatch.setattr(app_main, "classify_and_fetch_context", classify_and_fetch_context)
+    monkeypatch.setitem(app_main.router.sub_routers, "sales", (router, classify_sub_intent))
+
+
+def test_split_and_join_intent_round_trip(app_main):
+    from agents import join_intent, split_intent
+
+    assert split_intent("sales/upgrade") == ("sales", "upgrade")
+    assert split_intent("billing") == ("billing", None)
+    assert join_intent("sales", "upgrade") == "sales/upgrade"
+    assert join_intent("billing", None) == "billing"
+
+
+def test_bare_sales_reports_the_sub_intent_picked_by_the_sub_router(client, app_main, bare_sales):
+    body = client.post("/chat", json={"message": "what can I get", "customer_id": "routing-chat"}).json()
+    assert (body["agent_type"], body["sub_intent"]) == ("sales", "upgrade")
+
+    logged, _ = app_main.interaction_log.query(customer_id="routing-chat")
+    assert logged[0]["sub_intent"] == "upgrade"
+
+
+def test_bare_sales_stream_reports_the_sub_intent(client, bare_sales):
+    text = client.post("/chat/stream", json={"message": "what can I get", "customer_id": "routing-stream"}).text
+    meta = next(line for line in text.splitlines() if line.startswith("data:"))
+    assert json.loads(meta[len("data:"):])["sub_intent"] == "upgrade"
+
+
+def test_bare_sales_batch_items_report_the_sub_intent(client, app_main, monkeypatch):
+    async def classify_batch(messages):
+        return ["sales"] * len(messages)
+
+    async def classify_sub_intent(message):
+        return "promotion"
+
+    router, _ = app_main.router.sub_routers["sales"]
+    monkeypatch.setattr(app_main, "classify_intents_batch_async", classify_batch)
+    monkeypatch.setitem(app_main.router.sub_routers, "sales", (router, classify_sub_intent))
+    lines = client.post("/chat/batch", json={"messages": [{"message": "any deals?", "customer_id": "routing-batch"}]}).text
+    result = json.loads(lines.splitlines()[0])
+    assert (result["agent_type"], result["sub_intent"]) == ("sales", "promotion")
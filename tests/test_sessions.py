@@ -0,0 +1,24 @@
+from sessions import SessionStore
+from shared_state import SharedStateStore
+
+
+def test_record_appends_to_a_session_started_by_another_worker(tmp_path):
+    shared = SharedStateStore(str(tmp_path / "shared.db"))
+    first, second = SessionStore(shared=shared), SessionStore(shared=shared)
+
+    first.record("c1", "my bill is wrong", "Let me check.", "billing", "billing context")
+    second.record("c1", "and the late fee?", "It is waived.", "billing", "")
+    first.record("c1", "thanks", "You're welcome.", "billing", "")
+
+    messages = [turn.message for turn in SessionStore(shared=shared).get("c1").turns]
+    assert messages == ["my bill is wrong", "and the late fee?", "thanks"]
+    assert second.get("c1").last_context == "billing context"
+
+
+def test_turns_are_truncated_and_bounded():
+    store = SessionStore(max_turns=2, max_chars=5)
+    for i in range(3):
+        store.record("c1", f"message {i}", "response", "other", "")
+    session = store.get("c1")
+    assert [turn.message for turn in session.turns] == ["messa", "messa"]
+    assert len(session.turns) == 2
@@ -0,0 +1,139 @@
+# Prompt size budgeting: token estimates per section, trimming and context dedup
+
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_PATTERN = re.compile(r"[^.!?\n]+(?:[.!?]+|\n|$)")
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+ELISION = " ... "
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini-style token estimate: about four characters per token"""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def split_sentences(text: str) -> list:
+    return [s.strip() for s in SENTENCE_PATTERN.findall(text) if s.strip()]
+
+
+def _words(text: str) -> set:
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def dedupe_context(context: str, message: str, threshold: float = 0.8) -> tuple:
+    """
+    Drop context sentences whose words are (almost) all already in the customer message,
+    e.g. Perplexity restating the question. Returns (context, sentences removed).
+    """
+    message_words = _words(message)
+    if not context or not message_words:
+        return context, 0
+    kept = []
+    for sentence in split_sentences(context):
+        words = _words(sentence)
+        if words and len(words & message_words) / len(words) >= threshold:
+            continue
+        kept.append(sentence)
+    return " ".join(kept), len(split_sentences(context)) - len(kept)
+
+
+def trim_to_budget(text: str, max_tokens: int, keep_tail: bool = False) -> str:
+    """
+    Extractive summary within `max_tokens`: whole sentences from the start, and with
+    `keep_tail` the last sentence too (where a long customer message usually asks its
+    question). Falls back to a hard cut when a single sentence is over budget.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max_tokens * 4
+    sentences = split_sentences(text)
+    tail = sentences.pop() if keep_tail and len(sentences) > 1 else ""
+    if tail and len(tail) > max_chars // 2:
+        tail = tail[-(max_chars // 2):]
+    budget = max_chars - len(tail) - (len(ELISION) if tail else 0)
+
+    head = []
+    used = 0
+    for sentence in sentences:
+        if used + len(sentence) + 1 > budget:
+            break
+        head.append(sentence)
+        used += len(sentence) + 1
+    if not head:
+        head = [text[:budget].rstrip()]
+    return ELISION.join(part for part in (" ".join(head), tail) if part)
+
+
+class PromptBudget:
+    """
+    Fits the variable prompt sections (customer message and context) into token budgets
+    and keeps running per-section token totals, so the prompt spend can be inspected.
+    """
+
+    SECTIONS = ("system", "context", "message", "instructions")
+
+    def __init__(self, max_message_tokens: int = 400, max_context_tokens: int = 125,
+                 dedupe_threshold: float = 0.8):
+        self.max_message_tokens = max_message_tokens
+        self.max_context_tokens = max_context_tokens
+        self.dedupe_threshold = dedupe_threshold
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.tokens = dict.fromkeys(self.SECTIONS, 0)
+        self.tokens_saved = 0
+        self.messages_trimmed = 0
+        self.contexts_trimmed = 0
+        self.sentences_deduped = 0
+
+    def fit(self, system_prompt: str, context: str, customer_message: str, instructions: str = "") -> tuple:
+        """Returns (context, customer_message, per-section token counts) within budget"""
+        original = estimate_tokens(context) + estimate_tokens(customer_message)
+        context, deduped = dedupe_context(context, customer_message, self.dedupe_threshold)
+        message = trim_to_budget(customer_message, self.max_message_tokens, keep_tail=True)
+        trimmed_context = trim_to_budget(context, self.max_context_tokens)
+
+        counts = {
+            "system": estimate_tokens(system_prompt),
+            "context": estimate_tokens(trimmed_context),
+            "message": estimate_tokens(message),
+            "instructions": estimate_tokens(instructions)
+        }
+        with self._lock:
+            self.prompts += 1
+            for section, count in counts.items():
+                self.tokens[section] += count
+            self.tokens_saved += original - counts["context"] - counts["message"]
+            self.messages_trimmed += message != customer_message
+            self.contexts_trimmed += trimmed_context != context
+            self.sentences_deduped += deduped
+        logger.debug(f"Prompt tokens by section: {counts}")
+        return trimmed_context, message, counts
+
+    def stats(self) -> dict:
+        total = sum(self.tokens.values())
+        return {
+            "prompts": self.prompts,
+            "max_message_tokens": self.max_message_tokens,
+            "max_context_tokens": self.max_context_tokens,
+            "tokens_by_section": dict(self.tokens),
+            "share_by_section": {s: t / total if total else 0.0 for s, t in self.tokens.items()},
+            "avg_prompt_tokens": total / self.prompts if self.prompts else 0.0,
+            "tokens_saved": self.tokens_saved,
+            "messages_trimmed": self.messages_trimmed,
+            "contexts_trimmed": self.contexts_trimmed,
+            "context_sentences_deduped": self.sentences_deduped
+        }
+
+
+def create_prompt_budget() -> PromptBudget:
+    """Build the budget from PROMPT_* environment variables"""
+    return PromptBudget(
+        max_message_tokens=int(os.getenv("PROMPT_MAX_MESSAGE_TOKENS", "400")),
+        max_context_tokens=int(os.getenv("PROMPT_MAX_CONTEXT_TOKENS", "125")),
+        dedupe_threshold=float(os.getenv("PROMPT_DEDUPE_THRESHOLD", "0.8"))
+    )
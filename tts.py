@@ -0,0 +1,159 @@
+# Text-to-speech backends and a sentence-pipelined streaming synthesizer
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from typing import AsyncIterator, Optional
+
+from cost_tracker import record_tts
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# A sentence ends at ., ! or ? (optionally followed by closing quotes/brackets) and whitespace
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+
+def split_sentences(buffer: str) -> tuple:
+    """Split off complete sentences; returns (sentences, unfinished remainder)"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(buffer):
+        sentence = buffer[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, buffer[start:]
+
+
+class TTSUnavailable(Exception):
+    """Raised when the configured TTS backend cannot be used"""
+
+
+class ElevenLabsBackend:
+    """ElevenLabs synthesis through a single client reused across calls"""
+
+    name = "elevenlabs"
+    media_type = "audio/mpeg"
+
+    def __init__(self, api_key: Optional[str], voice: str = "Rachel", model: str = "eleven_monolingual_v1"):
+        self.api_key = api_key
+        self.voice = voice
+        self.model = model
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            if not self.api_key:
+                raise TTSUnavailable("API key not configured")
+            with self._lock:
+                if self._client is None:
+                    from elevenlabs.client import ElevenLabs
+                    self._client = ElevenLabs(api_key=self.api_key)
+        return self._client
+
+    def warm_up(self) -> None:
+        if self.api_key:
+            self.client
+
+    def synthesize(self, text: str) -> bytes:
+        audio = self.client.generate(text=text, voice=self.voice, model=self.model)
+        record_tts(self.model, len(text))
+        # Newer SDKs return an iterator of chunks rather than bytes
+        return audio if isinstance(audio, bytes) else b"".join(audio)
+
+
+class StubTTSBackend:
+    """
+    Deterministic local backend for tests and benchmarks: returns raw 16 kHz mono
+    16-bit PCM silence sized to the text, so chunks concatenate into valid audio
+    """
+
+    name = "stub"
+    media_type = "audio/L16;rate=16000"
+    voice = "stub"
+    model = "stub"
+
+    def __init__(self, latency_seconds: float = 0.0, seconds_per_word: float = 0.3):
+        self.latency_seconds = latency_seconds
+        self.seconds_per_word = seconds_per_word
+
+    def synthesize(self, text: str) -> bytes:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        samples = int(16000 * self.seconds_per_word * max(len(text.split()), 1))
+        return b"\x00\x00" * samples
+
+
+def create_tts_backend():
+    """Pick the backend from TTS_BACKEND (elevenlabs | stub)"""
+    backend = os.getenv("TTS_BACKEND", "elevenlabs").lower()
+    if backend == "stub":
+        return StubTTSBackend(latency_seconds=float(os.getenv("TTS_STUB_LATENCY_SECONDS", "0")))
+    return ElevenLabsBackend(
+        os.getenv("ELEVENLABS_API_KEY"),
+        voice=os.getenv("TTS_VOICE", "Rachel"),
+        model=os.getenv("TTS_MODEL", "eleven_monolingual_v1")
+    )
+
+
+async def stream_speech(text_chunks: AsyncIterator[str], backend, concurrency: int = 4) -> AsyncIterator[tuple]:
+    """
+    Yield (sentence, audio) in order while text is still arriving.
+
+    Each complete sentence is handed to the backend as soon as it is seen, with up to
+    `concurrency` syntheses in flight, so the first audio is ready after roughly one
+    sentence of generation plus one sentence of synthesis. Sentences whose synthesis
+    fails are logged and skipped.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+
+    async def synthesize(sentence: str) -> bytes:
+        async with semaphore:
+            with span("tts_sentence"):
+                return await asyncio.to_thread(backend.synthesize, sentence)
+
+    async def produce() -> None:
+        try:
+            buffer = ""
+            async for chunk in text_chunks:
+                buffer += chunk
+                sentences, buffer = split_sentences(buffer)
+                for sentence in sentences:
+                    await queue.put((sentence, asyncio.create_task(synthesize(sentence))))
+            if buffer.strip():
+                sentence = buffer.strip()
+                await queue.put((sentence, asyncio.create_task(synthesize(sentence))))
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    pending = []
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            sentence, task = item
+            pending.append(task)
+            try:
+                audio = await task
+            except Exception as e:
+                logger.warning(f"Text-to-speech failed for sentence: {e}")
+                continue
+            yield sentence, audio
+        await producer
+    finally:
+        producer.cancel()
+        while not queue.empty():
+            item = queue.get_nowait()
+            if item:
+                pending.append(item[1])
+        for task in pending:
+            task.cancel()
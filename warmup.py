@@ -0,0 +1,89 @@
+# Background warm-up of upstream clients once the app is serving
+
+import asyncio
+import inspect
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WarmUp:
+    """
+    Runs named warm-up steps (SDK imports, client construction, connection pre-opening)
+    concurrently in the background after startup, sync steps in worker threads. Steps are
+    optional: a failure is logged and the client is still built lazily on first use.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.steps = {}
+        self.results = {}
+        self.started_at = None
+        self.finished_at = None
+        self._task = None
+
+    def add(self, name: str, step: Optional[Callable]) -> None:
+        if step is not None:
+            self.steps[name] = step
+
+    async def _run_step(self, name: str, step: Callable) -> None:
+        started = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(step):
+                await step()
+            else:
+                await asyncio.to_thread(step)
+            status = "ok"
+        except Exception as e:
+            logger.warning(f"Warm-up step {name} failed: {e}")
+            status = "failed"
+        self.results[name] = {"status": status, "seconds": round(time.perf_counter() - started, 4)}
+
+    async def _run(self) -> None:
+        await asyncio.gather(*[self._run_step(name, step) for name, step in self.steps.items()])
+        self.finished_at = time.time()
+        logger.info(f"Warm-up finished in {self.finished_at - self.started_at:.2f}s: {self.results}")
+
+    def start(self) -> Optional[asyncio.Task]:
+        """Schedule the steps on the running loop and return immediately"""
+        if not self.enabled or not self.steps:
+            return None
+        self.started_at = time.time()
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        if self._task is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def cancel(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "done": self.done,
+            "duration_seconds": round(self.finished_at - self.started_at, 4) if self.done else 0.0,
+            "steps": dict(self.results)
+        }
+
+
+def create_warm_up() -> WarmUp:
+    return WarmUp(enabled=os.getenv("WARMUP_ENABLED", "true").lower() == "true")